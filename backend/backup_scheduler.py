@@ -19,8 +19,11 @@ async def main():
     
     try:
         while True:
-            # Cleanup old backups daily
-            await backup_manager.cleanup_old_backups()
+            # Prune expired backups daily
+            try:
+                await backup_manager.prune_backups()
+            except Exception as e:
+                logger.error(f"Error pruning backups: {e}")
             await asyncio.sleep(86400)  # 24 hours
     except KeyboardInterrupt:
         logger.info("Backup scheduler stopped")
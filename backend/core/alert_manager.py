@@ -1,46 +1,83 @@
+import time
 import asyncio
 import logging
-import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from sqlalchemy.orm import Session
+from fastapi import Request
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from .websocket_manager import WebSocketManager
-from .database import Alert, AlertHistory, SessionLocal, get_db
+from .metrics_sampler import MetricsSampler, MetricsSnapshot
+from .alert_rules import MetricWindows, RulePlan
+from .monitoring_service import MonitoringService
+from .write_buffer import WriteBehindBuffer
+from .notifications import NotificationDispatcher
+from .database import Alert, AlertHistory, AsyncReadSessionLocal, AsyncSessionLocal
 
 logger = logging.getLogger(__name__)
 
 class AlertManager:
     """Alert management and notification system"""
     
-    def __init__(self, websocket_manager: WebSocketManager, check_interval: int = 60):
+    def __init__(
+        self,
+        websocket_manager: WebSocketManager,
+        check_interval: int = 5,
+        monitoring_service: Optional[MonitoringService] = None,
+        write_buffer: Optional[WriteBehindBuffer] = None,
+        rules_refresh_interval: float = 300,
+        notifier: Optional[NotificationDispatcher] = None
+    ):
         self.websocket_manager = websocket_manager
         self.check_interval = check_interval
+        self.monitoring_service = monitoring_service
+        # Standalone alert managers (no monitoring service) sample on their own
+        self.sampler = MetricsSampler() if monitoring_service is None else None
+        self._owns_write_buffer = write_buffer is None
+        self.write_buffer = write_buffer or WriteBehindBuffer()
+        # Compiled rules, rebuilt on invalidate_rules() or after the refresh
+        # interval so edits made by other workers are picked up too
+        self.rules_refresh_interval = rules_refresh_interval
+        self._plan: Optional[RulePlan] = None
+        self._plan_loaded_at = 0.0
+        # Recent samples for windowed functions, fed on every collected snapshot
+        self.windows = MetricWindows()
+        self._sample_ready = asyncio.Event()
+        # alert id -> sample time its condition started holding (for duration)
+        self._pending_since: Dict[int, float] = {}
         self.running = False
         self.task: Optional[asyncio.Task] = None
-        self.active_alerts: Dict[str, dict] = {}
-        self.notification_channels: Dict[str, dict] = {
-            "email": {"enabled": False, "config": {}},
-            "slack": {"enabled": False, "config": {}},
-            "discord": {"enabled": False, "config": {}},
-            "webhook": {"enabled": False, "config": {}},
-            "sms": {"enabled": False, "config": {}}
-        }
+        self.active_alerts: Dict[int, dict] = {}  # by alert id; names need not be unique
+        self._owns_notifier = notifier is None
+        self.notifier = notifier or NotificationDispatcher()
     
     async def start(self):
         """Start alert manager"""
         self.running = True
+        if self._owns_write_buffer:
+            self.write_buffer.start()
+        if self._owns_notifier:
+            await self.notifier.start()
+        if self.monitoring_service is not None:
+            self.monitoring_service.add_listener(self._on_snapshot)
         self.task = asyncio.create_task(self._alert_loop())
         logger.info("Alert manager started")
     
     async def stop(self):
         """Stop alert manager"""
         self.running = False
+        if self.monitoring_service is not None:
+            self.monitoring_service.remove_listener(self._on_snapshot)
         if self.task:
             self.task.cancel()
             try:
                 await self.task
             except asyncio.CancelledError:
                 pass
+        if self._owns_notifier:
+            await self.notifier.stop()
+        if self._owns_write_buffer:
+            await asyncio.to_thread(self.write_buffer.stop)
         logger.info("Alert manager stopped")
     
     def is_running(self) -> bool:
@@ -48,122 +85,115 @@ class AlertManager:
         return self.running and (self.task is not None and not self.task.done())
     
     async def _alert_loop(self):
-        """Main alert checking loop"""
+        """Main alert checking loop, run once per metrics sample"""
         while self.running:
             try:
-                await self._check_alerts()
-                await asyncio.sleep(self.check_interval)
+                if self.monitoring_service is not None:
+                    # The monitoring loop signals each new sample
+                    try:
+                        await asyncio.wait_for(self._sample_ready.wait(), self.check_interval * 2)
+                    except asyncio.TimeoutError:
+                        continue
+                    self._sample_ready.clear()
+                    await self._check_alerts()
+                else:
+                    self._on_snapshot(await self.sampler.refresh())
+                    await self._check_alerts()
+                    await asyncio.sleep(self.check_interval)
             except Exception as e:
                 logger.error(f"Error in alert loop: {e}")
                 await asyncio.sleep(self.check_interval)
     
-    async def _check_alerts(self):
-        """Check all alert rules"""
-        try:
-            db = SessionLocal()
-            try:
-                alerts = db.query(Alert).filter(Alert.is_active == True).all()
-                
-                for alert in alerts:
-                    triggered = await self._evaluate_alert(alert)
-                    
-                    if triggered and alert.name not in self.active_alerts:
-                        # Alert triggered
-                        await self._trigger_alert(db, alert)
-                    elif not triggered and alert.name in self.active_alerts:
-                        # Alert resolved
-                        await self._resolve_alert(db, alert)
-                        
-            finally:
-                db.close()
-        except Exception as e:
-            logger.error(f"Error checking alerts: {e}")
+    def _on_snapshot(self, snapshot: MetricsSnapshot):
+        """Feed a metrics sample into the alert windows"""
+        self.windows.ingest(snapshot.sampled_at, snapshot.values)
+        self._sample_ready.set()
+    
+    def invalidate_rules(self):
+        """Drop the compiled rule plan so it is rebuilt on the next check"""
+        self._plan = None
     
-    async def _evaluate_alert(self, alert: Alert) -> bool:
-        """Evaluate an alert condition"""
+    async def _load_plan(self) -> RulePlan:
+        """Compile all active alert rules"""
+        async with AsyncReadSessionLocal() as db:
+            alerts = (await db.execute(select(Alert).where(Alert.is_active == True))).scalars().all()
+        return RulePlan.compile(alerts)
+    
+    async def _get_plan(self) -> RulePlan:
+        """Get the compiled rule plan, recompiling it if invalidated or stale"""
+        now = time.monotonic()
+        if self._plan is None or now - self._plan_loaded_at >= self.rules_refresh_interval:
+            self._plan = await self._load_plan()
+            self._plan_loaded_at = now
+            self.windows.configure(self._plan.series)
+            # Forget state of rules that were deleted or disabled
+            ids = {rule.alert_id for rule in self._plan.rules}
+            for alert_id in [alert_id for alert_id in self.active_alerts if alert_id not in ids]:
+                del self.active_alerts[alert_id]
+            for alert_id in [alert_id for alert_id in self._pending_since if alert_id not in ids]:
+                del self._pending_since[alert_id]
+            logger.debug(f"Compiled {len(self._plan)} alert rules")
+        return self._plan
+    
+    async def _check_alerts(self):
+        """Check all alert rules against the latest metric windows"""
         try:
-            condition = json.loads(alert.condition)
-            metric = condition.get("metric")
-            operator = condition.get("operator")
-            threshold = condition.get("threshold")
-            duration = condition.get("duration", 0)
-            
-            # Get current metric value
-            current_value = await self._get_metric_value(metric)
-            
-            if current_value is None:
-                return False
+            plan = await self._get_plan()
+            if not len(plan) or self.windows.timestamp is None:
+                return
             
-            # Evaluate condition
-            triggered = False
-            if operator == "gt":
-                triggered = current_value > threshold
-            elif operator == "gte":
-                triggered = current_value >= threshold
-            elif operator == "lt":
-                triggered = current_value < threshold
-            elif operator == "lte":
-                triggered = current_value <= threshold
-            elif operator == "eq":
-                triggered = current_value == threshold
-            elif operator == "neq":
-                triggered = current_value != threshold
+            now = self.windows.timestamp
+            triggered = plan.evaluate(self.windows.values())
             
-            return triggered
+            # Only rules changing state need the database
+            transitions = []
+            for index, rule in enumerate(plan.rules):
+                if index in triggered:
+                    # Fire once the condition has held for the rule's duration
+                    since = self._pending_since.setdefault(rule.alert_id, now)
+                    if rule.alert_id not in self.active_alerts and now - since >= rule.duration:
+                        transitions.append((rule, True))
+                else:
+                    self._pending_since.pop(rule.alert_id, None)
+                    if rule.alert_id in self.active_alerts:
+                        transitions.append((rule, False))
+            if not transitions:
+                return
             
+            async with AsyncSessionLocal() as db:
+                for rule, firing in transitions:
+                    alert = await db.get(Alert, rule.alert_id)
+                    if alert is None:
+                        # Deleted elsewhere; pick that up on the next check
+                        self.invalidate_rules()
+                        continue
+                    if firing:
+                        await self._trigger_alert(db, alert)
+                    else:
+                        await self._resolve_alert(db, alert)
         except Exception as e:
-            logger.error(f"Error evaluating alert {alert.name}: {e}")
-            return False
-    
-    async def _get_metric_value(self, metric: str) -> Optional[float]:
-        """Get current value for a metric"""
-        import psutil
-        
-        try:
-            if metric == "cpu_percent":
-                return psutil.cpu_percent(interval=1)
-            elif metric == "memory_percent":
-                return psutil.virtual_memory().percent
-            elif metric == "disk_percent":
-                return psutil.disk_usage('/').percent
-            elif metric == "load_avg_1":
-                return psutil.getloadavg()[0]
-            elif metric == "load_avg_5":
-                return psutil.getloadavg()[1]
-            elif metric == "load_avg_15":
-                return psutil.getloadavg()[2]
-            elif metric.startswith("disk_io_"):
-                io = psutil.disk_io_counters()
-                if io:
-                    return getattr(io, metric.replace("disk_io_", ""), None)
-            elif metric.startswith("net_"):
-                net = psutil.net_io_counters()
-                if net:
-                    return getattr(net, metric.replace("net_", ""), None)
-            return None
-        except Exception as e:
-            logger.error(f"Error getting metric {metric}: {e}")
-            return None
+            logger.error(f"Error checking alerts: {e}")
     
-    async def _trigger_alert(self, db: Session, alert: Alert):
+    async def _trigger_alert(self, db: AsyncSession, alert: Alert):
         """Handle alert trigger"""
         try:
             # Update alert
             alert.triggered_at = datetime.utcnow()
-            db.commit()
+            await db.commit()
             
-            # Add to history
-            history = AlertHistory(
-                alert_id=alert.id,
-                triggered_at=datetime.utcnow(),
-                message=f"Alert triggered: {alert.name}",
-                severity=alert.severity
+            # Add to history (written behind, flushed before resolution)
+            await self.write_buffer.put(
+                AlertHistory,
+                {
+                    "alert_id": alert.id,
+                    "triggered_at": alert.triggered_at,
+                    "message": f"Alert triggered: {alert.name}",
+                    "severity": alert.severity
+                }
             )
-            db.add(history)
-            db.commit()
             
             # Add to active alerts
-            self.active_alerts[alert.name] = {
+            self.active_alerts[alert.id] = {
                 "id": alert.id,
                 "name": alert.name,
                 "severity": alert.severity,
@@ -194,26 +224,30 @@ class AlertManager:
         except Exception as e:
             logger.error(f"Error triggering alert {alert.name}: {e}")
     
-    async def _resolve_alert(self, db: Session, alert: Alert):
+    async def _resolve_alert(self, db: AsyncSession, alert: Alert):
         """Handle alert resolution"""
         try:
             # Update alert
             alert.resolved_at = datetime.utcnow()
-            db.commit()
+            await db.commit()
+            
+            # Make sure the trigger's history row has been written
+            await self.write_buffer.flush_async()
             
             # Update history
-            history = db.query(AlertHistory).filter(
-                AlertHistory.alert_id == alert.id,
-                AlertHistory.resolved_at.is_(None)
-            ).order_by(AlertHistory.triggered_at.desc()).first()
+            history = (await db.execute(
+                select(AlertHistory).where(
+                    AlertHistory.alert_id == alert.id,
+                    AlertHistory.resolved_at.is_(None)
+                ).order_by(AlertHistory.triggered_at.desc()).limit(1)
+            )).scalar_one_or_none()
             
             if history:
                 history.resolved_at = datetime.utcnow()
-                db.commit()
+                await db.commit()
             
             # Remove from active alerts
-            if alert.name in self.active_alerts:
-                del self.active_alerts[alert.name]
+            self.active_alerts.pop(alert.id, None)
             
             # Send WebSocket notification
             await self.websocket_manager.broadcast(
@@ -234,41 +268,39 @@ class AlertManager:
             logger.error(f"Error resolving alert {alert.name}: {e}")
     
     async def _send_notifications(self, alert: Alert, status: str):
-        """Send notifications through configured channels"""
-        channels = alert.notification_channels or []
-        
-        for channel in channels:
-            try:
-                if channel == "email" and self.notification_channels["email"]["enabled"]:
-                    await self._send_email_notification(alert, status)
-                elif channel == "slack" and self.notification_channels["slack"]["enabled"]:
-                    await self._send_slack_notification(alert, status)
-                elif channel == "discord" and self.notification_channels["discord"]["enabled"]:
-                    await self._send_discord_notification(alert, status)
-                elif channel == "webhook" and self.notification_channels["webhook"]["enabled"]:
-                    await self._send_webhook_notification(alert, status)
-            except Exception as e:
-                logger.error(f"Error sending {channel} notification: {e}")
-    
-    async def _send_email_notification(self, alert: Alert, status: str):
-        """Send email notification"""
-        # Implementation for email notifications
-        pass
-    
-    async def _send_slack_notification(self, alert: Alert, status: str):
-        """Send Slack notification"""
-        # Implementation for Slack notifications
-        pass
-    
-    async def _send_discord_notification(self, alert: Alert, status: str):
-        """Send Discord notification"""
-        # Implementation for Discord notifications
-        pass
+        """Hand notifications to the dispatcher without waiting for delivery"""
+        for channel in alert.notification_channels or []:
+            self.notifier.notify(
+                channel,
+                {
+                    "id": alert.id,
+                    "name": alert.name,
+                    "severity": alert.severity,
+                    "message": alert.description
+                },
+                status
+            )
     
-    async def _send_webhook_notification(self, alert: Alert, status: str):
-        """Send webhook notification"""
-        # Implementation for webhook notifications
-        pass
+    async def delete_alert(self, db: AsyncSession, alert_id: int) -> bool:
+        """Delete an alert rule, resolving its open history in the same transaction; False if not found"""
+        # The trigger's history row may still be buffered; flushed before db
+        # begins its transaction, which on SQLite holds the write lock
+        await self.write_buffer.flush_async()
+        alert = await db.get(Alert, alert_id)
+        if alert is None:
+            return False
+        await db.execute(
+            update(AlertHistory).where(
+                AlertHistory.alert_id == alert_id,
+                AlertHistory.resolved_at.is_(None)
+            ).values(resolved_at=datetime.utcnow())
+        )
+        await db.delete(alert)
+        await db.commit()
+        self.active_alerts.pop(alert_id, None)
+        self._pending_since.pop(alert_id, None)
+        self.invalidate_rules()
+        return True
     
     def get_active_alerts(self) -> List[dict]:
         """Get list of active alerts"""
@@ -276,8 +308,8 @@ class AlertManager:
     
     def configure_notification_channel(self, channel: str, config: dict):
         """Configure a notification channel"""
-        if channel in self.notification_channels:
-            self.notification_channels[channel]["enabled"] = config.get("enabled", False)
-            self.notification_channels[channel]["config"] = config.get("settings", {})
-            return True
-        return False
\ No newline at end of file
+        return self.notifier.configure(channel, config)
+
+def get_alert_manager(request: Request) -> AlertManager:
+    """Dependency returning the application's alert manager"""
+    return request.app.state.alert_manager
@@ -0,0 +1,314 @@
+import json
+import math
+import bisect
+import logging
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = ("gt", "gte", "lt", "lte", "eq", "neq")
+
+# Functions applied to a metric before comparison; all but "last" need a window
+FUNCTIONS = ("last", "avg", "min", "max", "rate", "p95")
+
+# (metric, function, window seconds) identifying one evaluated input series
+SeriesKey = Tuple[str, str, float]
+
+
+class CompiledRule:
+    """An alert rule with its JSON condition parsed once"""
+
+    __slots__ = (
+        "alert_id", "name", "severity", "description", "notification_channels",
+        "metric", "operator", "threshold", "duration", "function", "window"
+    )
+
+    def __init__(
+        self,
+        alert_id: int,
+        name: str,
+        severity: str,
+        description: str,
+        notification_channels: List[str],
+        metric: str,
+        operator: str,
+        threshold: float,
+        duration: float = 0,
+        function: str = "last",
+        window: float = 0
+    ):
+        self.alert_id = alert_id
+        self.name = name
+        self.severity = severity
+        self.description = description
+        self.notification_channels = notification_channels
+        self.metric = metric
+        self.operator = operator
+        self.threshold = threshold
+        self.duration = duration
+        self.function = function
+        self.window = window
+    
+    @property
+    def series(self) -> SeriesKey:
+        return (self.metric, self.function, self.window)
+
+
+def parse_condition(condition) -> dict:
+    """Validate an alert condition (JSON string or dict).
+
+    Conditions look like {"metric": "cpu_percent", "operator": "gt",
+    "threshold": 90}, optionally with "function" and "window" (seconds) to
+    compare an aggregate such as the 5 minute average, and "duration" (or
+    "for") to require the comparison to hold that many seconds before firing.
+    """
+    if isinstance(condition, str):
+        try:
+            condition = json.loads(condition)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Condition is not valid JSON: {e}")
+    if not isinstance(condition, dict):
+        raise ValueError("Condition must be a JSON object")
+
+    metric = condition.get("metric")
+    if not metric or not isinstance(metric, str):
+        raise ValueError("Condition requires a metric")
+    operator = condition.get("operator")
+    if operator not in OPERATORS:
+        raise ValueError(f"Unknown operator {operator!r}; expected one of {', '.join(OPERATORS)}")
+    function = condition.get("function") or "last"
+    if function not in FUNCTIONS:
+        raise ValueError(f"Unknown function {function!r}; expected one of {', '.join(FUNCTIONS)}")
+    try:
+        threshold = float(condition.get("threshold"))
+        duration = float(condition.get("duration", condition.get("for", 0)) or 0)
+        window = float(condition.get("window", 0) or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Condition threshold, duration and window must be numbers")
+    if duration < 0 or window < 0:
+        raise ValueError("Condition duration and window cannot be negative")
+    if function == "last":
+        window = 0
+    elif window <= 0:
+        raise ValueError(f"Function {function} requires a window")
+
+    return {
+        "metric": metric,
+        "operator": operator,
+        "threshold": threshold,
+        "duration": duration,
+        "function": function,
+        "window": window
+    }
+
+
+def compile_rule(alert) -> CompiledRule:
+    """Compile an Alert row"""
+    condition = parse_condition(alert.condition)
+    return CompiledRule(
+        alert_id=alert.id,
+        name=alert.name,
+        severity=alert.severity,
+        description=alert.description,
+        notification_channels=list(alert.notification_channels or []),
+        **condition
+    )
+
+
+class _MetricPlan:
+    """All comparisons against one metric, batched by operator.
+
+    Thresholds are kept sorted so a single bisect per operator finds
+    every rule a value triggers.
+    """
+
+    def __init__(self):
+        self.sorted: Dict[str, Tuple[List[float], List[int]]] = {}
+        self.equal: Dict[float, List[int]] = {}
+        self.not_equal: Dict[float, List[int]] = {}
+
+    def add(self, index: int, rule: CompiledRule):
+        if rule.operator == "eq":
+            self.equal.setdefault(rule.threshold, []).append(index)
+        elif rule.operator == "neq":
+            self.not_equal.setdefault(rule.threshold, []).append(index)
+        else:
+            thresholds, indices = self.sorted.setdefault(rule.operator, ([], []))
+            position = bisect.bisect_right(thresholds, rule.threshold)
+            thresholds.insert(position, rule.threshold)
+            indices.insert(position, index)
+
+    def evaluate(self, value: float, triggered: Set[int]):
+        for operator, (thresholds, indices) in self.sorted.items():
+            if operator == "gt":  # threshold < value
+                triggered.update(indices[:bisect.bisect_left(thresholds, value)])
+            elif operator == "gte":  # threshold <= value
+                triggered.update(indices[:bisect.bisect_right(thresholds, value)])
+            elif operator == "lt":  # threshold > value
+                triggered.update(indices[bisect.bisect_right(thresholds, value):])
+            elif operator == "lte":  # threshold >= value
+                triggered.update(indices[bisect.bisect_left(thresholds, value):])
+        if self.equal:
+            triggered.update(self.equal.get(value, ()))
+        for threshold, indices in self.not_equal.items():
+            if threshold != value:
+                triggered.update(indices)
+
+
+class RulePlan:
+    """In-memory evaluation plan for all active alert rules"""
+
+    def __init__(self, rules: List[CompiledRule]):
+        self.rules = rules
+        self.series: Dict[SeriesKey, _MetricPlan] = {}
+        for index, rule in enumerate(rules):
+            self.series.setdefault(rule.series, _MetricPlan()).add(index, rule)
+
+    @classmethod
+    def compile(cls, alerts: Iterable) -> "RulePlan":
+        """Compile Alert rows, skipping (and logging) invalid conditions"""
+        rules = []
+        for alert in alerts:
+            try:
+                rules.append(compile_rule(alert))
+            except ValueError as e:
+                logger.error(f"Skipping alert {alert.name}: {e}")
+        return cls(rules)
+
+    def evaluate(self, values: Dict[SeriesKey, float]) -> Set[int]:
+        """Indices of rules whose condition holds for the current series values"""
+        triggered: Set[int] = set()
+        for key, plan in self.series.items():
+            value = values.get(key)
+            if value is not None:
+                plan.evaluate(value, triggered)
+        return triggered
+
+    def rule(self, index: int) -> CompiledRule:
+        return self.rules[index]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+
+class WindowAggregate:
+    """One function of a metric over a sliding time window, maintained incrementally"""
+
+    def __init__(self, function: str, window: float):
+        self.function = function
+        self.window = window
+        self.samples: Deque[Tuple[float, float]] = deque()
+        self.total = 0.0
+        # Monotonic deques: front is the current min / max
+        self.minima: Deque[Tuple[float, float]] = deque()
+        self.maxima: Deque[Tuple[float, float]] = deque()
+        self.ordered: List[float] = []
+
+    def push(self, timestamp: float, value: float):
+        self.samples.append((timestamp, value))
+        self.total += value
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((timestamp, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((timestamp, value))
+        if self.function == "p95":
+            bisect.insort(self.ordered, value)
+        self._expire(timestamp - self.window)
+
+    def _expire(self, cutoff: float):
+        samples = self.samples
+        while samples and samples[0][0] <= cutoff:
+            _, value = samples.popleft()
+            self.total -= value
+            if self.function == "p95":
+                del self.ordered[bisect.bisect_left(self.ordered, value)]
+        while self.minima and self.minima[0][0] <= cutoff:
+            self.minima.popleft()
+        while self.maxima and self.maxima[0][0] <= cutoff:
+            self.maxima.popleft()
+
+    def value(self) -> Optional[float]:
+        samples = self.samples
+        if not samples:
+            return None
+        if self.function == "avg":
+            return self.total / len(samples)
+        if self.function == "min":
+            return self.minima[0][1]
+        if self.function == "max":
+            return self.maxima[0][1]
+        if self.function == "rate":
+            (first_ts, first), (last_ts, last) = samples[0], samples[-1]
+            if last_ts <= first_ts:
+                return None
+            return (last - first) / (last_ts - first_ts)
+        if self.function == "p95":
+            return self.ordered[max(0, math.ceil(0.95 * len(self.ordered)) - 1)]
+        return samples[-1][1]
+
+
+class MetricWindows:
+    """Ring buffers of recent metric samples feeding the windowed alert functions.
+
+    A short raw history per metric lets aggregates created by a recompiled
+    plan start from already-collected samples instead of an empty window.
+    """
+
+    def __init__(self, history_seconds: float = 900):
+        self.min_history_seconds = history_seconds
+        self.history_seconds = history_seconds
+        self.history: Dict[str, Deque[Tuple[float, float]]] = {}
+        self.aggregates: Dict[SeriesKey, WindowAggregate] = {}
+        self.latest: Dict[str, float] = {}
+        self.timestamp: Optional[float] = None
+
+    def configure(self, keys: Iterable[SeriesKey]):
+        """Track exactly the given series, keeping state for ones already tracked"""
+        aggregates = {}
+        for key in keys:
+            metric, function, window = key
+            if function == "last":
+                continue
+            aggregate = self.aggregates.get(key)
+            if aggregate is None:
+                aggregate = WindowAggregate(function, window)
+                for timestamp, value in self.history.get(metric, ()):
+                    aggregate.push(timestamp, value)
+            aggregates[key] = aggregate
+        self.aggregates = aggregates
+        self.history_seconds = max(
+            [self.min_history_seconds] + [key[2] for key in aggregates]
+        )
+
+    def ingest(self, timestamp: float, values: Dict[str, float]):
+        """Append one sample of every metric"""
+        self.timestamp = timestamp
+        self.latest = values
+        cutoff = timestamp - self.history_seconds
+        for metric, value in values.items():
+            if value is None:
+                continue
+            history = self.history.get(metric)
+            if history is None:
+                history = self.history[metric] = deque()
+            history.append((timestamp, value))
+            while history[0][0] <= cutoff:
+                history.popleft()
+        for (metric, _, _), aggregate in self.aggregates.items():
+            value = values.get(metric)
+            if value is not None:
+                aggregate.push(timestamp, value)
+
+    def values(self) -> Dict[SeriesKey, float]:
+        """Current value of every tracked series (plain metrics included)"""
+        current: Dict[SeriesKey, float] = {
+            (metric, "last", 0): value for metric, value in self.latest.items()
+        }
+        for key, aggregate in self.aggregates.items():
+            value = aggregate.value()
+            if value is not None:
+                current[key] = value
+        return current
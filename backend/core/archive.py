@@ -0,0 +1,305 @@
+import os
+import bz2
+import gzip
+import json
+import time
+import bisect
+import tarfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Callable, Deque, List, Optional, Tuple
+
+EXTENSIONS = {"gz": ".tar.gz", "bz2": ".tar.bz2", "none": ".tar"}
+INDEX_EXTENSION = ".index.json.gz"
+
+# Progress messages sent to the parent process, at most this often per backup
+PROGRESS_INTERVAL = 0.5
+
+_progress_queue: Optional[multiprocessing.Queue] = None
+
+
+def init_worker(progress_queue: multiprocessing.Queue):
+    """ProcessPoolExecutor initializer: keep the queue progress is reported on"""
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def put_progress(update: dict):
+    """Send a progress message to the parent process, if it is listening"""
+    if _progress_queue is not None:
+        _progress_queue.put(update)
+
+
+def _compressor(compression: str, level: int) -> Optional[Callable[[bytes], bytes]]:
+    if compression == "gz":
+        return lambda block: gzip.compress(block, compresslevel=level, mtime=0)
+    if compression == "bz2":
+        return lambda block: bz2.compress(block, compresslevel=level)
+    return None
+
+
+class BlockCompressor:
+    """File-like sink compressing fixed-size blocks in parallel, written in order.
+
+    Each block becomes an independent gzip member (or bzip2 stream), so the
+    output is still a regular .tar.gz/.tar.bz2 while blocks are compressed
+    on a thread pool (zlib and bz2 release the GIL). blocks records
+    (uncompressed offset, compressed offset) of every member so readers can
+    later seek to the member containing a given tar offset.
+    """
+
+    def __init__(
+        self,
+        fileobj: BinaryIO,
+        compression: str = "gz",
+        level: int = 6,
+        block_size: int = 4 * 1024 * 1024,
+        threads: int = 0,
+        on_block: Optional[Callable[[], None]] = None
+    ):
+        self.fileobj = fileobj
+        self.on_block = on_block
+        self.compress = _compressor(compression, level)
+        self.block_size = block_size
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(self.threads) if self.compress else None
+        self.buffer = bytearray()
+        self.pending: Deque[Tuple[int, Future]] = deque()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._submitted = 0
+        self.blocks: List[Tuple[int, int]] = []
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.bytes_in += len(data)
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[:self.block_size])
+            del self.buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block: bytes):
+        if self.executor is None:
+            self._emit(len(block), block)
+            return
+        self.pending.append((len(block), self.executor.submit(self.compress, block)))
+        # Bound memory: keep at most two blocks per thread in flight
+        while len(self.pending) > self.threads * 2:
+            self._drain_one()
+
+    def _drain_one(self):
+        size, future = self.pending.popleft()
+        self._emit(size, future.result())
+
+    def _emit(self, size: int, data: bytes):
+        self.blocks.append((self._submitted, self.bytes_out))
+        self._submitted += size
+        self.fileobj.write(data)
+        self.bytes_out += len(data)
+        if self.on_block is not None:
+            self.on_block()
+
+    def close(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self._drain_one()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+class _IndexingTarFile(tarfile.TarFile):
+    """TarFile recording where each member's header and data land in the tar stream"""
+
+    def __init__(self, *args, **kwargs):
+        self.member_index: List[list] = []
+        super().__init__(*args, **kwargs)
+
+    def addfile(self, tarinfo, fileobj=None):
+        offset = self.offset
+        super().addfile(tarinfo, fileobj)
+        end = self.offset
+        data_offset = end
+        if tarinfo.isreg():
+            data_offset -= -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        # name, type, header offset, data offset, end offset, size, mtime
+        self.member_index.append([
+            tarinfo.name, tarinfo.type.decode(), offset, data_offset, end, tarinfo.size, int(tarinfo.mtime)
+        ])
+
+
+def index_path(backup_path: str) -> str:
+    return backup_path + INDEX_EXTENSION
+
+
+def read_index(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _RangeReader:
+    """Read-only view of [start, end) of the uncompressed tar stream of a block archive.
+
+    Seeks to the compressed member holding start, so only the blocks that
+    overlap the range are ever decompressed.
+    """
+
+    def __init__(self, backup_path: str, compression: str, blocks: List[Tuple[int, int]], start: int, end: int):
+        i = max(bisect.bisect_right([block[0] for block in blocks], start) - 1, 0) if blocks else 0
+        block_start, compressed_offset = blocks[i] if blocks else (0, 0)
+        self.raw = open(backup_path, "rb")
+        self.raw.seek(compressed_offset)
+        if compression == "gz":
+            self.stream = gzip.GzipFile(fileobj=self.raw, mode="rb")
+        elif compression == "bz2":
+            self.stream = bz2.BZ2File(self.raw, mode="rb")
+        else:
+            self.stream = self.raw
+        skip = start - block_start
+        while skip > 0:
+            skipped = len(self.stream.read(min(skip, 1024 * 1024)))
+            if not skipped:
+                break
+            skip -= skipped
+        self.remaining = end - start
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        if self.stream is not self.raw:
+            self.stream.close()
+        self.raw.close()
+
+
+def _selected(name: str, paths: List[str]) -> bool:
+    return any(name == path or name.startswith(path.rstrip("/") + "/") for path in paths)
+
+
+def restore_members(backup_path: str, target_path: str, paths: List[str]) -> int:
+    """Extract the given member paths (files or subtrees) using the archive index.
+
+    Members of one subtree are contiguous in the archive, so only the span
+    between the first and last selected member is read. Returns the number
+    of members extracted.
+    """
+    index = read_index(index_path(backup_path))
+    selected = [member for member in index["members"] if _selected(member[0], paths)]
+    if not selected:
+        return 0
+    reader = _RangeReader(backup_path, index["compression"], index["blocks"], selected[0][2], selected[-1][4])
+    extracted = 0
+    try:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            for member in tar:
+                if _selected(member.name, paths):
+                    tar.extract(member, target_path)
+                    extracted += 1
+    finally:
+        reader.close()
+    return extracted
+
+
+def _excluded(path: str, exclude_patterns: Optional[List[str]]) -> bool:
+    return any(pattern in path for pattern in exclude_patterns or [])
+
+
+def _source_size(source_path: str, exclude_patterns: Optional[List[str]]) -> int:
+    """Bytes of regular files under source_path, for progress percentages"""
+    if os.path.isfile(source_path):
+        return os.path.getsize(source_path)
+    total = 0
+    for root, dirs, files in os.walk(source_path):
+        dirs[:] = [d for d in dirs if not _excluded(os.path.join(root, d), exclude_patterns)]
+        for name in files:
+            path = os.path.join(root, name)
+            if _excluded(path, exclude_patterns):
+                continue
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not os.path.islink(path):
+                total += st.st_size
+    return total
+
+
+def create_archive(
+    backup_id: int,
+    source_path: str,
+    backup_path: str,
+    compression: str = "gz",
+    exclude_patterns: Optional[List[str]] = None,
+    level: int = 6,
+    block_size: int = 4 * 1024 * 1024,
+    threads: int = 0
+) -> dict:
+    """Write a block-compressed tar of source_path, reporting progress to the parent"""
+    total_bytes = _source_size(source_path, exclude_patterns)
+    files = 0
+    last_report = 0.0
+    sink: Optional[BlockCompressor] = None
+
+    def report(status: str = "running", force: bool = False):
+        nonlocal last_report
+        now = time.monotonic()
+        if not force and now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        put_progress({
+                "id": backup_id,
+                "status": status,
+                "files": files,
+                "bytes_read": sink.bytes_in,
+                "bytes_written": sink.bytes_out,
+                "total_bytes": total_bytes
+            })
+
+    def exclude_filter(member: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+        nonlocal files
+        if _excluded(member.name, exclude_patterns):
+            return None
+        files += 1
+        report()
+        return member
+
+    tmp_path = backup_path + ".partial"
+    try:
+        with open(tmp_path, "wb") as out:
+            sink = BlockCompressor(out, compression, level, block_size, threads, on_block=report)
+            try:
+                # Streaming mode: tarfile only ever appends to the sink
+                with _IndexingTarFile.open(fileobj=sink, mode="w|") as tar:
+                    tar.add(source_path, arcname=os.path.basename(source_path), filter=exclude_filter)
+            finally:
+                sink.close()
+        with gzip.open(tmp_path + INDEX_EXTENSION, "wt", encoding="utf-8") as f:
+            json.dump({
+                "compression": compression,
+                "blocks": sink.blocks,
+                "members": tar.member_index
+            }, f, separators=(",", ":"))
+        # Index first, so an archive never exists without one
+        os.replace(tmp_path + INDEX_EXTENSION, index_path(backup_path))
+        os.replace(tmp_path, backup_path)
+    except BaseException:
+        for path in (tmp_path, tmp_path + INDEX_EXTENSION):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    report("finalizing", force=True)
+    return {
+        "files": files,
+        "bytes_read": sink.bytes_in,
+        "bytes_written": sink.bytes_out,
+        "total_bytes": total_bytes,
+        "members": len(tar.member_index)
+    }
@@ -1,23 +1,153 @@
 import os
 import shutil
+import asyncio
 import tarfile
-import gzip
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
-from sqlalchemy.orm import Session
-from .database import Backup, SessionLocal
+from typing import Optional, List, Dict, Iterable, Set, Tuple
+from sqlalchemy import delete, select
+from . import archive, chunk_store
+from .config import get_settings
+from .database import AsyncReadSessionLocal, AsyncSessionLocal, Backup, SessionLocal
 
 logger = logging.getLogger(__name__)
 
+# Threads unlinking archives concurrently while pruning
+PRUNE_THREADS = 8
+
+
+def select_expired(
+    backups: Iterable[Backup],
+    now: datetime,
+    default_retention_days: int,
+    keep_daily: int = 0,
+    keep_weekly: int = 0,
+    keep_monthly: int = 0
+) -> List[Backup]:
+    """Backups past their retention that no GFS slot keeps.
+
+    Each backup expires retention_days (or default_retention_days) after it
+    was created. Per backup name, the newest completed backup of each of the
+    last keep_daily days, keep_weekly ISO weeks and keep_monthly months is
+    kept regardless of age.
+    """
+    by_name: Dict[str, List[Backup]] = {}
+    for backup in backups:
+        by_name.setdefault(backup.name, []).append(backup)
+    
+    expired = []
+    for group in by_name.values():
+        group.sort(key=lambda b: b.created_at, reverse=True)
+        keep: Set[int] = set()
+        for count, period in (
+            (keep_daily, lambda d: d.date()),
+            (keep_weekly, lambda d: d.isocalendar()[:2]),
+            (keep_monthly, lambda d: (d.year, d.month))
+        ):
+            seen = set()
+            for backup in group:
+                if len(seen) >= count:
+                    break
+                if backup.status != "completed" or period(backup.created_at) in seen:
+                    continue
+                seen.add(period(backup.created_at))
+                keep.add(backup.id)
+        for backup in group:
+            days = backup.retention_days or default_retention_days
+            if backup.id not in keep and backup.created_at < now - timedelta(days=days):
+                expired.append(backup)
+    return expired
+
+
 class BackupManager:
-    """Backup management system"""
+    """Backup management system.
+
+    Archives are written by archive.create_archive in a worker process, so
+    a multi-GB backup never blocks the event loop. Progress reported by the
+    workers is merged into active_backups and broadcast on the "backups"
+    WebSocket channel.
+    """
     
-    def __init__(self, backup_dir: str = "/app/backups"):
+    def __init__(self, backup_dir: str = "/app/backups", websocket_manager=None):
+        settings = get_settings()
         self.backup_dir = backup_dir
+        self.websocket_manager = websocket_manager
         self.active_backups: Dict[str, dict] = {}
+        self.workers = settings.BACKUP_WORKERS or 1
+        self.compression_level = settings.BACKUP_COMPRESSION_LEVEL
+        self.block_size = settings.BACKUP_BLOCK_SIZE_MB * 1024 * 1024
+        self.compression_threads = settings.BACKUP_COMPRESSION_THREADS
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+        self._progress_thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.chunk_dir = os.path.join(backup_dir, "chunks")
         os.makedirs(backup_dir, exist_ok=True)
     
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        """Start the worker pool and the progress reader on first use"""
+        if self._executor is None:
+            self._loop = asyncio.get_running_loop()
+            # spawn: the API process has threads (event loop, write buffer) that fork would not carry over safely
+            context = multiprocessing.get_context("spawn")
+            self._progress_queue = context.Queue()
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=archive.init_worker,
+                initargs=(self._progress_queue,)
+            )
+            self._progress_thread = threading.Thread(
+                target=self._read_progress, name="backup-progress", daemon=True
+            )
+            self._progress_thread.start()
+        return self._executor
+    
+    def _read_progress(self):
+        """Forward worker progress messages to the event loop until shutdown"""
+        while True:
+            try:
+                update = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if update is None:
+                return
+            try:
+                self._loop.call_soon_threadsafe(self._apply_progress, update)
+            except RuntimeError:
+                # Event loop already closed
+                return
+    
+    def _apply_progress(self, update: dict):
+        state = self.active_backups.get(str(update.pop("id")))
+        if state is None:
+            return
+        state.update(update)
+        if state.get("total_bytes"):
+            done = state["bytes_read"] + state.get("bytes_skipped", 0)
+            state["percent"] = round(min(done / state["total_bytes"] * 100, 100.0), 1)
+        self._publish(state)
+    
+    def _publish(self, state: dict):
+        if self.websocket_manager is None:
+            return
+        asyncio.ensure_future(self.websocket_manager.broadcast(
+            {"type": "backup_progress", "data": dict(state)},
+            channel="backups"
+        ))
+    
+    def shutdown(self):
+        """Stop the worker pool, waiting for running archives to finish"""
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._progress_queue.put(None)
+        self._progress_thread.join(timeout=5)
+        self._executor = None
+    
     async def create_backup(
         self,
         name: str,
@@ -25,13 +155,13 @@ class BackupManager:
         backup_type: str = "full",
         compression: str = "gz",
         exclude_patterns: List[str] = None,
-        retention_days: int = 30
+        retention_days: Optional[int] = None
     ) -> Optional[Backup]:
         """Create a new backup"""
+        backup_id = None
         try:
             # Create backup record
-            db = SessionLocal()
-            try:
+            async with AsyncSessionLocal() as db:
                 backup = Backup(
                     name=name,
                     type=backup_type,
@@ -41,111 +171,217 @@ class BackupManager:
                     retention_days=retention_days
                 )
                 db.add(backup)
-                db.commit()
-                db.refresh(backup)
+                await db.commit()
+                await db.refresh(backup)
+                backup_id = backup.id
                 
-                # Generate backup filename
+                # Generate backup filename; incremental backups store a manifest over the shared chunk store
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                backup_filename = f"{name}_{timestamp}.tar.{compression}"
-                backup_path = os.path.join(self.backup_dir, backup_filename)
+                if backup_type == "incremental":
+                    extension = chunk_store.MANIFEST_EXTENSION
+                else:
+                    extension = archive.EXTENSIONS.get(compression, ".tar")
+                backup_path = os.path.join(self.backup_dir, f"{name}_{timestamp}{extension}")
+                backup.archive_path = backup_path
+                await db.commit()
                 
                 self.active_backups[str(backup.id)] = {
                     "id": backup.id,
                     "name": name,
                     "status": "running",
-                    "started_at": datetime.utcnow().isoformat()
+                    "started_at": datetime.utcnow().isoformat(),
+                    "files": 0,
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                    "total_bytes": 0,
+                    "percent": 0.0
                 }
+                self._publish(self.active_backups[str(backup.id)])
                 
-                # Create backup archive
-                await self._create_archive(
-                    source_path,
-                    backup_path,
-                    compression,
-                    exclude_patterns
-                )
-                
-                # Update backup record
-                backup.status = "completed"
-                backup.completed_at = datetime.utcnow()
-                backup.size_bytes = os.path.getsize(backup_path)
-                db.commit()
-                
-                del self.active_backups[str(backup.id)]
+                try:
+                    if backup_type == "incremental":
+                        result = await self._create_snapshot(
+                            backup.id,
+                            name,
+                            source_path,
+                            backup_path,
+                            exclude_patterns
+                        )
+                        # Only the chunks this backup added count towards its size
+                        size_bytes = result["bytes_written"] + os.path.getsize(backup_path)
+                    else:
+                        # Create backup archive
+                        await self._create_archive(
+                            backup.id,
+                            source_path,
+                            backup_path,
+                            compression,
+                            exclude_patterns
+                        )
+                        size_bytes = os.path.getsize(backup_path)
+                    
+                    # Update backup record
+                    backup.status = "completed"
+                    backup.completed_at = datetime.utcnow()
+                    backup.size_bytes = size_bytes
+                    await db.commit()
+                    
+                    state = self.active_backups[str(backup.id)]
+                    state.update(status="completed", percent=100.0, completed_at=backup.completed_at.isoformat())
+                    self._publish(state)
+                except Exception as e:
+                    state = self.active_backups[str(backup.id)]
+                    state.update(status="failed", error=str(e))
+                    self._publish(state)
+                    raise
+                finally:
+                    self.active_backups.pop(str(backup.id), None)
                 
                 logger.info(f"Backup completed: {name}")
                 return backup
                 
-            finally:
-                db.close()
-                
         except Exception as e:
             logger.error(f"Error creating backup {name}: {e}")
             # Update backup record with error
             try:
-                db = SessionLocal()
-                backup = db.query(Backup).filter(Backup.name == name).order_by(Backup.created_at.desc()).first()
-                if backup:
-                    backup.status = "failed"
-                    backup.error_message = str(e)
-                    db.commit()
-                db.close()
+                # No record to update if creating it failed
+                if backup_id is not None:
+                    async with AsyncSessionLocal() as db:
+                        backup = await db.get(Backup, backup_id)
+                        if backup:
+                            backup.status = "failed"
+                            backup.error_message = str(e)
+                            await db.commit()
             except:
                 pass
             return None
     
     async def _create_archive(
         self,
+        backup_id: int,
         source_path: str,
         backup_path: str,
         compression: str,
         exclude_patterns: List[str] = None
-    ):
-        """Create compressed archive"""
-        mode = "w:gz" if compression == "gz" else "w:bz2" if compression == "bz2" else "w"
-        
-        with tarfile.open(backup_path, mode) as tar:
-            def exclude_filter(member):
-                if exclude_patterns:
-                    for pattern in exclude_patterns:
-                        if pattern in member.name:
-                            return False
-                return True
-            
-            tar.add(source_path, arcname=os.path.basename(source_path), filter=exclude_filter)
+    ) -> dict:
+        """Create a block-parallel compressed archive in a worker process"""
+        executor = self._ensure_executor()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor,
+            archive.create_archive,
+            backup_id,
+            source_path,
+            backup_path,
+            compression,
+            exclude_patterns,
+            self.compression_level,
+            self.block_size,
+            self.compression_threads
+        )
+    
+    def _archive_path(self, backup: Backup, listing: Optional[List[str]] = None) -> Optional[str]:
+        """Archive (or manifest) of a backup, from the catalog"""
+        if backup.archive_path:
+            return backup.archive_path if os.path.exists(backup.archive_path) else None
+        # Backups made before the catalog: newest file named <name>_<timestamp>
+        if backup.type == "incremental":
+            extensions = (chunk_store.MANIFEST_EXTENSION,)
+        else:
+            extensions = tuple(archive.EXTENSIONS.values())
+        backup_files = [
+            f for f in (os.listdir(self.backup_dir) if listing is None else listing)
+            if f.startswith(f"{backup.name}_") and f.endswith(extensions)
+        ]
+        return os.path.join(self.backup_dir, sorted(backup_files)[-1]) if backup_files else None
     
-    async def restore_backup(self, backup_id: int, target_path: str) -> bool:
-        """Restore from backup"""
+    async def _create_snapshot(
+        self,
+        backup_id: int,
+        name: str,
+        source_path: str,
+        manifest_path: str,
+        exclude_patterns: List[str] = None
+    ) -> dict:
+        """Store a deduplicated snapshot in a worker process, based on the previous one of this name"""
+        async with AsyncReadSessionLocal() as db:
+            previous = (await db.execute(
+                select(Backup).where(
+                    Backup.name == name,
+                    Backup.type == "incremental",
+                    Backup.source_path == source_path,
+                    Backup.status == "completed",
+                    Backup.archive_path.isnot(None)
+                ).order_by(Backup.created_at.desc()).limit(1)
+            )).scalar_one_or_none()
+        executor = self._ensure_executor()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor,
+            chunk_store.create_snapshot,
+            backup_id,
+            source_path,
+            manifest_path,
+            self.chunk_dir,
+            previous.archive_path if previous else None,
+            exclude_patterns,
+            self.compression_level
+        )
+    
+    async def collect_garbage(self) -> int:
+        """Remove chunks no longer referenced by any incremental backup; returns bytes freed"""
+        result = await asyncio.to_thread(chunk_store.collect_garbage, self.chunk_dir, self.backup_dir)
+        if result is None:
+            # A running snapshot, possibly in another process, may reference chunks its manifest does not list yet
+            logger.info("Skipped backup chunk garbage collection while a snapshot is running")
+            return 0
+        removed, freed = result
+        if removed:
+            logger.info(f"Removed {removed} unreferenced backup chunks ({freed} bytes)")
+        return freed
+    
+    async def restore_backup(self, backup_id: int, target_path: str, paths: Optional[List[str]] = None) -> bool:
+        """Restore from backup.
+        
+        paths limits the restore to the given member paths (as stored in the
+        archive, e.g. "etc/nginx/nginx.conf") and their subtrees. Indexed
+        archives then only decompress the blocks holding those members.
+        """
         try:
-            db = SessionLocal()
-            try:
-                backup = db.query(Backup).filter(Backup.id == backup_id).first()
-                if not backup:
-                    return False
-                
-                # Find backup file
-                backup_files = [
-                    f for f in os.listdir(self.backup_dir)
-                    if f.startswith(backup.name) and f.endswith(('.tar.gz', '.tar.bz2', '.tar'))
-                ]
-                
-                if not backup_files:
-                    return False
-                
-                backup_path = os.path.join(self.backup_dir, sorted(backup_files)[-1])
-                
-                # Extract backup
-                with tarfile.open(backup_path, "r:*") as tar:
-                    tar.extractall(target_path)
-                
-                logger.info(f"Backup restored: {backup.name} to {target_path}")
-                return True
-                
-            finally:
-                db.close()
+            async with AsyncReadSessionLocal() as db:
+                backup = await db.get(Backup, backup_id)
+            if not backup:
+                return False
+            
+            backup_path = self._archive_path(backup)
+            if not backup_path:
+                return False
+            
+            if backup.type == "incremental":
+                await asyncio.to_thread(
+                    chunk_store.restore_snapshot, backup_path, self.chunk_dir, target_path, paths
+                )
+            elif paths and os.path.exists(archive.index_path(backup_path)):
+                await asyncio.to_thread(archive.restore_members, backup_path, target_path, paths)
+            else:
+                await asyncio.to_thread(self._extract, backup_path, target_path, paths)
+            
+            logger.info(f"Backup restored: {backup.name} to {target_path}")
+            return True
         except Exception as e:
             logger.error(f"Error restoring backup {backup_id}: {e}")
             return False
     
+    @staticmethod
+    def _extract(backup_path: str, target_path: str, paths: Optional[List[str]] = None):
+        """Extract an archive without an index, reading it from the start"""
+        with tarfile.open(backup_path, "r:*") as tar:
+            if not paths:
+                tar.extractall(target_path)
+                return
+            prefixes = [path.rstrip("/") + "/" for path in paths]
+            tar.extractall(target_path, members=[
+                m for m in tar if m.name in paths or m.name.startswith(tuple(prefixes))
+            ])
+    
     def list_backups(self) -> List[dict]:
         """List all backups"""
         try:
@@ -174,49 +410,102 @@ class BackupManager:
     async def delete_backup(self, backup_id: int) -> bool:
         """Delete a backup"""
         try:
-            db = SessionLocal()
-            try:
-                backup = db.query(Backup).filter(Backup.id == backup_id).first()
+            async with AsyncSessionLocal() as db:
+                backup = await db.get(Backup, backup_id)
                 if not backup:
                     return False
                 
-                # Find and delete backup files
-                backup_files = [
-                    f for f in os.listdir(self.backup_dir)
-                    if f.startswith(backup.name)
-                ]
-                
-                for f in backup_files:
-                    os.remove(os.path.join(self.backup_dir, f))
+                # Delete the archive and its index
+                backup_path = self._archive_path(backup)
+                if backup_path:
+                    for path in (backup_path, archive.index_path(backup_path)):
+                        if os.path.exists(path):
+                            os.remove(path)
                 
                 # Delete record
-                db.delete(backup)
-                db.commit()
+                await db.delete(backup)
+                await db.commit()
+                
+                if backup.type == "incremental":
+                    await self.collect_garbage()
                 
                 logger.info(f"Backup deleted: {backup.name}")
                 return True
                 
-            finally:
-                db.close()
         except Exception as e:
             logger.error(f"Error deleting backup {backup_id}: {e}")
             return False
     
+    @staticmethod
+    def _remove_files(paths: List[str]) -> Tuple[int, List[str]]:
+        """Unlink files concurrently; returns (bytes freed, paths that could not be removed)"""
+        def remove(path: str) -> Tuple[int, Optional[str]]:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                return size, None
+            except FileNotFoundError:
+                return 0, None
+            except OSError as e:
+                logger.error(f"Error removing backup file {path}: {e}")
+                return 0, path
+        
+        with ThreadPoolExecutor(PRUNE_THREADS) as executor:
+            results = list(executor.map(remove, paths))
+        return sum(size for size, _ in results), [path for _, path in results if path]
+    
+    async def prune_backups(self) -> dict:
+        """Delete every backup past its retention in one pass.
+        
+        One query selects the candidates, the backup directory is listed at
+        most once (for rows predating the catalog), files are unlinked on a
+        thread pool and the rows are deleted in a single statement.
+        """
+        settings = get_settings()
+        now = datetime.utcnow()
+        # Read on the reader pool: the writer is not held while files are removed
+        async with AsyncReadSessionLocal() as db:
+            backups = (await db.execute(select(Backup).where(Backup.status != "running"))).scalars().all()
+        expired = select_expired(
+            backups,
+            now,
+            settings.BACKUP_RETENTION_DAYS,
+            settings.BACKUP_KEEP_DAILY,
+            settings.BACKUP_KEEP_WEEKLY,
+            settings.BACKUP_KEEP_MONTHLY
+        )
+        if not expired:
+            return {"deleted": 0, "freed_bytes": 0, "kept": len(backups)}
+        
+        listing = None
+        if any(not b.archive_path for b in expired):
+            listing = os.listdir(self.backup_dir)
+        files: Dict[int, List[str]] = {}
+        for backup in expired:
+            backup_path = self._archive_path(backup, listing)
+            files[backup.id] = [backup_path, archive.index_path(backup_path)] if backup_path else []
+        
+        freed, failed = await asyncio.to_thread(
+            self._remove_files, [path for paths in files.values() for path in paths]
+        )
+        failed = set(failed)
+        # Keep the rows of backups whose archive is still on disk
+        deleted = [b for b in expired if not failed.intersection(files[b.id])]
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(Backup).where(Backup.id.in_([b.id for b in deleted]))
+            )
+            await db.commit()
+        
+        if any(b.type == "incremental" for b in deleted):
+            freed += await self.collect_garbage()
+        
+        logger.info(f"Pruned {len(deleted)} backups, freed {freed} bytes")
+        return {"deleted": len(deleted), "freed_bytes": freed, "kept": len(backups) - len(deleted)}
+    
     async def cleanup_old_backups(self):
-        """Remove backups older than retention period"""
+        """Remove backups older than their retention period"""
         try:
-            db = SessionLocal()
-            try:
-                cutoff_date = datetime.utcnow() - timedelta(days=30)
-                old_backups = db.query(Backup).filter(
-                    Backup.created_at < cutoff_date
-                ).all()
-                
-                for backup in old_backups:
-                    await self.delete_backup(backup.id)
-                
-                logger.info(f"Cleaned up {len(old_backups)} old backups")
-            finally:
-                db.close()
+            await self.prune_backups()
         except Exception as e:
             logger.error(f"Error cleaning up old backups: {e}")
\ No newline at end of file
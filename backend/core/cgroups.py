@@ -0,0 +1,115 @@
+import os
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def _read_int(path: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def _read_cpu_usec(path: str) -> Optional[int]:
+    """usage_usec from a cgroup v2 cpu.stat"""
+    try:
+        with open(os.path.join(path, "cpu.stat")) as f:
+            for line in f:
+                if line.startswith("usage_usec "):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _read_io_bytes(path: str) -> Tuple[int, int]:
+    """Total (read, written) bytes over all devices from a cgroup v2 io.stat"""
+    read = written = 0
+    try:
+        with open(os.path.join(path, "io.stat")) as f:
+            for line in f:
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "rbytes":
+                        read += int(value)
+                    elif key == "wbytes":
+                        written += int(value)
+    except (OSError, ValueError):
+        pass
+    return read, written
+
+
+class CgroupSampler:
+    """CPU, memory and IO of every systemd service, from cgroup v2 accounting files.
+
+    Counters (CPU time, IO bytes) are turned into rates against the previous
+    sample of the same unit, so the first sample of a unit reports no rates.
+    On cgroup v1 hosts only memory and CPU are available.
+    """
+
+    def __init__(self, root: str = CGROUP_ROOT, slice_name: str = "system.slice"):
+        self.root = root
+        self.slice_name = slice_name
+        self.unified = os.path.exists(os.path.join(root, "cgroup.controllers"))
+        self._previous: Dict[str, Tuple[float, Optional[int], int, int]] = {}
+
+    def _units(self) -> Dict[str, str]:
+        """Service unit name -> cgroup directory (v2) or path below the controller (v1)"""
+        base = self.root if self.unified else os.path.join(self.root, "memory")
+        top = os.path.join(base, self.slice_name)
+        units = {}
+        for directory, subdirs, _ in os.walk(top):
+            for name in subdirs:
+                if name.endswith(".service"):
+                    units[name] = os.path.relpath(os.path.join(directory, name), base)
+            # Services only nest inside slices
+            subdirs[:] = [name for name in subdirs if name.endswith(".slice")]
+        return units
+
+    def _read_unit(self, relpath: str) -> Tuple[Optional[int], Optional[int], int, int]:
+        """(cpu usage in µs, memory bytes, io read bytes, io written bytes)"""
+        if self.unified:
+            path = os.path.join(self.root, relpath)
+            read, written = _read_io_bytes(path)
+            return _read_cpu_usec(path), _read_int(os.path.join(path, "memory.current")), read, written
+        cpu_ns = _read_int(os.path.join(self.root, "cpuacct", relpath, "cpuacct.usage"))
+        memory = _read_int(os.path.join(self.root, "memory", relpath, "memory.usage_in_bytes"))
+        return (cpu_ns // 1000 if cpu_ns is not None else None), memory, 0, 0
+
+    def sample(self) -> Dict[str, Dict[str, float]]:
+        """Unit -> {"cpu_percent", "memory_bytes", "io_read_bps", "io_write_bps"}; blocking"""
+        now = time.monotonic()
+        result: Dict[str, Dict[str, float]] = {}
+        current: Dict[str, Tuple[float, Optional[int], int, int]] = {}
+        try:
+            units = self._units()
+        except OSError as e:
+            logger.error(f"Error listing cgroups: {e}")
+            return result
+
+        for unit, relpath in units.items():
+            cpu_usec, memory, io_read, io_write = self._read_unit(relpath)
+            current[unit] = (now, cpu_usec, io_read, io_write)
+            values: Dict[str, float] = {}
+            if memory is not None:
+                values["memory_bytes"] = memory
+            previous = self._previous.get(unit)
+            if previous is not None and now > previous[0]:
+                elapsed = now - previous[0]
+                if cpu_usec is not None and previous[1] is not None and cpu_usec >= previous[1]:
+                    # Percent of one CPU, like per-process cpu_percent
+                    values["cpu_percent"] = round((cpu_usec - previous[1]) / 1e6 / elapsed * 100, 2)
+                if self.unified and io_read >= previous[2] and io_write >= previous[3]:
+                    values["io_read_bps"] = round((io_read - previous[2]) / elapsed, 1)
+                    values["io_write_bps"] = round((io_write - previous[3]) / elapsed, 1)
+            if values:
+                result[unit] = values
+        self._previous = current
+        return result
@@ -0,0 +1,384 @@
+import os
+import gzip
+import json
+import stat
+import time
+import random
+import hashlib
+import zlib
+import fcntl
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from .archive import PROGRESS_INTERVAL, put_progress, _excluded
+
+try:
+    import numpy
+except ImportError:  # optional: without it cut points are searched byte by byte, ~20x slower
+    numpy = None
+
+MANIFEST_EXTENSION = ".manifest.json.gz"
+MANIFEST_VERSION = 1
+# Lock file in the chunk directory: snapshots hold it shared while they add
+# chunks their manifest does not list yet, garbage collection exclusively
+LOCK_NAME = ".lock"
+
+# Content-defined chunking bounds; the mask gives ~1 MiB average chunks
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+CHUNK_MASK = (1 << 20) - 1
+
+_MASK64 = (1 << 64) - 1
+# Gear table of the rolling hash; fixed seed so cut points are stable across runs
+_GEAR = [random.Random(0x5EED + i).getrandbits(64) for i in range(256)]
+
+# The gear hash shifts left once per byte, so its low MASK_BITS bits (all the
+# cut test looks at) only depend on the last MASK_BITS bytes hashed
+MASK_BITS = CHUNK_MASK.bit_length()
+# Bytes hashed per vectorised step; small enough to stay in cache
+_SCAN_BLOCK = 64 * 1024
+_GEAR_LOW = numpy.array([g & CHUNK_MASK for g in _GEAR], dtype=numpy.uint32) if numpy is not None else None
+
+
+def _cut_point(data: memoryview) -> int:
+    """Length of the next chunk at the start of data (gear hash, FastCDC style)"""
+    size = len(data)
+    if size <= MIN_CHUNK:
+        return size
+    end = min(size, MAX_CHUNK)
+    if numpy is not None:
+        return _cut_point_vectorised(data, end)
+    h = 0
+    gear = _GEAR
+    # Bytes before MIN_CHUNK can never be a cut point, so they are not hashed
+    for i in range(MIN_CHUNK, end):
+        h = ((h << 1) + gear[data[i]]) & _MASK64
+        if not h & CHUNK_MASK:
+            return i + 1
+    return end
+
+
+def _cut_point_vectorised(data: memoryview, end: int) -> int:
+    """_cut_point with numpy: the low hash bits at every position of a block at once"""
+    window = MASK_BITS - 1
+    for block_start in range(MIN_CHUNK, end, _SCAN_BLOCK):
+        block_end = min(end, block_start + _SCAN_BLOCK)
+        # Earlier bytes still in the hash, but none from before MIN_CHUNK
+        lead = min(window, block_start - MIN_CHUNK)
+        h = _GEAR_LOW[numpy.frombuffer(data[block_start - lead:block_end], dtype=numpy.uint8)]
+        # Sums over windows of 1, 2, 4, ... bytes, each from two halves; uint32
+        # wraps, which leaves the low MASK_BITS bits exact
+        width = 1
+        windows = {}
+        while width * 2 <= MASK_BITS:
+            windows[width] = h
+            h = h.copy()
+            h[width:] += windows[width][:-width] << width
+            width *= 2
+        # Top up to MASK_BITS bytes from the smaller windows
+        for size in sorted(windows, reverse=True):
+            if width + size <= MASK_BITS:
+                h[width:] += windows[size][:-width] << width
+                width += size
+        hits = numpy.flatnonzero((h[lead:] & CHUNK_MASK) == 0)
+        if hits.size:
+            return block_start + int(hits[0]) + 1
+    return end
+
+
+def iter_chunks(fileobj) -> Iterator[bytes]:
+    """Split a file into content-defined chunks"""
+    buffer = bytearray()
+    eof = False
+    while True:
+        while not eof and len(buffer) < MAX_CHUNK:
+            data = fileobj.read(MAX_CHUNK)
+            if not data:
+                eof = True
+            buffer += data
+        if not buffer:
+            return
+        cut = _cut_point(memoryview(buffer))
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+@contextmanager
+def store_lock(chunk_dir: str, exclusive: bool = False, blocking: bool = True) -> Iterator[bool]:
+    """flock on the chunk store, shared across processes; yields False if non-blocking and held"""
+    os.makedirs(chunk_dir, exist_ok=True)
+    fd = os.open(os.path.join(chunk_dir, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        try:
+            fcntl.flock(fd, operation if blocking else operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class ChunkStore:
+    """Content-addressed store of zlib-compressed chunks, keyed by SHA-256"""
+
+    def __init__(self, root: str, level: int = 6):
+        self.root = root
+        self.level = level
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, data: bytes) -> Tuple[str, int]:
+        """Store a chunk unless already present; returns (digest, bytes written)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, self.level)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return digest, len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as f:
+            data = zlib.decompress(f.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return data
+
+    def digests(self) -> Iterator[str]:
+        for prefix in os.listdir(self.root):
+            directory = os.path.join(self.root, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".tmp"):
+                    yield name
+
+
+def read_manifest(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(path: str, manifest: dict):
+    tmp_path = path + ".partial"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _walk(source_path: str, exclude_patterns: Optional[List[str]]) -> Iterator[str]:
+    """Paths under source_path (itself included), directories before their contents"""
+    yield source_path
+    if not os.path.isdir(source_path) or os.path.islink(source_path):
+        return
+    for root, dirs, files in os.walk(source_path):
+        dirs[:] = sorted(d for d in dirs if not _excluded(os.path.join(root, d), exclude_patterns))
+        for name in dirs:
+            yield os.path.join(root, name)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not _excluded(path, exclude_patterns):
+                yield path
+
+
+def create_snapshot(
+    backup_id: int,
+    source_path: str,
+    manifest_path: str,
+    chunk_dir: str,
+    previous_manifest: Optional[str] = None,
+    exclude_patterns: Optional[List[str]] = None,
+    level: int = 6
+) -> dict:
+    """Store source_path as chunks plus a manifest, reusing unchanged chunks.
+
+    Files whose size, mtime and inode match the previous manifest reuse its
+    chunk list without being read. Everything else is chunked and hashed,
+    and only chunks not yet in the store are written. Holds the store lock
+    shared until the manifest is written, keeping garbage collection out.
+    """
+    with store_lock(chunk_dir):
+        return _create_snapshot(backup_id, source_path, manifest_path, chunk_dir, previous_manifest, exclude_patterns, level)
+
+
+def _create_snapshot(
+    backup_id: int,
+    source_path: str,
+    manifest_path: str,
+    chunk_dir: str,
+    previous_manifest: Optional[str],
+    exclude_patterns: Optional[List[str]],
+    level: int
+) -> dict:
+    store = ChunkStore(chunk_dir, level)
+    previous: Dict[str, dict] = {}
+    if previous_manifest and os.path.exists(previous_manifest):
+        manifest = read_manifest(previous_manifest)
+        if manifest.get("source_path") == source_path:
+            for entry in manifest["entries"]:
+                if entry["type"] == "file":
+                    previous[entry["path"]] = entry
+
+    base = os.path.dirname(os.path.abspath(source_path))
+    entries = []
+    counters = {"files": 0, "files_unchanged": 0, "bytes_skipped": 0, "bytes_read": 0, "bytes_written": 0, "total_bytes": 0}
+    last_report = 0.0
+
+    def report(status: str = "running", force: bool = False):
+        nonlocal last_report
+        now = time.monotonic()
+        if not force and now - last_report < PROGRESS_INTERVAL:
+            return
+        last_report = now
+        put_progress({"id": backup_id, "status": status, **counters})
+
+    for path in _walk(source_path, exclude_patterns):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        entry = {
+            "path": os.path.relpath(os.path.abspath(path), base),
+            "mode": stat.S_IMODE(st.st_mode),
+            "mtime_ns": st.st_mtime_ns
+        }
+        if stat.S_ISLNK(st.st_mode):
+            entry.update(type="symlink", target=os.readlink(path))
+        elif stat.S_ISDIR(st.st_mode):
+            entry["type"] = "dir"
+        elif stat.S_ISREG(st.st_mode):
+            entry.update(type="file", size=st.st_size, inode=st.st_ino)
+            counters["files"] += 1
+            counters["total_bytes"] += st.st_size
+            old = previous.get(entry["path"])
+            if (
+                old is not None
+                and old["size"] == st.st_size
+                and old["mtime_ns"] == st.st_mtime_ns
+                and old["inode"] == st.st_ino
+            ):
+                entry["chunks"] = old["chunks"]
+                counters["files_unchanged"] += 1
+                counters["bytes_skipped"] += st.st_size
+            else:
+                chunks = []
+                try:
+                    with open(path, "rb") as f:
+                        for data in iter_chunks(f):
+                            digest, written = store.put(data)
+                            chunks.append(digest)
+                            counters["bytes_read"] += len(data)
+                            counters["bytes_written"] += written
+                            report()
+                except OSError:
+                    continue
+                entry["chunks"] = chunks
+        else:
+            # Sockets, fifos and devices are not backed up
+            continue
+        entries.append(entry)
+        report()
+
+    _write_manifest(manifest_path, {
+        "version": MANIFEST_VERSION,
+        "source_path": source_path,
+        "created_at": datetime.utcnow().isoformat(),
+        "entries": entries
+    })
+    report("finalizing", force=True)
+    return counters
+
+
+def restore_snapshot(
+    manifest_path: str,
+    chunk_dir: str,
+    target_path: str,
+    paths: Optional[List[str]] = None
+) -> int:
+    """Recreate a snapshot, or only the given files and subtrees, under target_path.
+
+    Returns the number of files written.
+    """
+    store = ChunkStore(chunk_dir)
+    manifest = read_manifest(manifest_path)
+    target = os.path.abspath(target_path)
+    directories = []
+    files = 0
+    for entry in manifest["entries"]:
+        if paths and not any(
+            entry["path"] == path or entry["path"].startswith(path.rstrip("/") + "/") for path in paths
+        ):
+            continue
+        path = os.path.abspath(os.path.join(target, entry["path"]))
+        if os.path.commonpath([target, path]) != target:
+            raise ValueError(f"Refusing to restore outside target: {entry['path']}")
+        if entry["type"] == "dir":
+            os.makedirs(path, exist_ok=True)
+            directories.append((path, entry))
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.remove(path)
+        if entry["type"] == "symlink":
+            os.symlink(entry["target"], path)
+            continue
+        with open(path, "wb") as f:
+            for digest in entry["chunks"]:
+                f.write(store.get(digest))
+        os.chmod(path, entry["mode"])
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        files += 1
+    # Directory metadata last, after their contents stopped changing
+    for path, entry in reversed(directories):
+        os.chmod(path, entry["mode"])
+        os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+    return files
+
+
+def collect_garbage(chunk_dir: str, manifest_dir: str) -> Optional[Tuple[int, int]]:
+    """Delete chunks no manifest in manifest_dir references; returns (chunks removed, bytes freed).
+
+    Takes the store lock exclusively, in whichever process it runs, and
+    returns None without touching the store while any snapshot is running.
+    """
+    if not os.path.isdir(chunk_dir):
+        return 0, 0
+    with store_lock(chunk_dir, exclusive=True, blocking=False) as locked:
+        if not locked:
+            return None
+        return _collect_garbage(chunk_dir, manifest_dir)
+
+
+def _collect_garbage(chunk_dir: str, manifest_dir: str) -> Tuple[int, int]:
+    store = ChunkStore(chunk_dir)
+    live: Set[str] = set()
+    # Listed under the lock, so every finished snapshot's manifest is seen
+    for name in os.listdir(manifest_dir):
+        if not name.endswith(MANIFEST_EXTENSION):
+            continue
+        try:
+            manifest = read_manifest(os.path.join(manifest_dir, name))
+        except FileNotFoundError:
+            # Deleted meanwhile; its chunks are garbage now
+            continue
+        for entry in manifest["entries"]:
+            live.update(entry.get("chunks", ()))
+    removed = freed = 0
+    for digest in list(store.digests()):
+        if digest not in live:
+            path = store.path(digest)
+            freed += os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+    return removed, freed
@@ -0,0 +1,378 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Command families share a concurrency limit; unknown binaries fall back to "default"
+FAMILIES = {
+    "apt": "apt",
+    "apt-get": "apt",
+    "apt-cache": "apt_query",
+    "dpkg": "apt",
+    "dpkg-query": "apt_query",
+    "systemctl": "systemctl",
+    "hostnamectl": "systemctl",
+    "timedatectl": "systemctl",
+    "journalctl": "journalctl",
+    "docker": "docker",
+    "ufw": "ufw"
+}
+
+# Concurrent processes per family. apt holds a global lock, so it runs one at a time
+FAMILY_LIMITS = {
+    "apt": 1,
+    "apt_query": 4,  # read-only package queries take no dpkg lock
+    "systemctl": 8,
+    "journalctl": 4,
+    "docker": 4,
+    "ufw": 2,
+    "journal_follow": 16,  # long-lived `journalctl --follow` readers, kept apart from one-shot reads
+    "journal_export": 4,  # unbounded NDJSON downloads, paced by the client
+    "default": 8
+}
+
+# How often a running command checks whether the HTTP client went away
+DISCONNECT_POLL_INTERVAL = 0.5
+_READ_SIZE = 64 * 1024
+
+
+class CommandError(Exception):
+    """A command could not be started or did not finish"""
+
+
+class CommandTimeout(CommandError):
+    pass
+
+
+class CommandCancelled(CommandError):
+    """The client that requested the command disconnected"""
+
+
+class CommandResult:
+    """Outcome of a finished command, shaped like subprocess.CompletedProcess"""
+
+    __slots__ = ("args", "returncode", "stdout", "stderr", "duration", "truncated")
+
+    def __init__(self, args: List[str], returncode: int, stdout: str, stderr: str, duration: float, truncated: bool):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+        self.truncated = truncated  # stdout or stderr exceeded max_output and was cut
+
+
+class CommandStats:
+    """Rolling timing statistics of one command family"""
+
+    def __init__(self, window: int = 256):
+        self.durations: Deque[float] = deque(maxlen=window)
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.running = 0
+        self.waiting = 0
+
+    def record(self, duration: float, returncode: Optional[int]):
+        self.runs += 1
+        self.durations.append(duration)
+        if returncode:
+            self.failures += 1
+
+    def summary(self) -> dict:
+        """Counters plus duration summary in milliseconds over the rolling window"""
+        summary = {
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "running": self.running,
+            "waiting": self.waiting
+        }
+        if not self.durations:
+            return {**summary, "avg_ms": None, "p95_ms": None, "max_ms": None}
+        ordered = sorted(self.durations)
+        return {
+            **summary,
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)] * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3)
+        }
+
+
+async def _read_capped(stream: asyncio.StreamReader, limit: int) -> Tuple[bytes, bool]:
+    """Read a stream to EOF, keeping at most limit bytes; the rest is drained and dropped"""
+    data = bytearray()
+    truncated = False
+    while True:
+        chunk = await stream.read(_READ_SIZE)
+        if not chunk:
+            return bytes(data), truncated
+        room = limit - len(data)
+        if room > 0:
+            data += chunk[:room]
+        if len(chunk) > room:
+            truncated = True
+
+
+class CommandRunner:
+    """Runs CLI tools with asyncio subprocesses so handlers never block the event loop.
+
+    Every command is limited per family, killed after a timeout or when the
+    requesting client disconnects, and its output is capped. Identical
+    read-only commands can be coalesced with shared=True, so concurrent
+    callers wait on one process instead of queueing behind each other.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, max_output: Optional[int] = None):
+        settings = get_settings()
+        self.timeout = timeout or settings.COMMAND_TIMEOUT
+        self.max_output = max_output or settings.COMMAND_MAX_OUTPUT
+        self.semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.stats: Dict[str, CommandStats] = {}
+        self._inflight: Dict[Tuple[str, ...], asyncio.Future] = {}
+
+    @staticmethod
+    def family(args: List[str]) -> str:
+        name = os.path.basename(args[0])
+        return FAMILIES.get(name, "default")
+
+    def _family_state(self, family: str) -> Tuple[asyncio.Semaphore, CommandStats]:
+        if family not in self.semaphores:
+            self.semaphores[family] = asyncio.Semaphore(FAMILY_LIMITS.get(family, FAMILY_LIMITS["default"]))
+            self.stats[family] = CommandStats()
+        return self.semaphores[family], self.stats[family]
+
+    async def run(
+        self,
+        args: List[str],
+        timeout: Optional[float] = None,
+        max_output: Optional[int] = None,
+        request: Optional[Request] = None,
+        shared: bool = False
+    ) -> CommandResult:
+        """Run a command and collect its output.
+
+        A non-zero exit status is returned, not raised. CommandError is raised
+        if the binary cannot be started, CommandTimeout once timeout seconds
+        pass and CommandCancelled if request's client disconnects first.
+        """
+        if not shared:
+            return await self._run(args, timeout, max_output, request)
+
+        key = tuple(args)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._run(args, timeout, max_output, None))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller going away must not kill the process the others wait on
+        waiter = asyncio.shield(future)
+        if request is None:
+            return await waiter
+        return await self._until_disconnect(waiter, request, lambda: None)
+
+    async def _run(
+        self,
+        args: List[str],
+        timeout: Optional[float],
+        max_output: Optional[int],
+        request: Optional[Request]
+    ) -> CommandResult:
+        family = self.family(args)
+        semaphore, stats = self._family_state(family)
+        timeout = timeout or self.timeout
+        limit = max_output or self.max_output
+
+        stats.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            stats.waiting -= 1
+        stats.running += 1
+        started = time.perf_counter()
+        process = None
+        try:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            except OSError as e:
+                stats.record(time.perf_counter() - started, None)
+                stats.failures += 1
+                raise CommandError(f"Failed to run {args[0]}: {e}") from e
+
+            async def communicate() -> Tuple[Tuple[bytes, bool], Tuple[bytes, bool]]:
+                out, err = await asyncio.gather(
+                    _read_capped(process.stdout, limit),
+                    _read_capped(process.stderr, limit)
+                )
+                await process.wait()
+                return out, err
+
+            task = asyncio.ensure_future(asyncio.wait_for(communicate(), timeout))
+            try:
+                if request is None:
+                    (stdout, out_cut), (stderr, err_cut) = await task
+                else:
+                    (stdout, out_cut), (stderr, err_cut) = await self._until_disconnect(
+                        task, request, lambda: self._kill(process)
+                    )
+            except asyncio.TimeoutError:
+                stats.timeouts += 1
+                raise CommandTimeout(f"{' '.join(args)} timed out after {timeout}s")
+            except CommandCancelled:
+                stats.cancelled += 1
+                raise
+
+            duration = time.perf_counter() - started
+            stats.record(duration, process.returncode)
+            if out_cut or err_cut:
+                logger.warning(f"Output of {args[0]} truncated to {limit} bytes")
+            return CommandResult(
+                args,
+                process.returncode,
+                stdout.decode(errors="replace"),
+                stderr.decode(errors="replace"),
+                duration,
+                out_cut or err_cut
+            )
+        finally:
+            if process is not None and process.returncode is None:
+                # Timed out, cancelled or the caller's task was cancelled
+                self._kill(process)
+                try:
+                    await asyncio.shield(process.wait())
+                except asyncio.CancelledError:
+                    pass
+            stats.running -= 1
+            semaphore.release()
+
+    async def stream(
+        self,
+        args: List[str],
+        idle_timeout: Optional[float] = None,
+        max_line: Optional[int] = None,
+        family: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        """Yield a command's stdout line by line as it is produced.
+
+        The process holds its family slot until the generator is exhausted or
+        closed; closing it early (or cancelling the consumer) kills the
+        process. CommandTimeout is raised if no line arrives for idle_timeout
+        seconds, so a filter that matches nothing cannot hang the caller;
+        followers that may legitimately stay quiet pass 0 to disable it.
+        Lines longer than max_line bytes are skipped. stderr is discarded.
+        family overrides the concurrency family derived from the binary.
+        """
+        family = family or self.family(args)
+        semaphore, stats = self._family_state(family)
+        if idle_timeout is None:
+            idle_timeout = self.timeout
+        limit = max_line or self.max_output
+
+        stats.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            stats.waiting -= 1
+        stats.running += 1
+        started = time.perf_counter()
+        process = None
+        try:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    limit=limit
+                )
+            except OSError as e:
+                stats.record(time.perf_counter() - started, None)
+                stats.failures += 1
+                raise CommandError(f"Failed to run {args[0]}: {e}") from e
+
+            while True:
+                try:
+                    line = await asyncio.wait_for(process.stdout.readline(), idle_timeout or None)
+                except asyncio.TimeoutError:
+                    stats.timeouts += 1
+                    raise CommandTimeout(f"{' '.join(args)} produced no output for {idle_timeout}s")
+                except ValueError:
+                    # Line over the limit: readline dropped it, carry on with the next
+                    logger.warning(f"Skipped a line over {limit} bytes from {args[0]}")
+                    continue
+                if not line:
+                    break
+                yield line
+            await process.wait()
+            stats.record(time.perf_counter() - started, process.returncode)
+        finally:
+            if process is not None and process.returncode is None:
+                # Closed early by the consumer
+                self._kill(process)
+                try:
+                    await asyncio.shield(process.wait())
+                except asyncio.CancelledError:
+                    pass
+                stats.record(time.perf_counter() - started, None)
+            stats.running -= 1
+            semaphore.release()
+
+    @staticmethod
+    async def _until_disconnect(awaitable, request: Request, on_disconnect):
+        """Await awaitable, giving up with CommandCancelled once the client disconnects"""
+        task = asyncio.ensure_future(awaitable)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                on_disconnect()
+                task.cancel()
+                raise CommandCancelled("Client disconnected")
+
+    @staticmethod
+    def _kill(process: asyncio.subprocess.Process):
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+    async def check(self, args: List[str], error: str, status_code: int = 400, **kwargs) -> CommandResult:
+        """Run a command for a handler, turning failures into HTTPException"""
+        try:
+            result = await self.run(args, **kwargs)
+        except CommandTimeout as e:
+            raise HTTPException(status_code=504, detail=f"{error}: {e}")
+        except CommandCancelled:
+            # Nobody is left to read the response
+            raise HTTPException(status_code=499, detail=f"{error}: client disconnected")
+        except CommandError as e:
+            raise HTTPException(status_code=500, detail=f"{error}: {e}")
+        if result.returncode != 0:
+            raise HTTPException(status_code=status_code, detail=f"{error}: {result.stderr.strip()}")
+        return result
+
+    def get_stats(self) -> dict:
+        """Timing and concurrency statistics per command family"""
+        return {
+            family: {**stats.summary(), "limit": FAMILY_LIMITS.get(family, FAMILY_LIMITS["default"])}
+            for family, stats in self.stats.items()
+        }
+
+
+def get_command_runner(request: Request) -> CommandRunner:
+    """Dependency returning the application's command runner"""
+    return request.app.state.command_runner
@@ -27,8 +27,26 @@ class Settings(BaseSettings):
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
     
     # Database
-    DATABASE_URL: str = "sqlite:///app/data/umc.db"
+    DATABASE_URL: str = "sqlite:////app/data/umc.db"
+    DATABASE_READ_URL: str = ""  # replica for API reads, empty = DATABASE_URL
     REDIS_URL: str = "redis://localhost:6379/0"
+    DB_POOL_SIZE: int = 5  # writer connections per engine (SQLite always writes through one)
+    DB_READER_POOL_SIZE: int = 4  # read-only connections per process
+    DB_MAX_OVERFLOW: int = 10  # extra connections opened under load
+    DB_POOL_TIMEOUT: int = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800  # seconds before a connection is replaced
+    SQLITE_BUSY_TIMEOUT: int = 5000  # ms a connection waits for a lock before failing
+    SQLITE_MMAP_SIZE_MB: int = 256  # database pages read through mmap, 0 = off
+    DB_MAINTENANCE_INTERVAL_HOURS: int = 6  # retention and vacuum runs
+    DB_MAINTENANCE_BATCH_SIZE: int = 5000  # expired rows deleted per write transaction
+    DB_MAINTENANCE_BATCH_PAUSE: float = 0.05  # seconds between batches, letting other writers in
+    DB_MAINTENANCE_VACUUM_PAGES: int = 2048  # free pages released per incremental vacuum step
+    DB_MAINTENANCE_LOCK_PATH: str = "/app/data/db_maintenance.lock"  # one run at a time across workers
+    
+    # Write-behind persistence for metrics, alert history and log entries
+    WRITE_BUFFER_MAX_BATCH: int = 500  # rows per flush before the time watermark
+    WRITE_BUFFER_FLUSH_INTERVAL: int = 300  # seconds
+    WRITE_BUFFER_MAX_PENDING: int = 10000  # rows held in memory before producers wait
     
     # Admin credentials
     ADMIN_USER: str = os.getenv("UMC_ADMIN_USER", "admin")
@@ -37,14 +55,51 @@ class Settings(BaseSettings):
     # Monitoring
     MONITORING_INTERVAL: int = 5  # seconds
     METRICS_RETENTION_DAYS: int = 30
+    METRICS_SNAPSHOT_MAX_AGE: int = 10  # seconds a cached metrics snapshot may be served
+    METRICS_DATA_DIR: str = "/app/data/metrics"
+    PROCESS_PUBLISH_LIMIT: int = 100  # busiest processes broadcast on the processes channel
+    
+    # Per-service (cgroup) and per-process resource history
+    RESOURCE_HISTORY_ENABLED: bool = False
+    RESOURCE_TOP_PROCESSES: int = 10  # process names recorded per tick, by CPU and by memory
+    RESOURCE_MAX_METRICS: int = 2000  # series kept before new units/processes are dropped
+    RESOURCE_DATA_DIR: str = "/app/data/resources"
+    
+    # WebSocket
+    WEBSOCKET_MAX_QUEUE: int = 100  # outbound frames buffered per client before it is dropped
+    
+    # Live log tailing over the "logs" WebSocket channel
+    LOG_TAIL_MAX_RATE: int = 200  # entries/s delivered per followed unit before sampling kicks in
+    
+    # Log ingestion (log_aggregator.py) into the searchable log_entries table
+    LOG_INGEST_JOURNAL: bool = True
+    LOG_INGEST_FILES: str = ""  # comma separated files tailed besides the journal, e.g. /var/log/nginx/error.log
+    LOG_INGEST_BACKFILL_HOURS: int = 24  # journal history read on the first run
+    LOG_INGEST_FLUSH_INTERVAL: int = 2  # seconds
+    LOG_INGEST_STATE_PATH: str = "/app/data/log_ingest.json"
+    LOG_PATTERNS_ENABLED: bool = True  # store repetitive messages as template + parameters
+    LOG_PATTERN_SAMPLE_THRESHOLD: int = 0  # DEBUG/INFO rows kept per pattern and minute before sampling, 0 = keep all
+    LOG_PATTERN_SAMPLE_RATE: int = 10  # past the threshold, one row in this many is kept
+    LOG_RETENTION_DAYS: int = 14  # stored log entries and pattern counts, 0 = keep forever
+    
+    # External commands (systemctl, journalctl, apt, ufw, docker)
+    COMMAND_TIMEOUT: int = 60  # seconds before a command is killed
+    COMMAND_MAX_OUTPUT: int = 4 * 1024 * 1024  # bytes kept per output stream
     
     # Alerts
     ALERT_CHECK_INTERVAL: int = 60  # seconds
-    MAX_ALERT_HISTORY: int = 1000
+    MAX_ALERT_HISTORY: int = 1000  # resolved history rows kept, newest first
     
     # Backup
-    BACKUP_RETENTION_DAYS: int = 30
+    BACKUP_RETENTION_DAYS: int = 30  # for backups without their own retention_days
+    BACKUP_KEEP_DAILY: int = 7  # newest backup of this many recent days is kept past retention, per name
+    BACKUP_KEEP_WEEKLY: int = 4
+    BACKUP_KEEP_MONTHLY: int = 6
     MAX_BACKUP_SIZE_GB: int = 100
+    BACKUP_WORKERS: int = 1  # backups archived concurrently, each in its own process
+    BACKUP_COMPRESSION_THREADS: int = 0  # threads compressing blocks per backup, 0 = one per core
+    BACKUP_COMPRESSION_LEVEL: int = 6
+    BACKUP_BLOCK_SIZE_MB: int = 4  # uncompressed bytes per independently compressed member
     
     # Localization
     TIMEZONE: str = os.getenv("UMC_TIMEZONE", "UTC")
@@ -62,6 +117,8 @@ class Settings(BaseSettings):
     SMTP_USER: str = os.getenv("SMTP_USER", "")
     SMTP_PASSWORD: str = os.getenv("SMTP_PASSWORD", "")
     SMTP_TLS: bool = True
+    SMTP_FROM: str = os.getenv("SMTP_FROM", "")
+    SMTP_TO: str = os.getenv("SMTP_TO", "")  # comma separated recipients
     
     # Slack webhook
     SLACK_WEBHOOK_URL: str = os.getenv("SLACK_WEBHOOK_URL", "")
@@ -69,6 +126,14 @@ class Settings(BaseSettings):
     # Discord webhook
     DISCORD_WEBHOOK_URL: str = os.getenv("DISCORD_WEBHOOK_URL", "")
     
+    # Generic webhook
+    NOTIFICATION_WEBHOOK_URL: str = os.getenv("NOTIFICATION_WEBHOOK_URL", "")
+    
+    # Notification delivery
+    NOTIFICATION_DIGEST_WINDOW: int = 30  # seconds alerts are coalesced per channel
+    NOTIFICATION_MAX_RETRIES: int = 8
+    NOTIFICATION_RETRY_INTERVAL: int = 30  # seconds between retry queue scans
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
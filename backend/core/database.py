@@ -1,8 +1,16 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, JSON
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, Boolean, DateTime, Float, Text, ForeignKey, JSON, Index, UniqueConstraint, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import logging
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
@@ -52,6 +60,11 @@ class Alert(Base):
     triggered_at = Column(DateTime)
     resolved_at = Column(DateTime)
     notification_channels = Column(JSON, default=list)
+    
+    # Every rule reload reads only the active alerts
+    __table_args__ = (
+        Index("ix_alerts_active", "id", sqlite_where=text("is_active = 1"), postgresql_where=text("is_active")),
+    )
 
 class AlertHistory(Base):
     __tablename__ = "alert_history"
@@ -65,6 +78,25 @@ class AlertHistory(Base):
     acknowledged = Column(Boolean, default=False)
     acknowledged_by = Column(String)
     acknowledged_at = Column(DateTime)
+    
+    # Resolving an alert looks up its latest open history row
+    __table_args__ = (
+        Index(
+            "ix_alert_history_open", "alert_id", "triggered_at",
+            sqlite_where=text("resolved_at IS NULL"), postgresql_where=text("resolved_at IS NULL")
+        ),
+    )
+
+class NotificationQueue(Base):
+    __tablename__ = "notification_queue"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    channel = Column(String)  # email, slack, discord, webhook
+    payload = Column(JSON)  # subject, text and alerts of the undelivered message
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(Text)
 
 class Backup(Base):
     __tablename__ = "backups"
@@ -79,7 +111,14 @@ class Backup(Base):
     completed_at = Column(DateTime)
     status = Column(String)  # pending, running, completed, failed
     error_message = Column(Text)
-    retention_days = Column(Integer, default=30)
+    retention_days = Column(Integer)  # None: the BACKUP_RETENTION_DAYS setting applies
+    archive_path = Column(String)  # archive or manifest file; tar archives have an .index.json.gz beside them
+    
+    # Latest backup of a name (failures, incremental bases) and the newest-first listing
+    __table_args__ = (
+        Index("ix_backups_name_created_at", "name", "created_at"),
+        Index("ix_backups_created_at", "created_at"),
+    )
 
 class Service(Base):
     __tablename__ = "services"
@@ -102,8 +141,42 @@ class LogEntry(Base):
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     level = Column(String)  # DEBUG, INFO, WARNING, ERROR, CRITICAL
     source = Column(String)  # component name
-    message = Column(Text)
-    metadata = Column(JSON, default=dict)
+    message = Column(Text)  # NULL when stored as template_id + params
+    # "metadata" is reserved by the declarative API, so the attribute is named meta
+    meta = Column("metadata", JSON, default=dict)
+    template_id = Column(Integer, ForeignKey("log_templates.id"), index=True)
+    params = Column(JSON)  # tokens filling the template's <*> slots, in order
+    
+    # Search filters by level or source within a time range, newest first
+    __table_args__ = (
+        Index("ix_log_entries_level_timestamp", "level", "timestamp"),
+        Index("ix_log_entries_source_timestamp", "source", "timestamp"),
+    )
+
+class LogTemplate(Base):
+    """One version of a learned message pattern; versions are never changed once written"""
+    __tablename__ = "log_templates"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    pattern_id = Column(Integer, index=True)  # id of the pattern's first version
+    source = Column(String, index=True)
+    template = Column(Text)  # space-separated tokens, <*> for variable ones
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LogPatternCount(Base):
+    __tablename__ = "log_pattern_counts"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    pattern_id = Column(Integer)
+    minute = Column(DateTime)
+    level = Column(String)
+    count = Column(Integer, default=0)
+    
+    # "Top patterns since t" reads one minute range of the index, without touching the table
+    __table_args__ = (
+        UniqueConstraint("pattern_id", "minute", "level"),
+        Index("ix_log_pattern_counts_covering", "minute", "level", "pattern_id", "count"),
+    )
 
 class Setting(Base):
     __tablename__ = "settings"
@@ -115,20 +188,259 @@ class Setting(Base):
     description = Column(Text)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-# Database engine and session
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+# Database engines and sessions
+#
+# Writers and readers get separate pools. On SQLite every write is
+# serialized anyway, so each writer engine keeps a single connection and
+# opens its transactions with BEGIN IMMEDIATE: the write lock is taken up
+# front and waited for (busy_timeout), instead of failing when another
+# process (gunicorn workers, the log aggregator, the alert and backup
+# daemons) wrote in between. Readers are read-only connections that, in
+# WAL mode, never wait for the writer. Elsewhere readers may point at a
+# replica (DATABASE_READ_URL).
+settings = get_settings()
+DATABASE_URL = settings.DATABASE_URL
+DATABASE_READ_URL = settings.DATABASE_READ_URL or DATABASE_URL
+IS_SQLITE = make_url(DATABASE_URL).get_backend_name() == "sqlite"
+
+# Async drivers for the sync URL's backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+def async_url(url: str) -> str:
+    """Same database as url, through its asyncio driver"""
+    parsed = make_url(url)
+    return parsed.set(drivername=ASYNC_DRIVERS.get(parsed.get_backend_name(), parsed.drivername)).render_as_string(hide_password=False)
+
+def _pool_options(size: int, max_overflow: int) -> dict:
+    return {
+        "pool_size": size,
+        "max_overflow": max_overflow,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True
+    }
+
+def _writer_pool() -> dict:
+    if IS_SQLITE:
+        return _pool_options(1, 0)
+    return _pool_options(settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW)
+
+def _reader_pool() -> dict:
+    return _pool_options(settings.DB_READER_POOL_SIZE, settings.DB_MAX_OVERFLOW)
+
+def _sqlite_pragmas(dbapi_connection, busy_timeout: int):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE_MB) * 1024 * 1024}")
+    return cursor
+
+def _sqlite_writer_connect(dbapi_connection, connection_record):
+    """WAL lets readers run alongside the writer; NORMAL sync is durable across app crashes in WAL mode"""
+    # Transactions are begun by the "begin" listener, not by the driver
+    dbapi_connection.isolation_level = None
+    cursor = _sqlite_pragmas(dbapi_connection, settings.SQLITE_BUSY_TIMEOUT)
+    # Takes effect when the database is created, or with the next full VACUUM
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def _sqlite_writer_begin(conn):
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def _sqlite_reader_connect(dbapi_connection, connection_record):
+    cursor = _sqlite_pragmas(dbapi_connection, settings.SQLITE_BUSY_TIMEOUT)
+    cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+def _configure(engine: Engine, writer: bool):
+    if engine.dialect.name != "sqlite":
+        return
+    if writer:
+        event.listen(engine, "connect", _sqlite_writer_connect)
+        event.listen(engine, "begin", _sqlite_writer_begin)
+    else:
+        event.listen(engine, "connect", _sqlite_reader_connect)
+
+# Sync writer: background threads (write-behind buffer, notification queue),
+# worker processes and scripts
 engine = create_engine(
-    os.getenv("DATABASE_URL", "sqlite:///app/data/umc.db"),
-    connect_args={"check_same_thread": False} if "sqlite" in os.getenv("DATABASE_URL", "") else {}
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if IS_SQLITE else {},
+    **_writer_pool()
 )
+_configure(engine, writer=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async writer and readers: request handlers and services running on the
+# event loop. aiosqlite would open a connection per session by default;
+# pooling them keeps the pragmas and page cache. expire_on_commit=False
+# keeps loaded attributes usable after commit, as async sessions cannot
+# lazy-load them.
+async_engine = create_async_engine(async_url(DATABASE_URL), poolclass=AsyncAdaptedQueuePool, **_writer_pool())
+_configure(async_engine.sync_engine, writer=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+reader_engine = create_async_engine(async_url(DATABASE_READ_URL), poolclass=AsyncAdaptedQueuePool, **_reader_pool())
+_configure(reader_engine.sync_engine, writer=False)
+AsyncReadSessionLocal = async_sessionmaker(reader_engine, expire_on_commit=False, autoflush=False)
+
+# Full-text index over log_entries.message (SQLite FTS5, external content).
+# Triggers keep it in step with every insert and delete, whichever code path writes.
+# Templated rows have no message, so their params are indexed instead, and
+# the template text in a second index, tokenized the same way.
+LOG_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS log_entries_fts USING fts5("
+    "message, content='log_entries', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS log_entries_fts_insert AFTER INSERT ON log_entries BEGIN "
+    "INSERT INTO log_entries_fts(rowid, message) VALUES (new.id, coalesce(new.message, new.params)); END",
+    "CREATE TRIGGER IF NOT EXISTS log_entries_fts_delete AFTER DELETE ON log_entries BEGIN "
+    "INSERT INTO log_entries_fts(log_entries_fts, rowid, message) "
+    "VALUES ('delete', old.id, coalesce(old.message, old.params)); END",
+    "CREATE TRIGGER IF NOT EXISTS log_entries_fts_update AFTER UPDATE OF message, params ON log_entries BEGIN "
+    "INSERT INTO log_entries_fts(log_entries_fts, rowid, message) "
+    "VALUES ('delete', old.id, coalesce(old.message, old.params)); "
+    "INSERT INTO log_entries_fts(rowid, message) VALUES (new.id, coalesce(new.message, new.params)); END",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS log_templates_fts USING fts5("
+    "template, content='log_templates', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS log_templates_fts_insert AFTER INSERT ON log_templates BEGIN "
+    "INSERT INTO log_templates_fts(rowid, template) VALUES (new.id, new.template); END",
+    "CREATE TRIGGER IF NOT EXISTS log_templates_fts_delete AFTER DELETE ON log_templates BEGIN "
+    "INSERT INTO log_templates_fts(log_templates_fts, rowid, template) VALUES ('delete', old.id, old.template); END"
+]
+
+# Triggers replaced on startup so older definitions pick up changes
+LOG_SEARCH_TRIGGERS = [
+    "log_entries_fts_insert", "log_entries_fts_delete", "log_entries_fts_update",
+    "log_templates_fts_insert", "log_templates_fts_delete"
+]
+
+LOG_SEARCH_TABLES = ["log_entries_fts", "log_templates_fts"]
+
+def setup_log_search(bind=None) -> bool:
+    """Create the log full-text index if the database supports it; returns whether it exists"""
+    bind = bind or engine
+    if bind.dialect.name != "sqlite":
+        return False
+    try:
+        with bind.begin() as conn:
+            existed = {
+                name for name, in conn.execute(text(
+                    "SELECT name FROM sqlite_master WHERE name IN ('log_entries_fts', 'log_templates_fts')"
+                ))
+            }
+            for trigger in LOG_SEARCH_TRIGGERS:
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            for statement in LOG_SEARCH_DDL:
+                conn.execute(text(statement))
+            for table in LOG_SEARCH_TABLES:
+                if table not in existed:
+                    # Index rows written before the index existed
+                    conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+    except OperationalError as e:
+        logger.warning(f"Log full-text index unavailable, searching with LIKE: {e}")
+        return False
+    return True
+
+def add_missing_columns(bind=None):
+    """Add nullable columns introduced since a table was created; create_all never alters tables"""
+    bind = bind or engine
+    inspector = inspect(bind)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or column.primary_key or not column.nullable:
+                continue
+            with bind.begin() as conn:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                ))
+            logger.info(f"Added column {table.name}.{column.name}")
+
+def _drop_pattern_count_index(conn):
+    conn.execute(text("DROP INDEX IF EXISTS ix_log_pattern_counts_minute_level"))
+
+def _analyze(conn):
+    conn.execute(text("ANALYZE"))
+
+# Schema changes that declaring the models cannot express, applied once
+# per database in version order. Append only: never edit or renumber an
+# entry that has shipped.
+SCHEMA_MIGRATIONS = [
+    (1, "drop pattern count index superseded by ix_log_pattern_counts_covering", _drop_pattern_count_index),
+    (2, "planner statistics for the composite and partial indexes", _analyze),
+]
+
+def run_migrations(bind=None) -> int:
+    """Apply pending SCHEMA_MIGRATIONS; returns how many were applied"""
+    bind = bind or engine
+    applied = 0
+    for version, name, migrate in SCHEMA_MIGRATIONS:
+        # Checked inside the migration's own transaction: on SQLite the writer
+        # begins IMMEDIATE, so workers starting together apply it exactly once
+        with bind.begin() as conn:
+            if conn.execute(
+                SchemaMigration.__table__.select().where(SchemaMigration.version == version)
+            ).first() is not None:
+                continue
+            migrate(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.utcnow()
+            ))
+        logger.info(f"Applied schema migration {version}: {name}")
+        applied += 1
+    return applied
+
+def sync_schema(bind=None):
+    """Bring a database up to the models: tables, columns, indexes, full-text index, migrations; blocking"""
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    add_missing_columns(bind)
+    # create_all skips existing tables, including indexes added to them later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+    setup_log_search(bind)
+    run_migrations(bind)
+
 async def init_db():
     """Initialize database tables"""
-    Base.metadata.create_all(bind=engine)
+    database = make_url(DATABASE_URL).database
+    if IS_SQLITE and database and database != ":memory:":
+        os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    sync_schema()
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    """Session on the writer; for requests that change data"""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    """Session on the read-only pool; for requests that only query"""
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+async def close_db():
+    """Close pooled connections of every engine"""
+    await reader_engine.dispose()
+    await async_engine.dispose()
+    engine.dispose()
\ No newline at end of file
@@ -0,0 +1,188 @@
+import json
+import logging
+from contextlib import aclosing
+from datetime import datetime, timezone
+from typing import AsyncIterator, List, Optional
+from fastapi import Request
+from .commands import CommandRunner
+
+logger = logging.getLogger(__name__)
+
+# syslog priority names accepted wherever a numeric priority is
+PRIORITIES = {
+    "emerg": 0,
+    "alert": 1,
+    "crit": 2,
+    "err": 3,
+    "warning": 4,
+    "notice": 5,
+    "info": 6,
+    "debug": 7
+}
+
+# Journal fields requested from journalctl; __CURSOR and __REALTIME_TIMESTAMP always come along
+OUTPUT_FIELDS = "MESSAGE,PRIORITY,_SYSTEMD_UNIT,SYSLOG_IDENTIFIER,_COMM,_PID,_HOSTNAME"
+
+MAX_PAGE_SIZE = 1000
+
+
+def parse_priority(priority) -> Optional[int]:
+    """Numeric priority from a name or number; ValueError if it is neither"""
+    if priority is None or priority == "":
+        return None
+    if isinstance(priority, str) and priority.lower() in PRIORITIES:
+        return PRIORITIES[priority.lower()]
+    value = int(priority)
+    if not 0 <= value <= 7:
+        raise ValueError(f"Priority out of range: {priority}")
+    return value
+
+
+def _text(value) -> str:
+    """journalctl encodes non-UTF-8 fields as byte arrays and repeated fields as lists"""
+    if isinstance(value, list):
+        if value and isinstance(value[0], int):
+            return bytes(value).decode(errors="replace")
+        return _text(value[0]) if value else ""
+    return value if value is not None else ""
+
+
+def parse_entry(line: bytes) -> Optional[dict]:
+    """One `journalctl -o json` line as an API entry, or None if it is not valid JSON"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    realtime = int(record.get("__REALTIME_TIMESTAMP", 0))
+    priority = record.get("PRIORITY")
+    pid = record.get("_PID")
+    return {
+        "cursor": record.get("__CURSOR"),
+        "timestamp": datetime.fromtimestamp(realtime / 1e6, timezone.utc).isoformat(),
+        "unit": _text(record.get("_SYSTEMD_UNIT")) or None,
+        "identifier": _text(record.get("SYSLOG_IDENTIFIER") or record.get("_COMM")) or None,
+        "pid": int(pid) if isinstance(pid, str) and pid.isdigit() else None,
+        "priority": int(priority) if isinstance(priority, str) and priority.isdigit() else None,
+        "hostname": _text(record.get("_HOSTNAME")) or None,
+        "message": _text(record.get("MESSAGE"))
+    }
+
+
+def format_entry(entry: dict) -> str:
+    """Entry rendered like journalctl's short-iso output"""
+    source = entry["identifier"] or entry["unit"] or ""
+    if entry["pid"] is not None:
+        source = f"{source}[{entry['pid']}]"
+    return f"{entry['timestamp']} {entry['hostname'] or ''} {source}: {entry['message']}"
+
+
+class JournalReader:
+    """Reads the systemd journal by streaming `journalctl -o json`.
+
+    Filters (unit, priority, time range, grep) are passed to journalctl so
+    the journal is filtered at the source, and entries are parsed one line
+    at a time as they arrive: nothing holds the full output in memory.
+    Every entry carries its journal cursor; passing the last one back
+    continues right after it, so paging never re-reads earlier entries.
+    """
+
+    def __init__(self, runner: CommandRunner):
+        self.runner = runner
+
+    @staticmethod
+    def build_args(
+        unit: Optional[str] = None,
+        priority=None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        grep: Optional[str] = None,
+        cursor: Optional[str] = None,
+        reverse: bool = True
+    ) -> List[str]:
+        """journalctl arguments; values use --opt=value so they can never be read as options"""
+        args = ["journalctl", "--no-pager", "--output=json", f"--output-fields={OUTPUT_FIELDS}"]
+        if reverse:
+            args.append("--reverse")
+        if unit:
+            args.append(f"--unit={unit}")
+        level = parse_priority(priority)
+        if level is not None:
+            args.append(f"--priority={level}")
+        if since:
+            args.append(f"--since={since}")
+        if until:
+            args.append(f"--until={until}")
+        if grep:
+            args.append(f"--grep={grep}")
+        if cursor:
+            # Continue in the read direction, excluding the cursor's own entry
+            args.append(f"--after-cursor={cursor}")
+        return args
+
+    async def entries(
+        self,
+        limit: Optional[int] = None,
+        family: Optional[str] = None,
+        **filters
+    ) -> AsyncIterator[dict]:
+        """Yield up to limit parsed entries, newest first unless reverse=False.
+
+        family overrides the command family journalctl runs under.
+        """
+        if limit is not None and limit <= 0:
+            return
+        count = 0
+        async with aclosing(self.runner.stream(self.build_args(**filters), family=family)) as lines:
+            async for line in lines:
+                entry = parse_entry(line)
+                if entry is None:
+                    continue
+                yield entry
+                count += 1
+                if limit is not None and count >= limit:
+                    # Leaving the block closes the stream and kills journalctl
+                    return
+
+    async def page(self, limit: int = 100, **filters) -> dict:
+        """One page of entries plus the cursor that continues after it"""
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        entries = []
+        has_more = False
+        # One entry past the page tells whether there is a next page
+        async with aclosing(self.entries(limit + 1, **filters)) as stream:
+            async for entry in stream:
+                if len(entries) == limit:
+                    has_more = True
+                    break
+                entries.append(entry)
+        return {
+            "entries": entries,
+            "next_cursor": entries[-1]["cursor"] if has_more else None,
+            "has_more": has_more
+        }
+
+    async def follow(
+        self,
+        unit: Optional[str] = None,
+        cursor: Optional[str] = None,
+        since: Optional[str] = None
+    ) -> AsyncIterator[dict]:
+        """Yield entries as they are written, until closed; never times out while idle.
+
+        Without cursor or since only new entries are returned; with them the
+        backlog after that point comes first.
+        """
+        args = self.build_args(unit=unit, since=since, cursor=cursor, reverse=False) + ["--follow"]
+        if not cursor and not since:
+            args.append("--lines=0")
+        stream = self.runner.stream(args, idle_timeout=0, family="journal_follow")
+        async with aclosing(stream) as lines:
+            async for line in lines:
+                entry = parse_entry(line)
+                if entry is not None:
+                    yield entry
+
+
+def get_journal_reader(request: Request) -> JournalReader:
+    """Dependency returning the application's journal reader"""
+    return request.app.state.journal_reader
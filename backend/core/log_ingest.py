@@ -0,0 +1,346 @@
+import os
+import re
+import json
+import asyncio
+import logging
+from contextlib import aclosing
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from .database import LogEntry, LogTemplate
+from .journal import JournalReader
+from .log_patterns import PatternMiner, store_counts
+from .write_buffer import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+# journald priority -> stored level name
+PRIORITY_LEVELS = {
+    0: "CRITICAL",
+    1: "CRITICAL",
+    2: "CRITICAL",
+    3: "ERROR",
+    4: "WARNING",
+    5: "INFO",
+    6: "INFO",
+    7: "DEBUG"
+}
+
+# Severity words looked for near the start of file lines without a priority
+LEVEL_WORDS = {
+    "emerg": "CRITICAL",
+    "alert": "CRITICAL",
+    "crit": "CRITICAL",
+    "critical": "CRITICAL",
+    "fatal": "CRITICAL",
+    "err": "ERROR",
+    "error": "ERROR",
+    "warn": "WARNING",
+    "warning": "WARNING",
+    "debug": "DEBUG"
+}
+_LEVEL_WORD = re.compile(r"\b(" + "|".join(LEVEL_WORDS) + r")\b", re.IGNORECASE)
+
+# "Oct 17 10:00:00 host sshd[123]: message" and the RFC 3339 variant rsyslog writes
+_SYSLOG_LINE = re.compile(
+    r"^(?P<timestamp>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d|\d{4}-\d\d-\d\dT\S+) "
+    r"(?P<host>\S+) (?P<ident>[^\s:\[]+)(?:\[(?P<pid>\d+)\])?: ?(?P<message>.*)$"
+)
+
+MAX_MESSAGE = 16 * 1024  # characters stored per entry
+MAX_READ = 1024 * 1024  # bytes read from one file per poll
+FILE_POLL_INTERVAL = 1.0  # seconds
+CHECKPOINT_INTERVAL = 10.0  # seconds
+RESTART_DELAY = 5  # seconds before a failed journal follower is restarted
+
+
+def _utc_naive(value: datetime) -> datetime:
+    """Naive UTC, as every other timestamp in the database"""
+    if value.tzinfo is None:
+        # Local time, as syslog writes it
+        value = value.astimezone()
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def level_from_message(message: str) -> str:
+    match = _LEVEL_WORD.search(message, 0, 200)
+    return LEVEL_WORDS[match.group(1).lower()] if match else "INFO"
+
+
+def journal_row(entry: dict) -> dict:
+    """LogEntry row for a parsed journal entry (see journal.parse_entry)"""
+    return {
+        "timestamp": _utc_naive(datetime.fromisoformat(entry["timestamp"])),
+        "level": PRIORITY_LEVELS.get(entry["priority"], "INFO"),
+        "source": entry["unit"] or entry["identifier"] or "journal",
+        "message": entry["message"][:MAX_MESSAGE],
+        "meta": {
+            "origin": "journal",
+            "unit": entry["unit"],
+            "identifier": entry["identifier"],
+            "pid": entry["pid"],
+            "host": entry["hostname"]
+        }
+    }
+
+
+def file_row(line: str, path: str, now: Optional[datetime] = None) -> dict:
+    """LogEntry row for one line of a log file; syslog-format lines are split into their fields"""
+    now = now or datetime.now()
+    match = _SYSLOG_LINE.match(line)
+    timestamp = None
+    if match is not None:
+        stamp = match.group("timestamp")
+        try:
+            if stamp[0].isdigit():
+                timestamp = datetime.fromisoformat(stamp)
+            else:
+                # Classic syslog stamps carry no year; a date ahead of now belongs to last year
+                timestamp = datetime.strptime(f"{now.year} {stamp}", "%Y %b %d %H:%M:%S")
+                if timestamp > now + timedelta(days=1):
+                    timestamp = timestamp.replace(year=now.year - 1)
+        except ValueError:
+            # Looks like syslog but the stamp is no valid date (e.g. Feb 29 outside a leap year)
+            timestamp = None
+    if timestamp is None:
+        return {
+            "timestamp": _utc_naive(now),
+            "level": level_from_message(line),
+            "source": os.path.basename(path),
+            "message": line[:MAX_MESSAGE],
+            "meta": {"origin": "file", "file": path}
+        }
+    message = match.group("message")
+    pid = match.group("pid")
+    return {
+        "timestamp": _utc_naive(timestamp),
+        "level": level_from_message(message),
+        "source": match.group("ident"),
+        "message": message[:MAX_MESSAGE],
+        "meta": {
+            "origin": "file",
+            "file": path,
+            "identifier": match.group("ident"),
+            "pid": int(pid) if pid else None,
+            "host": match.group("host")
+        }
+    }
+
+
+class FileTailer:
+    """Reads lines appended to a file, following rotation and truncation.
+
+    A file seen for the first time is read from its end. The position
+    (inode and offset of the last complete line) survives restarts
+    through state().
+    """
+
+    def __init__(self, path: str, state: Optional[dict] = None):
+        self.path = path
+        self.inode: Optional[int] = state.get("inode") if state else None
+        self.offset: int = state.get("offset", 0) if state else 0
+        self._partial = b""
+        self.behind = False  # more data was already written than the last read returned
+
+    def state(self) -> dict:
+        return {"inode": self.inode, "offset": self.offset - len(self._partial)}
+
+    def read(self) -> List[str]:
+        """Complete lines appended since the last call; blocking"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return []
+        if self.inode is None:
+            self.inode, self.offset = st.st_ino, st.st_size
+        elif st.st_ino != self.inode or st.st_size < self.offset:
+            # Rotated or truncated: start over on the new file
+            self.inode, self.offset, self._partial = st.st_ino, 0, b""
+        if st.st_size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(MAX_READ)
+        self.offset += len(data)
+        self.behind = self.offset < st.st_size
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if len(self._partial) > MAX_MESSAGE * 4:
+            # A line without an end in sight is stored in pieces
+            lines.append(self._partial)
+            self._partial = b""
+        return [line.decode(errors="replace").rstrip("\r") for line in lines if line.strip()]
+
+
+class LogIngestor:
+    """Streams the journal and log files into the log_entries table.
+
+    Entries are parsed into LogEntry rows and batch-inserted through a
+    write-behind buffer; the full-text and level/source/time indexes are
+    maintained by the database on insert. The journal cursor and file
+    offsets are checkpointed only after the rows before them are
+    committed, so a restart resumes without gaps (at worst repeating the
+    entries of one checkpoint interval). Once the buffer drops rows, no
+    later checkpoint is saved: a restart re-reads from the last one.
+
+    With a PatternMiner, messages are clustered into templates: rows that
+    fit one store template_id + params instead of the message, every
+    occurrence is counted per pattern and minute, and once a DEBUG/INFO
+    pattern passes sample_threshold rows in a minute only one row in
+    sample_rate is kept (the counts stay exact).
+    """
+
+    def __init__(
+        self,
+        write_buffer: WriteBehindBuffer,
+        reader: Optional[JournalReader],
+        files: List[str],
+        state_path: str,
+        backfill_hours: int = 0,
+        patterns: Optional[PatternMiner] = None,
+        sample_threshold: int = 0,
+        sample_rate: int = 10
+    ):
+        self.write_buffer = write_buffer
+        self.reader = reader
+        self.state_path = state_path
+        self.backfill_hours = backfill_hours
+        self.patterns = patterns
+        self.sample_threshold = sample_threshold
+        self.sample_rate = max(1, sample_rate)
+        state = self._load_state()
+        self.journal_cursor: Optional[str] = state.get("journal_cursor")
+        self.files = [FileTailer(path, state.get("files", {}).get(path)) for path in files]
+        self.stats: Dict[str, int] = {"journal": 0, "files": 0, "templated": 0, "sampled": 0, "checkpoints": 0}
+        self._tasks: List[asyncio.Task] = []
+        self._committed_seq = 0  # write buffer sequence number covered by the last checkpoint
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable log ingest state {self.state_path}: {e}")
+            return {}
+
+    def _state(self) -> dict:
+        return {
+            "journal_cursor": self.journal_cursor,
+            "files": {tailer.path: tailer.state() for tailer in self.files}
+        }
+
+    def _save_state(self, state: dict):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        partial = f"{self.state_path}.partial"
+        with open(partial, "w") as f:
+            json.dump(state, f)
+        os.replace(partial, self.state_path)
+
+    async def start(self):
+        if self.patterns is not None:
+            await asyncio.to_thread(self.patterns.load)
+        if self.reader is not None:
+            self._tasks.append(asyncio.create_task(self._follow_journal()))
+        if self.files:
+            self._tasks.append(asyncio.create_task(self._tail_files()))
+        self._tasks.append(asyncio.create_task(self._checkpoint_loop()))
+        logger.info(
+            f"Log ingestion started (journal: {self.reader is not None}, files: {[t.path for t in self.files]})"
+        )
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.checkpoint()
+
+    async def checkpoint(self):
+        """Commit buffered rows, then record how far they reach"""
+        state = self._state()
+        seq = self.write_buffer.enqueued_seq
+        if not await self.write_buffer.flush_async(since=self._committed_seq):
+            logger.error(
+                f"Buffered log rows were not all committed; keeping the checkpoint in {self.state_path} "
+                f"so a restart re-reads them"
+            )
+            return
+        self._committed_seq = seq
+        if self.patterns is not None:
+            counts = self.patterns.take_counts()
+            try:
+                await asyncio.to_thread(store_counts, counts)
+            except Exception:
+                self.patterns.restore_counts(counts)
+                raise
+        await asyncio.to_thread(self._save_state, state)
+        self.stats["checkpoints"] += 1
+
+    async def _store(self, row: dict):
+        """Template, count and enqueue one row, unless sampling skips it"""
+        match = self.patterns.match(row["source"], row["message"]) if self.patterns is not None else None
+        if match is not None:
+            if match.new_template is not None:
+                await self.write_buffer.put(LogTemplate, match.new_template)
+            seen = self.patterns.count(match.pattern_id, row["timestamp"], row["level"])
+            if (
+                self.sample_threshold
+                and row["level"] in ("DEBUG", "INFO")
+                and seen > self.sample_threshold
+                and (seen - self.sample_threshold) % self.sample_rate
+            ):
+                self.stats["sampled"] += 1
+                return
+            row["template_id"] = match.template_id
+            if match.params is not None:
+                # JSON params only when set: a None would be stored as the JSON text "null"
+                row["params"] = match.params
+                row["message"] = None
+                self.stats["templated"] += 1
+        await self.write_buffer.put(LogEntry, row)
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                logger.error(f"Error checkpointing log ingestion: {e}")
+
+    async def _follow_journal(self):
+        while True:
+            since = None
+            if self.journal_cursor is None and self.backfill_hours:
+                since = f"-{self.backfill_hours}h"
+            try:
+                entries = self.reader.follow(cursor=self.journal_cursor, since=since)
+                async with aclosing(entries) as stream:
+                    async for entry in stream:
+                        await self._store(journal_row(entry))
+                        self.journal_cursor = entry["cursor"]
+                        self.stats["journal"] += 1
+                logger.warning("Journal follower exited")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error ingesting journal: {e}")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def _tail_files(self):
+        while True:
+            for tailer in self.files:
+                try:
+                    lines = await asyncio.to_thread(tailer.read)
+                except OSError as e:
+                    logger.error(f"Error reading {tailer.path}: {e}")
+                    continue
+                now = datetime.now()
+                for line in lines:
+                    try:
+                        await self._store(file_row(line, tailer.path, now))
+                    except Exception as e:
+                        logger.error(f"Error ingesting line from {tailer.path}: {e}")
+                self.stats["files"] += len(lines)
+            if not any(tailer.behind for tailer in self.files):
+                await asyncio.sleep(FILE_POLL_INTERVAL)
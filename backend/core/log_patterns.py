@@ -0,0 +1,250 @@
+import re
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from sqlalchemy import func, literal_column
+from sqlalchemy.orm import Session
+from .database import LogPatternCount, LogTemplate, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+WILDCARD = "<*>"
+
+# Tokens that are variables whatever the message: numbers, hex ids, IPs, UUIDs, paths with digits
+_VARIABLE = re.compile(
+    r"^(?:[-+]?\d+(?:[.,:]\d+)*[a-zA-Z%]{0,3}"
+    r"|0x[0-9a-fA-F]+|[0-9a-fA-F]{8,}"
+    r"|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?"
+    r"|\S*/\S*\d\S*)$"
+)
+
+SIMILARITY_THRESHOLD = 0.5  # share of positions that must equal a template to join it
+MAX_CLUSTERS_PER_LEAF = 100
+MAX_TOKENS = 64  # longer messages are stored as they are
+
+
+def tokenize(message: str) -> List[str]:
+    return message.split()
+
+
+def mask(tokens: List[str]) -> List[str]:
+    return [WILDCARD if _VARIABLE.match(token) else token for token in tokens]
+
+
+def render(template: str, params: List[str]) -> str:
+    """Message of a templated row, params filling the <*> slots in order"""
+    values = iter(params)
+    return " ".join(next(values, WILDCARD) if token == WILDCARD else token for token in template.split(" "))
+
+
+class _Cluster:
+    __slots__ = ("pattern_id", "template_id", "tokens")
+
+    def __init__(self, pattern_id: int, template_id: int, tokens: List[str]):
+        self.pattern_id = pattern_id
+        self.template_id = template_id  # current version
+        self.tokens = tokens
+
+    def similarity(self, tokens: List[str]) -> Tuple[float, int]:
+        """(share of equal positions, fewer wildcards), compared best first; masked variables equal <*>"""
+        same = sum(1 for mine, theirs in zip(self.tokens, tokens) if mine == theirs)
+        wildcards = self.tokens.count(WILDCARD)
+        return same / len(tokens), -wildcards
+
+
+class PatternMatch:
+    """Outcome of PatternMiner.match()"""
+
+    __slots__ = ("pattern_id", "template_id", "params", "new_template")
+
+    def __init__(self, pattern_id: int, template_id: int, params: Optional[List[str]], new_template: Optional[dict]):
+        self.pattern_id = pattern_id
+        self.template_id = template_id
+        self.params = params  # None if the message cannot be rebuilt from the template exactly
+        self.new_template = new_template  # LogTemplate row to insert before the entry, if any
+
+
+class PatternMiner:
+    """Online message clustering in the style of Drain.
+
+    Messages are split on whitespace, obvious variables (numbers, ids,
+    addresses) are masked, and the result is looked up in a fixed-depth
+    tree: source, then token count, then first token. The closest
+    template in that leaf is joined if enough positions agree, turning
+    the disagreeing ones into <*>; otherwise a new pattern starts.
+
+    Every template change is a new immutable LogTemplate version, so rows
+    stored against an older version still render exactly. Ids are
+    allocated here, which assumes a single writer (the log aggregator).
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal):
+        self.session_factory = session_factory
+        self._tree: Dict[Tuple[str, int, str], List[_Cluster]] = {}
+        self._next_id = 1
+        self.counts: Dict[Tuple[int, datetime, str], int] = {}  # unsaved, per level
+        self._minute_totals: Dict[Tuple[int, datetime], int] = {}  # recent minutes, for sampling
+        self.stats: Dict[str, int] = {"matched": 0, "patterns": 0, "versions": 0, "raw": 0}
+
+    def load(self):
+        """Rebuild the tree from the latest version of every stored pattern; blocking"""
+        db = self.session_factory()
+        try:
+            latest = db.query(func.max(LogTemplate.id)).group_by(LogTemplate.pattern_id)
+            rows = db.query(LogTemplate).filter(LogTemplate.id.in_(latest)).all()
+            self._next_id = (db.query(func.max(LogTemplate.id)).scalar() or 0) + 1
+        finally:
+            db.close()
+        for row in rows:
+            tokens = row.template.split(" ")
+            self._leaf(row.source, tokens).append(_Cluster(row.pattern_id, row.id, tokens))
+        self.stats["patterns"] = len(rows)
+        logger.info(f"Loaded {len(rows)} log patterns")
+
+    def _leaf(self, source: str, tokens: List[str]) -> List[_Cluster]:
+        return self._tree.setdefault((source, len(tokens), tokens[0]), [])
+
+    def _new_version(self, source: str, pattern_id: Optional[int], tokens: List[str]) -> dict:
+        template_id = self._next_id
+        self._next_id += 1
+        self.stats["versions"] += 1
+        return {
+            "id": template_id,
+            "pattern_id": pattern_id or template_id,
+            "source": source,
+            "template": " ".join(tokens),
+            "created_at": datetime.utcnow()
+        }
+
+    def match(self, source: str, message: str) -> Optional[PatternMatch]:
+        """Pattern of a message, learning from it; None for messages that are not clustered"""
+        tokens = tokenize(message)
+        if not tokens or len(tokens) > MAX_TOKENS:
+            self.stats["raw"] += 1
+            return None
+        # Masked first, so a variable first token cannot scatter a pattern over many leaves
+        masked = mask(tokens)
+        leaf = self._leaf(source, masked)
+
+        best: Optional[_Cluster] = None
+        best_score = None
+        for cluster in leaf:
+            score = cluster.similarity(masked)
+            if best_score is None or score > best_score:
+                best, best_score = cluster, score
+
+        new_template = None
+        if best is None or best_score[0] < SIMILARITY_THRESHOLD:
+            if len(leaf) >= MAX_CLUSTERS_PER_LEAF:
+                self.stats["raw"] += 1
+                return None
+            new_template = self._new_version(source, None, masked)
+            best = _Cluster(new_template["id"], new_template["id"], masked)
+            leaf.append(best)
+            self.stats["patterns"] += 1
+        else:
+            merged = [mine if mine == theirs else WILDCARD for mine, theirs in zip(best.tokens, masked)]
+            if merged != best.tokens:
+                new_template = self._new_version(source, best.pattern_id, merged)
+                best.tokens = merged
+                best.template_id = new_template["id"]
+            self.stats["matched"] += 1
+
+        # Only single-spaced messages round-trip through " ".join
+        params = None
+        if " ".join(tokens) == message:
+            params = [token for token, slot in zip(tokens, best.tokens) if slot == WILDCARD]
+        return PatternMatch(best.pattern_id, best.template_id, params, new_template)
+
+    def count(self, pattern_id: int, timestamp: datetime, level: str) -> int:
+        """Count an occurrence in its minute; returns the pattern's count in that minute so far"""
+        minute = timestamp.replace(second=0, microsecond=0)
+        key = (pattern_id, minute, level)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        total = self._minute_totals.get((pattern_id, minute), 0) + 1
+        self._minute_totals[(pattern_id, minute)] = total
+        return total
+
+    def take_counts(self) -> Dict[Tuple[int, datetime, str], int]:
+        """Detach the counts gathered since the last call"""
+        counts, self.counts = self.counts, {}
+        if self._minute_totals:
+            newest = max(minute for _, minute in self._minute_totals)
+            self._minute_totals = {
+                key: total for key, total in self._minute_totals.items()
+                if (newest - key[1]).total_seconds() <= 120
+            }
+        return counts
+
+    def restore_counts(self, counts: Dict[Tuple[int, datetime, str], int]):
+        """Put back counts taken but not stored, to be taken again on the next call"""
+        for key, count in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+
+def store_counts(counts: Dict[Tuple[int, datetime, str], int], session_factory: Callable[[], Session] = SessionLocal):
+    """Add per-minute occurrence counts to log_pattern_counts; blocking"""
+    if not counts:
+        return
+    db = session_factory()
+    try:
+        for (pattern_id, minute, level), count in counts.items():
+            updated = db.query(LogPatternCount).filter(
+                LogPatternCount.pattern_id == pattern_id,
+                LogPatternCount.minute == minute,
+                LogPatternCount.level == level
+            ).update({LogPatternCount.count: LogPatternCount.count + count}, synchronize_session=False)
+            if not updated:
+                db.add(LogPatternCount(pattern_id=pattern_id, minute=minute, level=level, count=count))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def top_patterns(
+    db: Session,
+    since: datetime,
+    levels: Optional[List[str]] = None,
+    source: Optional[str] = None,
+    limit: int = 20
+) -> List[dict]:
+    """Most frequent patterns since a time, from the per-minute counts; blocking"""
+    total = func.sum(LogPatternCount.count).label("total")
+    group = LogPatternCount.pattern_id
+    if db.get_bind().dialect.name == "sqlite":
+        # Unary + keeps SQLite from grouping in unique index order, which walks
+        # every stored minute; the covering index reads only the range
+        group = literal_column("+log_pattern_counts.pattern_id")
+    q = db.query(LogPatternCount.pattern_id, total).filter(LogPatternCount.minute >= since.replace(second=0, microsecond=0))
+    if levels:
+        q = q.filter(LogPatternCount.level.in_(levels))
+    if source:
+        q = q.filter(LogPatternCount.pattern_id.in_(
+            db.query(LogTemplate.pattern_id).filter(LogTemplate.source == source)
+        ))
+    ranked = q.group_by(group).order_by(total.desc()).limit(limit).all()
+    if not ranked:
+        return []
+
+    pattern_ids = [pattern_id for pattern_id, _ in ranked]
+    latest = db.query(func.max(LogTemplate.id)).filter(
+        LogTemplate.pattern_id.in_(pattern_ids)
+    ).group_by(LogTemplate.pattern_id)
+    templates = {row.pattern_id: row for row in db.query(LogTemplate).filter(LogTemplate.id.in_(latest))}
+    first_seen = dict(db.query(LogTemplate.pattern_id, func.min(LogTemplate.created_at)).filter(
+        LogTemplate.pattern_id.in_(pattern_ids)
+    ).group_by(LogTemplate.pattern_id).all())
+    return [
+        {
+            "pattern_id": pattern_id,
+            "template": templates[pattern_id].template if pattern_id in templates else None,
+            "source": templates[pattern_id].source if pattern_id in templates else None,
+            "count": count,
+            "first_seen": first_seen[pattern_id].isoformat() if first_seen.get(pattern_id) else None
+        }
+        for pattern_id, count in ranked
+    ]
@@ -0,0 +1,177 @@
+import re
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import String, and_, bindparam, cast, or_, text
+from sqlalchemy.orm import Session
+from .database import LOG_SEARCH_TABLES, LogEntry, LogTemplate
+from .log_patterns import render
+
+# Stored level names, least to most severe
+LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+
+MAX_SEARCH_LIMIT = 1000
+
+# Words of a search query; a trailing * makes the word a prefix
+_TERM = re.compile(r"[^\s\"*]+\*?")
+
+_fts_available: Optional[bool] = None
+
+
+def full_text_available(db: Session) -> bool:
+    """Whether the log entry and template full-text indexes exist; checked once per process"""
+    global _fts_available
+    if _fts_available is None:
+        if db.get_bind().dialect.name != "sqlite":
+            _fts_available = False
+        else:
+            _fts_available = db.execute(
+                text("SELECT count(*) FROM sqlite_master WHERE name IN :names").bindparams(
+                    bindparam("names", expanding=True)
+                ),
+                {"names": LOG_SEARCH_TABLES}
+            ).scalar() == len(LOG_SEARCH_TABLES)
+    return _fts_available
+
+
+def search_terms(query: str) -> List[str]:
+    return _TERM.findall(query or "")
+
+
+def fts_query(terms: List[str]) -> str:
+    """FTS5 MATCH expression requiring every term; terms are quoted so user input is never syntax"""
+    parts = []
+    for term in terms:
+        prefix = term.endswith("*")
+        word = term.rstrip("*")
+        # Punctuation alone tokenizes to nothing and would make an empty phrase
+        if any(c.isalnum() for c in word):
+            parts.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " AND ".join(parts)
+
+
+def levels_at_least(level: str) -> List[str]:
+    """Stored level names at or above level; ValueError for an unknown level"""
+    name = level.upper()
+    if name == "WARN":
+        name = "WARNING"
+    if name not in LEVELS:
+        raise ValueError(f"Unknown level: {level}")
+    return LEVELS[LEVELS.index(name):]
+
+
+def encode_cursor(entry: LogEntry) -> str:
+    return f"{entry.timestamp.isoformat()}/{entry.id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """ValueError if cursor was not produced by encode_cursor"""
+    timestamp, _, entry_id = cursor.rpartition("/")
+    return datetime.fromisoformat(timestamp), int(entry_id)
+
+
+def _fts_filter(name: str, match: str, table: str = "log_entries"):
+    return text(
+        f"{table}.id IN (SELECT rowid FROM {table}_fts WHERE {table}_fts MATCH :{name})"
+    ).bindparams(**{name: match})
+
+
+def _like_pattern(word: str) -> str:
+    """Substring LIKE pattern matching word literally (escape with backslash)"""
+    escaped = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def _utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def search_logs(
+    db: Session,
+    query: Optional[str] = None,
+    level: Optional[str] = None,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100
+) -> dict:
+    """Stored log entries matching every filter, newest first.
+
+    query words must all occur in the message (as whole words through the
+    full-text index when available, as substrings with LIKE otherwise);
+    level is a minimum severity. Pass next_cursor back as cursor for the
+    following page. Blocking.
+
+    Templated rows are matched by their params and by their template
+    text, the same way as raw messages, and returned with the message
+    rebuilt.
+    """
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    since, until = _utc_naive(since), _utc_naive(until)
+    q = db.query(LogEntry)
+
+    terms = search_terms(query)
+    fts = full_text_available(db)
+    index_only = []  # terms no template contains, combined into one MATCH
+    for i, term in enumerate(terms):
+        if fts:
+            match = fts_query([term])
+            if not match:
+                continue
+            templates = db.query(LogTemplate.id).filter(_fts_filter(f"template{i}", match, "log_templates"))
+            if db.query(templates.exists()).scalar():
+                q = q.filter(or_(_fts_filter(f"match{i}", match), LogEntry.template_id.in_(templates)))
+            else:
+                index_only.append(term)
+        else:
+            pattern = _like_pattern(term.rstrip("*"))
+            templates = db.query(LogTemplate.id).filter(LogTemplate.template.ilike(pattern, escape="\\"))
+            q = q.filter(or_(
+                LogEntry.message.ilike(pattern, escape="\\"),
+                cast(LogEntry.params, String).ilike(pattern, escape="\\"),
+                LogEntry.template_id.in_(templates)
+            ))
+    if index_only:
+        q = q.filter(_fts_filter("match", fts_query(index_only)))
+    if level:
+        q = q.filter(LogEntry.level.in_(levels_at_least(level)))
+    if source:
+        q = q.filter(LogEntry.source == source)
+    if since:
+        q = q.filter(LogEntry.timestamp >= since)
+    if until:
+        q = q.filter(LogEntry.timestamp < until)
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        q = q.filter(or_(
+            LogEntry.timestamp < timestamp,
+            and_(LogEntry.timestamp == timestamp, LogEntry.id < entry_id)
+        ))
+
+    rows = q.order_by(LogEntry.timestamp.desc(), LogEntry.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    template_ids = {row.template_id for row in rows if row.message is None and row.template_id is not None}
+    templates = dict(
+        db.query(LogTemplate.id, LogTemplate.template).filter(LogTemplate.id.in_(template_ids)).all()
+    ) if template_ids else {}
+    return {
+        "entries": [
+            {
+                "id": row.id,
+                "timestamp": row.timestamp.isoformat(),
+                "level": row.level,
+                "source": row.source,
+                "message": row.message if row.message is not None else render(
+                    templates.get(row.template_id, ""), row.params or []
+                ),
+                "template_id": row.template_id,
+                "meta": row.meta or {}
+            }
+            for row in rows
+        ],
+        "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        "has_more": has_more
+    }
@@ -0,0 +1,255 @@
+import re
+import math
+import random
+import time
+import asyncio
+import logging
+from contextlib import aclosing
+from typing import Dict, List, Optional, Tuple
+from fastapi import Request, WebSocket
+from .config import get_settings
+from .journal import PRIORITIES, JournalReader, parse_priority
+
+logger = logging.getLogger(__name__)
+
+# Seconds entries are collected before a batch goes out
+FLUSH_INTERVAL = 0.25
+# Seconds before a follower whose journalctl exited is started again
+RESTART_DELAY = 5
+# Entries at least this severe are never sampled out
+KEEP_PRIORITY = PRIORITIES["err"]
+
+
+class SubscriberFilter:
+    """Filters one subscriber applies to its follower's entries, in-process"""
+
+    __slots__ = ("priority", "grep", "identifier", "key")
+
+    def __init__(self, options: dict):
+        self.priority = parse_priority(options.get("priority"))
+        pattern = options.get("grep") or None
+        try:
+            self.grep = re.compile(pattern, re.IGNORECASE) if pattern else None
+        except re.error as e:
+            raise ValueError(f"Invalid grep pattern: {e}")
+        self.identifier = options.get("identifier") or None
+        # Subscribers with equal keys share one serialized frame
+        self.key = (self.priority, pattern, self.identifier)
+
+    def matches(self, entry: dict) -> bool:
+        if self.priority is not None and (entry["priority"] is None or entry["priority"] > self.priority):
+            return False
+        if self.identifier is not None and entry["identifier"] != self.identifier:
+            return False
+        return self.grep is None or self.grep.search(entry["message"]) is not None
+
+
+class _Follower:
+    """One `journalctl --follow` process and the subscribers sharing it"""
+
+    def __init__(self, unit: Optional[str]):
+        self.unit = unit
+        self.subscribers: Dict[WebSocket, SubscriberFilter] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.pending: List[dict] = []
+        # Rate control, over one-second windows
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.window_passed = 0
+        self.window_dropped = 0
+        self.sample_every = 1
+        self.dropped = 0  # total, for stats
+        self.notices: List[dict] = []
+        # Entries with a priority up to this pass sampling and the rate cap
+        self.keep_priority = KEEP_PRIORITY
+
+    def update_keep_priority(self):
+        """Keep everything the strictest priority filter asks for, and errors regardless"""
+        priorities = [s.priority for s in self.subscribers.values() if s.priority is not None]
+        self.keep_priority = max(KEEP_PRIORITY, min(priorities)) if priorities else KEEP_PRIORITY
+
+
+class LogTailer:
+    """Live journal entries for "logs" channel subscribers.
+
+    Subscribers of the same unit (or of the whole journal) share a single
+    follower process, started with the first subscriber and stopped with
+    the last. Priority, grep and identifier filters are applied per
+    subscriber on the parsed entries, so they never cost another process.
+
+    Entries go out in batches every FLUSH_INTERVAL. When a unit logs more
+    than max_rate entries per second the follower samples: it keeps each
+    entry with probability 1/sample_every, sized from the previous
+    second's rate, and delivers no more than max_rate per second. Errors,
+    and entries as severe as the strictest subscriber priority filter,
+    are always delivered. How many entries were skipped is announced with
+    a "logs_sampled" message.
+    """
+
+    def __init__(self, reader: JournalReader, websocket_manager, max_rate: Optional[int] = None):
+        self.reader = reader
+        self.websocket_manager = websocket_manager
+        self.max_rate = max_rate or get_settings().LOG_TAIL_MAX_RATE
+        self.followers: Dict[Optional[str], _Follower] = {}
+        self.subscriptions: Dict[WebSocket, Optional[str]] = {}  # websocket -> followed unit
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.websocket_manager.add_listener("logs", self)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        tasks = [follower.task for follower in self.followers.values() if follower.task]
+        if self._flusher:
+            tasks.append(self._flusher)
+        self.followers.clear()
+        self.subscriptions.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def _unit_key(unit: Optional[str]) -> Optional[str]:
+        """"nginx" and "nginx.service" follow the same unit"""
+        if not unit:
+            return None
+        return unit if "." in unit else f"{unit}.service"
+
+    async def subscribed(self, websocket: WebSocket, options: dict):
+        """Start (or change) a subscriber's tail; options: unit, priority, grep, identifier"""
+        try:
+            subscriber = SubscriberFilter(options)
+        except ValueError as e:
+            await self.websocket_manager.send_to_client(websocket, {
+                "type": "error",
+                "channel": "logs",
+                "detail": str(e)
+            })
+            return
+        unit = self._unit_key(options.get("unit"))
+        if websocket in self.subscriptions and self.subscriptions[websocket] != unit:
+            self.unsubscribed(websocket)
+        follower = self.followers.get(unit)
+        if follower is None:
+            follower = self.followers[unit] = _Follower(unit)
+            follower.task = asyncio.create_task(self._follow(follower))
+            logger.info(f"Started log follower for {unit or 'all units'}")
+        follower.subscribers[websocket] = subscriber
+        follower.update_keep_priority()
+        self.subscriptions[websocket] = unit
+
+    def unsubscribed(self, websocket: WebSocket):
+        """Drop a subscriber; the follower stops with its last subscriber"""
+        if websocket not in self.subscriptions:
+            return
+        unit = self.subscriptions.pop(websocket)
+        follower = self.followers.get(unit)
+        if follower is None:
+            return
+        follower.subscribers.pop(websocket, None)
+        if not follower.subscribers:
+            del self.followers[unit]
+            follower.task.cancel()
+            logger.info(f"Stopped log follower for {unit or 'all units'}")
+        else:
+            follower.update_keep_priority()
+
+    async def _follow(self, follower: _Follower):
+        while True:
+            try:
+                async with aclosing(self.reader.follow(follower.unit)) as entries:
+                    async for entry in entries:
+                        self._admit(follower, entry)
+                logger.warning(f"Log follower for {follower.unit or 'all units'} exited")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error following logs of {follower.unit or 'all units'}: {e}")
+            await asyncio.sleep(RESTART_DELAY)
+
+    def _admit(self, follower: _Follower, entry: dict):
+        """Queue an entry for delivery unless sampling or the rate cap skips it"""
+        now = time.monotonic()
+        if now - follower.window_start >= 1.0:
+            self._roll_window(follower, now)
+        follower.window_count += 1
+        kept = entry["priority"] is not None and entry["priority"] <= follower.keep_priority
+        # Random rather than every n-th entry, so periodic log patterns cannot alias away
+        sampled_out = follower.sample_every > 1 and random.random() * follower.sample_every >= 1
+        if not kept and (sampled_out or follower.window_passed >= self.max_rate):
+            follower.window_dropped += 1
+            follower.dropped += 1
+            return
+        follower.window_passed += 1
+        follower.pending.append(entry)
+        self._wakeup.set()
+
+    def _roll_window(self, follower: _Follower, now: float):
+        rate = follower.window_count / (now - follower.window_start)
+        if follower.window_dropped:
+            follower.notices.append({
+                "type": "logs_sampled",
+                "channel": "logs",
+                "unit": follower.unit,
+                "dropped": follower.window_dropped,
+                "rate": round(rate, 1),
+                "sample_every": follower.sample_every
+            })
+            self._wakeup.set()
+        follower.sample_every = max(1, math.ceil(rate / self.max_rate))
+        follower.window_start = now
+        follower.window_count = follower.window_passed = follower.window_dropped = 0
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            # Let a batch build up before sending
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            for follower in list(self.followers.values()):
+                try:
+                    await self._flush(follower)
+                except Exception as e:
+                    logger.error(f"Error delivering logs of {follower.unit or 'all units'}: {e}")
+
+    async def _flush(self, follower: _Follower):
+        entries, follower.pending = follower.pending, []
+        notices, follower.notices = follower.notices, []
+        for notice in notices:
+            await self.websocket_manager.send_to_clients(list(follower.subscribers), notice)
+        if not entries:
+            return
+        groups: Dict[Tuple, Tuple[SubscriberFilter, List[WebSocket]]] = {}
+        for websocket, subscriber in follower.subscribers.items():
+            groups.setdefault(subscriber.key, (subscriber, []))[1].append(websocket)
+        for subscriber, websockets in groups.values():
+            data = [entry for entry in entries if subscriber.matches(entry)]
+            if data:
+                await self.websocket_manager.send_to_clients(websockets, {
+                    "type": "log_entries",
+                    "channel": "logs",
+                    "unit": follower.unit,
+                    "sample_every": follower.sample_every,
+                    "data": data
+                })
+
+    def get_stats(self) -> dict:
+        """Running followers with their subscriber counts and sampling state"""
+        return {
+            "max_rate": self.max_rate,
+            "followers": [
+                {
+                    "unit": follower.unit,
+                    "subscribers": len(follower.subscribers),
+                    "sample_every": follower.sample_every,
+                    "dropped": follower.dropped
+                }
+                for follower in self.followers.values()
+            ]
+        }
+
+
+def get_log_tailer(request: Request) -> LogTailer:
+    """Dependency returning the application's log tailer"""
+    return request.app.state.log_tailer
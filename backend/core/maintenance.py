@@ -0,0 +1,237 @@
+import os
+import time
+import fcntl
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from fastapi import Request
+from sqlalchemy import Table, and_, delete, select, update
+from sqlalchemy.engine import Engine, make_url
+from .config import get_settings
+from .database import Alert, AlertHistory, LogEntry, LogPatternCount, SystemMetric, engine
+
+logger = logging.getLogger(__name__)
+
+# Without incremental auto-vacuum a full VACUUM (which blocks writers while
+# it rewrites the file) only runs once this share of the pages is free
+FULL_VACUUM_FREE_SHARE = 0.2
+
+
+class DatabaseMaintenance:
+    """Retention and space reclamation for the application database.
+
+    Expired metrics, log entries and pattern counts, and resolved alert
+    history past MAX_ALERT_HISTORY (open rows left behind by deleted rules
+    are resolved first) are deleted in batches of batch_size
+    rows, each its own short write transaction, so the ingest and API
+    writers are never locked out for long. Freed pages are then returned
+    to the filesystem with incremental vacuum steps (a one-off full VACUUM
+    converts databases created before incremental auto-vacuum), and
+    PRAGMA optimize refreshes the planner statistics.
+
+    Every gunicorn worker schedules the job; a file lock lets only one of
+    them run it per interval.
+    """
+
+    def __init__(self, bind: Engine = engine):
+        settings = get_settings()
+        self.bind = bind
+        self.metrics_retention_days = settings.METRICS_RETENTION_DAYS
+        self.log_retention_days = settings.LOG_RETENTION_DAYS
+        self.max_alert_history = settings.MAX_ALERT_HISTORY
+        self.batch_size = max(1, settings.DB_MAINTENANCE_BATCH_SIZE)
+        self.batch_pause = settings.DB_MAINTENANCE_BATCH_PAUSE
+        self.vacuum_pages = max(1, settings.DB_MAINTENANCE_VACUUM_PAGES)
+        self.interval = settings.DB_MAINTENANCE_INTERVAL_HOURS * 3600
+        self.lock_path = settings.DB_MAINTENANCE_LOCK_PATH
+        self.last_report: Optional[dict] = None
+
+    def _database_files(self) -> List[str]:
+        if self.bind.dialect.name != "sqlite":
+            return []
+        database = make_url(str(self.bind.url)).database
+        if not database or database == ":memory:":
+            return []
+        return [database, f"{database}-wal"]
+
+    def _file_bytes(self) -> Optional[int]:
+        files = self._database_files()
+        if not files:
+            return None
+        return sum(os.path.getsize(path) for path in files if os.path.exists(path))
+
+    def _acquire(self, force: bool) -> Optional[int]:
+        """Lock file descriptor, or None if another worker runs or recently ran maintenance"""
+        os.makedirs(os.path.dirname(self.lock_path) or ".", exist_ok=True)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        # The lock file holds the time of the last completed run
+        try:
+            last = float(os.read(fd, 32) or 0)
+        except ValueError:
+            last = 0.0
+        if not force and time.time() - last < self.interval / 2:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _mark_completed(fd: int):
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, str(time.time()).encode(), 0)
+
+    @staticmethod
+    def _release(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def _delete_batches(self, table: Table, condition) -> int:
+        """Delete matching rows batch by batch; blocking"""
+        total = 0
+        while True:
+            with self.bind.begin() as conn:
+                batch = select(table.c.id).where(condition).limit(self.batch_size)
+                deleted = conn.execute(delete(table).where(table.c.id.in_(batch))).rowcount
+            total += deleted
+            if deleted < self.batch_size:
+                return total
+            time.sleep(self.batch_pause)
+
+    def enforce_retention(self) -> Dict[str, int]:
+        """Delete expired rows; returns rows deleted per table; blocking"""
+        now = datetime.utcnow()
+        deleted = {}
+        if self.metrics_retention_days > 0:
+            deleted["system_metrics"] = self._delete_batches(
+                SystemMetric.__table__,
+                SystemMetric.timestamp < now - timedelta(days=self.metrics_retention_days)
+            )
+        if self.log_retention_days > 0:
+            cutoff = now - timedelta(days=self.log_retention_days)
+            deleted["log_entries"] = self._delete_batches(LogEntry.__table__, LogEntry.timestamp < cutoff)
+            deleted["log_pattern_counts"] = self._delete_batches(
+                LogPatternCount.__table__, LogPatternCount.minute < cutoff
+            )
+        if self.max_alert_history > 0:
+            with self.bind.begin() as conn:
+                # Open rows of deleted rules would never be resolved, nor pruned
+                conn.execute(
+                    update(AlertHistory).where(
+                        AlertHistory.resolved_at.is_(None),
+                        AlertHistory.alert_id.notin_(select(Alert.id))
+                    ).values(resolved_at=now)
+                )
+            with self.bind.connect() as conn:
+                # Id of the oldest row kept; open rows are kept regardless, for resolution
+                oldest_kept = conn.execute(
+                    select(AlertHistory.id).order_by(AlertHistory.id.desc())
+                    .offset(self.max_alert_history - 1).limit(1)
+                ).scalar()
+            deleted["alert_history"] = self._delete_batches(
+                AlertHistory.__table__,
+                and_(AlertHistory.id < oldest_kept, AlertHistory.resolved_at.isnot(None))
+            ) if oldest_kept is not None else 0
+        return deleted
+
+    def _sqlite(self, statement: str, script: bool = False) -> list:
+        """Run a statement outside any transaction (writer connections autocommit)"""
+        connection = self.bind.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if script:
+                # Stepped to completion; execute() stops row-less pragmas after one step
+                cursor.executescript(statement)
+                rows = []
+            else:
+                cursor.execute(statement)
+                rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        finally:
+            connection.close()
+
+    def _pragma(self, name: str) -> int:
+        return self._sqlite(f"PRAGMA {name}")[0][0]
+
+    def reclaim_space(self) -> dict:
+        """Return free pages to the filesystem and refresh planner statistics; blocking"""
+        if self.bind.dialect.name != "sqlite":
+            return {"vacuum": None, "freed_bytes": 0}
+        page_size = self._pragma("page_size")
+        free_before = free = self._pragma("freelist_count")
+        vacuum = None
+        if self._pragma("auto_vacuum") == 2:
+            # Bounded steps, the connection released in between
+            while free > 0:
+                self._sqlite(f"PRAGMA incremental_vacuum({self.vacuum_pages})", script=True)
+                remaining = self._pragma("freelist_count")
+                if remaining >= free:
+                    break
+                free = remaining
+                time.sleep(self.batch_pause)
+            vacuum = "incremental"
+        elif free > self._pragma("page_count") * FULL_VACUUM_FREE_SHARE:
+            # Writer connections ask for incremental auto-vacuum; VACUUM applies it
+            logger.info(f"Running full VACUUM to reclaim {free * page_size} bytes and enable incremental vacuum")
+            self._sqlite("VACUUM")
+            free = self._pragma("freelist_count")
+            vacuum = "full"
+        self._sqlite("PRAGMA optimize")
+        # Shrink the WAL file back; a no-op while readers hold old snapshots
+        self._sqlite("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"vacuum": vacuum, "freed_bytes": (free_before - free) * page_size}
+
+    async def run(self, force: bool = False) -> Optional[dict]:
+        """Enforce retention and reclaim space; None if another worker has it covered"""
+        fd = await asyncio.to_thread(self._acquire, force)
+        if fd is None:
+            logger.debug("Database maintenance skipped, run by another worker")
+            return None
+        try:
+            started = time.monotonic()
+            bytes_before = await asyncio.to_thread(self._file_bytes)
+            deleted = await asyncio.to_thread(self.enforce_retention)
+            space = await asyncio.to_thread(self.reclaim_space)
+            bytes_after = await asyncio.to_thread(self._file_bytes)
+            report = {
+                "finished_at": datetime.utcnow().isoformat(),
+                "duration": round(time.monotonic() - started, 2),
+                "deleted": deleted,
+                "vacuum": space["vacuum"],
+                "freed_bytes": space["freed_bytes"],
+                "file_bytes_before": bytes_before,
+                "file_bytes_after": bytes_after,
+                "reclaimed_bytes": bytes_before - bytes_after if bytes_before is not None else None
+            }
+            self.last_report = report
+            # Only a completed run lets the other workers skip theirs
+            await asyncio.to_thread(self._mark_completed, fd)
+            logger.info(
+                f"Database maintenance: deleted {deleted}, vacuum {space['vacuum']}, "
+                f"reclaimed {report['reclaimed_bytes']} bytes in {report['duration']}s"
+            )
+            return report
+        finally:
+            await asyncio.to_thread(self._release, fd)
+
+
+database_maintenance = DatabaseMaintenance()
+
+
+async def run_database_maintenance():
+    """Scheduler job; a module-level function so the persistent job store can reference it"""
+    try:
+        await database_maintenance.run()
+    except Exception as e:
+        logger.error(f"Error running database maintenance: {e}")
+
+
+def get_database_maintenance(request: Request) -> DatabaseMaintenance:
+    """Dependency returning the application's database maintenance"""
+    return request.app.state.database_maintenance
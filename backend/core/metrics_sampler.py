@@ -0,0 +1,212 @@
+import asyncio
+import time
+import threading
+import logging
+import psutil
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsSnapshot:
+    """A single host metrics sample shared by routers and background services"""
+
+    __slots__ = ("metrics", "values", "sampled_at", "timestamp")
+
+    def __init__(self, metrics: Dict, values: Dict[str, float], sampled_at: float, timestamp: datetime):
+        self.metrics = metrics  # nested dict, as broadcast on the system_metrics channel
+        self.values = values  # flat metric name -> value, as used by alert rules
+        self.sampled_at = sampled_at  # time.monotonic() of the sample
+        self.timestamp = timestamp
+
+    def age(self) -> float:
+        """Seconds since this snapshot was taken"""
+        return time.monotonic() - self.sampled_at
+
+
+def _cpu_total_time(times) -> float:
+    """Total CPU time, excluding guest time which Linux already counts in user time"""
+    total = sum(times)
+    total -= getattr(times, "guest", 0.0)
+    total -= getattr(times, "guest_nice", 0.0)
+    return total
+
+
+def _cpu_busy_percent(previous, current) -> float:
+    """CPU utilisation between two cpu_times() readings"""
+    def busy(times):
+        return _cpu_total_time(times) - times.idle - getattr(times, "iowait", 0.0)
+
+    if previous is None:
+        total_delta = _cpu_total_time(current)
+        busy_delta = busy(current)
+    else:
+        total_delta = _cpu_total_time(current) - _cpu_total_time(previous)
+        busy_delta = busy(current) - busy(previous)
+
+    if total_delta <= 0:
+        return 0.0
+    return round(min(max(busy_delta / total_delta * 100.0, 0.0), 100.0), 1)
+
+
+class MetricsSampler:
+    """Non-blocking host metrics sampler.
+
+    CPU utilisation is computed from the delta between consecutive
+    ``psutil.cpu_times()`` readings, so a sample never sleeps. The latest
+    sample is cached and served to every reader; samples are taken off the
+    event loop through refresh().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prev_cpu_times = None
+        self._prev_per_cpu_times: Optional[List] = None
+        self._snapshot: Optional[MetricsSnapshot] = None
+
+    @property
+    def snapshot(self) -> Optional[MetricsSnapshot]:
+        """Latest snapshot without any freshness guarantee"""
+        return self._snapshot
+
+    async def refresh(self) -> MetricsSnapshot:
+        """Take a new sample off the event loop"""
+        return await asyncio.to_thread(self.sample)
+
+    def sample(self) -> MetricsSnapshot:
+        """Take a new sample and make it the current snapshot"""
+        with self._lock:
+            cpu_times = psutil.cpu_times()
+            per_cpu_times = psutil.cpu_times(percpu=True)
+
+            cpu_percent = _cpu_busy_percent(self._prev_cpu_times, cpu_times)
+            previous_per_cpu = self._prev_per_cpu_times
+            if previous_per_cpu is None or len(previous_per_cpu) != len(per_cpu_times):
+                previous_per_cpu = [None] * len(per_cpu_times)
+            per_cpu = [
+                _cpu_busy_percent(prev, cur)
+                for prev, cur in zip(previous_per_cpu, per_cpu_times)
+            ]
+
+            self._prev_cpu_times = cpu_times
+            self._prev_per_cpu_times = per_cpu_times
+
+            metrics, values = self._collect(cpu_percent, per_cpu)
+            snapshot = MetricsSnapshot(metrics, values, time.monotonic(), datetime.utcnow())
+            self._snapshot = snapshot
+            return snapshot
+
+    def _collect(self, cpu_percent: float, per_cpu: List[float]):
+        """Collect everything except CPU utilisation"""
+        cpu_count = psutil.cpu_count()
+        cpu_freq = psutil.cpu_freq()
+        cpu_stats = psutil.cpu_stats()
+
+        memory = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+
+        disk = psutil.disk_usage('/')
+        disk_io = psutil.disk_io_counters()
+
+        network = psutil.net_io_counters()
+
+        load_avg = psutil.getloadavg()
+
+        uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
+
+        # Temperature sensors (if available)
+        temperatures = {}
+        try:
+            temps = psutil.sensors_temperatures()
+            for name, entries in temps.items():
+                temperatures[name] = [
+                    {
+                        "label": entry.label,
+                        "current": entry.current,
+                        "high": entry.high,
+                        "critical": entry.critical
+                    }
+                    for entry in entries
+                ]
+        except Exception:
+            pass
+
+        # Battery info (if available)
+        battery = None
+        try:
+            batt = psutil.sensors_battery()
+            if batt:
+                battery = {
+                    "percent": batt.percent,
+                    "power_plugged": batt.power_plugged,
+                    "secsleft": batt.secsleft
+                }
+        except Exception:
+            pass
+
+        metrics = {
+            "timestamp": datetime.utcnow().isoformat(),
+            "cpu": {
+                "percent": cpu_percent,
+                "per_cpu": per_cpu,
+                "count": cpu_count,
+                "frequency": cpu_freq._asdict() if cpu_freq else None,
+                "stats": cpu_stats._asdict() if cpu_stats else None
+            },
+            "memory": {
+                "percent": memory.percent,
+                "used": memory.used // (1024 * 1024),  # MB
+                "total": memory.total // (1024 * 1024),  # MB
+                "available": memory.available // (1024 * 1024),
+                "swap_percent": swap.percent,
+                "swap_used": swap.used // (1024 * 1024),
+                "swap_total": swap.total // (1024 * 1024)
+            },
+            "disk": {
+                "percent": disk.percent,
+                "used": round(disk.used / (1024 * 1024 * 1024), 2),  # GB
+                "total": round(disk.total / (1024 * 1024 * 1024), 2),  # GB
+                "free": round(disk.free / (1024 * 1024 * 1024), 2)
+            },
+            "disk_io": disk_io._asdict() if disk_io else None,
+            "network": {
+                "sent": network.bytes_sent,
+                "recv": network.bytes_recv,
+                "packets_sent": network.packets_sent,
+                "packets_recv": network.packets_recv,
+                "errin": network.errin,
+                "errout": network.errout,
+                "dropin": network.dropin,
+                "dropout": network.dropout
+            },
+            "load_avg": {
+                "1min": load_avg[0],
+                "5min": load_avg[1],
+                "15min": load_avg[2]
+            },
+            "uptime": {
+                "seconds": uptime.total_seconds(),
+                "formatted": str(uptime).split('.')[0]
+            },
+            "temperatures": temperatures,
+            "battery": battery
+        }
+
+        values = {
+            "cpu_percent": cpu_percent,
+            "memory_percent": memory.percent,
+            "swap_percent": swap.percent,
+            "disk_percent": disk.percent,
+            "load_avg_1": load_avg[0],
+            "load_avg_5": load_avg[1],
+            "load_avg_15": load_avg[2],
+            "uptime_seconds": uptime.total_seconds()
+        }
+        if disk_io:
+            for key, value in disk_io._asdict().items():
+                values[f"disk_io_{key}"] = value
+        for key, value in network._asdict().items():
+            values[f"net_{key}"] = value
+
+        return metrics, values
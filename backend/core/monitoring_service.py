@@ -1,28 +1,111 @@
+import heapq
 import asyncio
-import psutil
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, Optional
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+from fastapi import Request
+from .config import get_settings
+from .cgroups import CgroupSampler
+from .metrics_sampler import MetricsSampler, MetricsSnapshot
+from .process_tracker import ProcessTable, ProcessTracker
+from .timeseries import TimeSeriesStore
+from .write_buffer import WriteBehindBuffer
 from .websocket_manager import WebSocketManager
-from .database import SystemMetric, SessionLocal
+from .database import SystemMetric
 
 logger = logging.getLogger(__name__)
 
+# Flat snapshot values kept in the time-series store
+TIMESERIES_METRICS = [
+    "cpu_percent",
+    "memory_percent",
+    "swap_percent",
+    "disk_percent",
+    "load_avg_1",
+    "load_avg_5",
+    "load_avg_15",
+    "net_bytes_sent",
+    "net_bytes_recv",
+    "disk_io_read_bytes",
+    "disk_io_write_bytes"
+]
+
+# Fields of the per-unit and per-process resource series
+UNIT_RESOURCE_FIELDS = ["cpu_percent", "memory_bytes", "io_read_bps", "io_write_bps"]
+PROCESS_RESOURCE_FIELDS = ["cpu_percent", "memory_bytes"]
+RESOURCE_KINDS = {"unit": UNIT_RESOURCE_FIELDS, "process": PROCESS_RESOURCE_FIELDS}
+
+
+def resource_metric(kind: str, name: str, field: str) -> str:
+    """Series name of one resource field, e.g. "unit:nginx.service:memory_bytes" """
+    return f"{kind}:{name.replace('/', '_')}:{field}"
+
+# Historical query interval -> step in seconds
+HISTORY_INTERVALS = {
+    "1m": 60,
+    "5m": 300,
+    "15m": 900,
+    "1h": 3600,
+    "1d": 86400
+}
+
 class MonitoringService:
     """System monitoring and metrics collection service"""
     
-    def __init__(self, websocket_manager: WebSocketManager, interval: int = 5):
+    def __init__(
+        self,
+        websocket_manager: WebSocketManager,
+        interval: int = 5,
+        snapshot_max_age: Optional[float] = None,
+        write_buffer: Optional[WriteBehindBuffer] = None
+    ):
+        settings = get_settings()
         self.websocket_manager = websocket_manager
         self.interval = interval
+        self.sampler = MetricsSampler()
+        self.processes = ProcessTracker()
+        self.process_publish_limit = settings.PROCESS_PUBLISH_LIMIT
+        self.snapshot_max_age = (
+            snapshot_max_age if snapshot_max_age is not None
+            else settings.METRICS_SNAPSHOT_MAX_AGE
+        )
+        # Standalone services (no shared buffer) own and flush their own
+        self._owns_write_buffer = write_buffer is None
+        self.write_buffer = write_buffer or WriteBehindBuffer(
+            max_batch=settings.WRITE_BUFFER_MAX_BATCH,
+            flush_interval=settings.WRITE_BUFFER_FLUSH_INTERVAL,
+            max_pending=settings.WRITE_BUFFER_MAX_PENDING
+        )
+        self.timeseries = TimeSeriesStore(
+            TIMESERIES_METRICS,
+            retention_days=settings.METRICS_RETENTION_DAYS,
+            data_dir=settings.METRICS_DATA_DIR
+        )
+        # Optional per-unit and per-process history, with series created as units appear
+        self.resources: Optional[TimeSeriesStore] = None
+        self.cgroups: Optional[CgroupSampler] = None
+        self.resource_top_processes = settings.RESOURCE_TOP_PROCESSES
+        if settings.RESOURCE_HISTORY_ENABLED:
+            self.resources = TimeSeriesStore(
+                [],
+                retention_days=settings.METRICS_RETENTION_DAYS,
+                data_dir=settings.RESOURCE_DATA_DIR,
+                max_metrics=settings.RESOURCE_MAX_METRICS
+            )
+            self.cgroups = CgroupSampler()
+        self.checkpoint_interval = 60  # seconds between time-series checkpoints
+        self._last_checkpoint = 0.0
+        self._listeners: List[Callable[[MetricsSnapshot], None]] = []
         self.running = False
         self.task: Optional[asyncio.Task] = None
-        self.metrics_history: list = []
-        self.max_history = 1440  # 2 hours at 5-second intervals
         
     async def start(self):
         """Start monitoring service"""
         self.running = True
+        if self._owns_write_buffer:
+            self.write_buffer.start()
+        # Prime the process handles so the first served table has CPU deltas
+        await asyncio.to_thread(self.processes.refresh)
         self.task = asyncio.create_task(self._monitoring_loop())
         logger.info("Monitoring service started")
     
@@ -35,6 +118,11 @@ class MonitoringService:
                 await self.task
             except asyncio.CancelledError:
                 pass
+        await asyncio.to_thread(self.timeseries.close)
+        if self.resources is not None:
+            await asyncio.to_thread(self.resources.close)
+        if self._owns_write_buffer:
+            await asyncio.to_thread(self.write_buffer.stop)
         logger.info("Monitoring service stopped")
     
     def is_running(self) -> bool:
@@ -45,148 +133,178 @@ class MonitoringService:
         """Main monitoring loop"""
         while self.running:
             try:
-                metrics = await self._collect_metrics()
-                await self._store_metrics(metrics)
-                await self._broadcast_metrics(metrics)
+                snapshot = await self._collect_metrics()
+                if snapshot is not None:
+                    await self._record_metrics(snapshot)
+                    self._notify_listeners(snapshot)
+                    await self._store_metrics(snapshot.metrics)
+                    await self._broadcast_metrics(snapshot.metrics)
+                if self.resources is not None and snapshot is not None:
+                    await asyncio.to_thread(self._record_resources, snapshot)
+                if self.websocket_manager.get_channel_subscribers("processes"):
+                    await self._broadcast_processes(await asyncio.to_thread(self.processes.table, self.interval / 2))
                 await asyncio.sleep(self.interval)
             except Exception as e:
                 logger.error(f"Error in monitoring loop: {e}")
                 await asyncio.sleep(self.interval)
     
-    async def _collect_metrics(self) -> Dict:
-        """Collect system metrics"""
+    async def _collect_metrics(self) -> Optional[MetricsSnapshot]:
+        """Collect system metrics and publish them as the shared snapshot"""
         try:
-            # CPU metrics
-            cpu_percent = psutil.cpu_percent(interval=1)
-            cpu_count = psutil.cpu_count()
-            cpu_freq = psutil.cpu_freq()
-            cpu_stats = psutil.cpu_stats()
-            
-            # Memory metrics
-            memory = psutil.virtual_memory()
-            swap = psutil.swap_memory()
-            
-            # Disk metrics
-            disk = psutil.disk_usage('/')
-            disk_io = psutil.disk_io_counters()
-            
-            # Network metrics
-            network = psutil.net_io_counters()
-            
-            # Load average
-            load_avg = psutil.getloadavg()
-            
-            # Uptime
-            uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
-            
-            # Temperature sensors (if available)
-            temperatures = {}
-            try:
-                temps = psutil.sensors_temperatures()
-                for name, entries in temps.items():
-                    temperatures[name] = [
-                        {
-                            "label": entry.label,
-                            "current": entry.current,
-                            "high": entry.high,
-                            "critical": entry.critical
-                        }
-                        for entry in entries
-                    ]
-            except:
-                pass
-            
-            # Battery info (if available)
-            battery = None
-            try:
-                batt = psutil.sensors_battery()
-                if batt:
-                    battery = {
-                        "percent": batt.percent,
-                        "power_plugged": batt.power_plugged,
-                        "secsleft": batt.secsleft
-                    }
-            except:
-                pass
+            return await self.sampler.refresh()
+        except Exception as e:
+            logger.error(f"Error collecting metrics: {e}")
+            return None
+    
+    async def _record_metrics(self, snapshot: MetricsSnapshot):
+        """Append a snapshot to the time-series store"""
+        try:
+            timestamp = snapshot.timestamp.replace(tzinfo=timezone.utc).timestamp()
+            self.timeseries.ingest(timestamp, snapshot.values)
             
-            metrics = {
-                "timestamp": datetime.utcnow().isoformat(),
-                "cpu": {
-                    "percent": cpu_percent,
-                    "count": cpu_count,
-                    "frequency": cpu_freq._asdict() if cpu_freq else None,
-                    "stats": cpu_stats._asdict() if cpu_stats else None
-                },
-                "memory": {
-                    "percent": memory.percent,
-                    "used": memory.used // (1024 * 1024),  # MB
-                    "total": memory.total // (1024 * 1024),  # MB
-                    "available": memory.available // (1024 * 1024),
-                    "swap_percent": swap.percent,
-                    "swap_used": swap.used // (1024 * 1024),
-                    "swap_total": swap.total // (1024 * 1024)
-                },
-                "disk": {
-                    "percent": disk.percent,
-                    "used": disk.used // (1024 * 1024 * 1024),  # GB
-                    "total": disk.total // (1024 * 1024 * 1024),  # GB
-                    "free": disk.free // (1024 * 1024 * 1024)
-                },
-                "network": {
-                    "sent": network.bytes_sent,
-                    "recv": network.bytes_recv,
-                    "packets_sent": network.packets_sent,
-                    "packets_recv": network.packets_recv,
-                    "errin": network.errin,
-                    "errout": network.errout,
-                    "dropin": network.dropin,
-                    "dropout": network.dropout
-                },
-                "load_avg": {
-                    "1min": load_avg[0],
-                    "5min": load_avg[1],
-                    "15min": load_avg[2]
-                },
-                "uptime": {
-                    "seconds": uptime.total_seconds(),
-                    "formatted": str(uptime).split('.')[0]
-                },
-                "temperatures": temperatures,
-                "battery": battery
-            }
+            if timestamp - self._last_checkpoint >= self.checkpoint_interval:
+                self._last_checkpoint = timestamp
+                await asyncio.to_thread(self.timeseries.flush)
+                if self.resources is not None:
+                    await asyncio.to_thread(self.resources.flush)
+        except Exception as e:
+            logger.error(f"Error recording metrics: {e}")
+    
+    def _record_resources(self, snapshot: MetricsSnapshot):
+        """Append per-unit cgroup usage and the busiest process names to the resource store (blocking)"""
+        try:
+            timestamp = snapshot.timestamp.replace(tzinfo=timezone.utc).timestamp()
+            values: Dict[str, float] = {}
+            for unit, usage in self.cgroups.sample().items():
+                for field, value in usage.items():
+                    values[resource_metric("unit", unit, field)] = value
             
-            return metrics
+            # Processes are grouped by name, so restarts and worker pools share one series
+            by_name: Dict[str, Dict[str, float]] = {}
+            for row in self.processes.table(self.interval / 2).rows.values():
+                usage = by_name.setdefault(row["name"], {"cpu_percent": 0.0, "memory_bytes": 0})
+                usage["cpu_percent"] += row["cpu_percent"] or 0.0
+                usage["memory_bytes"] += row["memory_rss"] or 0
+            top = set()
+            for field in PROCESS_RESOURCE_FIELDS:
+                top.update(heapq.nlargest(self.resource_top_processes, by_name, key=lambda name: by_name[name][field]))
+            for name in top:
+                for field, value in by_name[name].items():
+                    values[resource_metric("process", name, field)] = value
             
+            self.resources.ingest(timestamp, values)
         except Exception as e:
-            logger.error(f"Error collecting metrics: {e}")
-            return {}
+            logger.error(f"Error recording resource usage: {e}")
+    
+    def get_resource_history(
+        self,
+        kind: str,
+        name: str,
+        start_time: datetime,
+        end_time: datetime,
+        step: int = 0,
+        max_points: int = 500
+    ) -> List[dict]:
+        """Average resource usage of one unit or process name, aligned by timestamp"""
+        if self.resources is None:
+            return []
+        fields = RESOURCE_KINDS[kind]
+        history = self._query_aligned(
+            self.resources,
+            [resource_metric(kind, name, field) for field in fields],
+            start_time,
+            end_time,
+            step,
+            max_points
+        )
+        prefix = resource_metric(kind, name, "")
+        return [
+            {key[len(prefix):] if key.startswith(prefix) else key: value for key, value in row.items()}
+            for row in history
+        ]
+    
+    def top_resources(
+        self,
+        kind: str,
+        field: str,
+        start_time: datetime,
+        end_time: datetime,
+        limit: int = 10
+    ) -> List[dict]:
+        """Units or process names with the highest average field between start and end"""
+        if self.resources is None:
+            return []
+        start = start_time.replace(tzinfo=timezone.utc).timestamp()
+        end = end_time.replace(tzinfo=timezone.utc).timestamp()
+        prefix, suffix = f"{kind}:", f":{field}"
+        ranked = []
+        for metric in list(self.resources.metrics):
+            if not (metric.startswith(prefix) and metric.endswith(suffix)):
+                continue
+            points = self.resources.query(metric, start, end, step=end - start, max_points=0)
+            if not points:
+                continue
+            count = sum(point["count"] for point in points)
+            ranked.append({
+                "name": metric[len(prefix):-len(suffix)],
+                "avg": sum(point["avg"] * point["count"] for point in points) / count,
+                "max": max(point["max"] for point in points)
+            })
+        return heapq.nlargest(limit, ranked, key=lambda item: item["avg"])
+    
+    def add_listener(self, listener: Callable[[MetricsSnapshot], None]):
+        """Call listener with every snapshot the monitoring loop collects"""
+        self._listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable[[MetricsSnapshot], None]):
+        """Stop calling a listener added with add_listener"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def _notify_listeners(self, snapshot: MetricsSnapshot):
+        """Hand a fresh snapshot to listeners (which must not block)"""
+        for listener in list(self._listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Error in metrics listener: {e}")
+    
+    async def get_snapshot(self, max_age: Optional[float] = None) -> MetricsSnapshot:
+        """Get the latest metrics snapshot, as refreshed by the monitoring loop.
+
+        Only if there is none yet, or the loop fell more than max_age seconds
+        behind, is a new sample taken, off the event loop.
+        """
+        if max_age is None:
+            max_age = self.snapshot_max_age
+        snapshot = self.sampler.snapshot
+        if snapshot is not None and snapshot.age() <= max_age:
+            return snapshot
+        return await self.sampler.refresh()
     
     async def _store_metrics(self, metrics: Dict):
-        """Store metrics in database"""
+        """Queue metrics for batched insertion into the database"""
         try:
-            db = SessionLocal()
-            try:
-                metric_record = SystemMetric(
-                    timestamp=datetime.utcnow(),
-                    cpu_percent=metrics.get("cpu", {}).get("percent"),
-                    cpu_count=metrics.get("cpu", {}).get("count"),
-                    memory_percent=metrics.get("memory", {}).get("percent"),
-                    memory_used=metrics.get("memory", {}).get("used"),
-                    memory_total=metrics.get("memory", {}).get("total"),
-                    disk_percent=metrics.get("disk", {}).get("percent"),
-                    disk_used=metrics.get("disk", {}).get("used"),
-                    disk_total=metrics.get("disk", {}).get("total"),
-                    network_sent=metrics.get("network", {}).get("sent"),
-                    network_recv=metrics.get("network", {}).get("recv"),
-                    load_avg_1=metrics.get("load_avg", {}).get("1min"),
-                    load_avg_5=metrics.get("load_avg", {}).get("5min"),
-                    load_avg_15=metrics.get("load_avg", {}).get("15min"),
-                    uptime_seconds=int(metrics.get("uptime", {}).get("seconds", 0))
-                )
-                db.add(metric_record)
-                db.commit()
-            finally:
-                db.close()
+            await self.write_buffer.put(
+                SystemMetric,
+                {
+                    "timestamp": datetime.utcnow(),
+                    "cpu_percent": metrics.get("cpu", {}).get("percent"),
+                    "cpu_count": metrics.get("cpu", {}).get("count"),
+                    "memory_percent": metrics.get("memory", {}).get("percent"),
+                    "memory_used": metrics.get("memory", {}).get("used"),
+                    "memory_total": metrics.get("memory", {}).get("total"),
+                    "disk_percent": metrics.get("disk", {}).get("percent"),
+                    "disk_used": metrics.get("disk", {}).get("used"),
+                    "disk_total": metrics.get("disk", {}).get("total"),
+                    "network_sent": metrics.get("network", {}).get("sent"),
+                    "network_recv": metrics.get("network", {}).get("recv"),
+                    "load_avg_1": metrics.get("load_avg", {}).get("1min"),
+                    "load_avg_5": metrics.get("load_avg", {}).get("5min"),
+                    "load_avg_15": metrics.get("load_avg", {}).get("15min"),
+                    "uptime_seconds": int(metrics.get("uptime", {}).get("seconds", 0))
+                }
+            )
         except Exception as e:
             logger.error(f"Error storing metrics: {e}")
     
@@ -201,57 +319,97 @@ class MonitoringService:
             channel="system_metrics"
         )
     
+    async def get_process_table(self, max_age: Optional[float] = None) -> ProcessTable:
+        """Get the cached process table, refreshing it off the event loop if older than max_age seconds"""
+        if max_age is None:
+            max_age = self.interval
+        return await asyncio.to_thread(self.processes.table, max_age)
+    
+    async def _broadcast_processes(self, table: ProcessTable):
+        """Broadcast the busiest processes keyed by pid, so delta subscribers only get changed rows"""
+        top = self.processes.top(table, "cpu", self.process_publish_limit)
+        await self.websocket_manager.broadcast(
+            {
+                "type": "processes",
+                "data": {
+                    "processes": {str(row["pid"]): row for row in top},
+                    "total": len(table.rows)
+                },
+                "timestamp": datetime.utcnow().isoformat()
+            },
+            channel="processes"
+        )
+    
+    def get_metric_history(
+        self,
+        metrics: List[str],
+        start_time: datetime,
+        end_time: datetime,
+        step: int = 0,
+        max_points: int = 500
+    ) -> List[dict]:
+        """Get average values of several metrics, aligned by timestamp"""
+        return self._query_aligned(self.timeseries, metrics, start_time, end_time, step, max_points)
+    
+    @staticmethod
+    def _query_aligned(
+        store: TimeSeriesStore,
+        metrics: List[str],
+        start_time: datetime,
+        end_time: datetime,
+        step: int,
+        max_points: int
+    ) -> List[dict]:
+        start = start_time.replace(tzinfo=timezone.utc).timestamp()
+        end = end_time.replace(tzinfo=timezone.utc).timestamp()
+        
+        rows: Dict[float, dict] = {}
+        for metric in metrics:
+            for point in store.query(metric, start, end, step, max_points):
+                row = rows.setdefault(point["timestamp"], {})
+                row[metric] = point["avg"]
+        
+        return [
+            {"timestamp": datetime.utcfromtimestamp(ts).isoformat(), **rows[ts]}
+            for ts in sorted(rows)
+        ]
+    
     async def get_historical_metrics(
         self,
         start_time: Optional[datetime] = None,
         end_time: Optional[datetime] = None,
         interval: str = "5m"
     ) -> list:
-        """Get historical metrics from database"""
+        """Get historical metrics from the time-series store"""
         try:
-            db = SessionLocal()
-            try:
-                query = db.query(SystemMetric)
-                
-                if start_time:
-                    query = query.filter(SystemMetric.timestamp >= start_time)
-                if end_time:
-                    query = query.filter(SystemMetric.timestamp <= end_time)
-                else:
-                    # Default to last 24 hours
-                    query = query.filter(
-                        SystemMetric.timestamp >= datetime.utcnow() - timedelta(hours=24)
-                    )
-                
-                # Order by timestamp descending
-                query = query.order_by(SystemMetric.timestamp.desc())
-                
-                # Limit results based on interval
-                limit_map = {
-                    "1m": 60,
-                    "5m": 288,  # 24 hours at 5 min intervals
-                    "15m": 96,
-                    "1h": 24,
-                    "1d": 30
+            end_time = end_time or datetime.utcnow()
+            # Default to last 24 hours
+            start_time = start_time or end_time - timedelta(hours=24)
+            
+            history = self.get_metric_history(
+                ["cpu_percent", "memory_percent", "disk_percent",
+                 "net_bytes_sent", "net_bytes_recv", "load_avg_1"],
+                start_time,
+                end_time,
+                step=HISTORY_INTERVALS.get(interval, 300)
+            )
+            
+            return [
+                {
+                    "timestamp": row["timestamp"],
+                    "cpu_percent": row.get("cpu_percent"),
+                    "memory_percent": row.get("memory_percent"),
+                    "disk_percent": row.get("disk_percent"),
+                    "network_sent": row.get("net_bytes_sent"),
+                    "network_recv": row.get("net_bytes_recv"),
+                    "load_avg_1": row.get("load_avg_1")
                 }
-                query = query.limit(limit_map.get(interval, 288))
-                
-                metrics = query.all()
-                
-                return [
-                    {
-                        "timestamp": m.timestamp.isoformat(),
-                        "cpu_percent": m.cpu_percent,
-                        "memory_percent": m.memory_percent,
-                        "disk_percent": m.disk_percent,
-                        "network_sent": m.network_sent,
-                        "network_recv": m.network_recv,
-                        "load_avg_1": m.load_avg_1
-                    }
-                    for m in reversed(metrics)
-                ]
-            finally:
-                db.close()
+                for row in history
+            ]
         except Exception as e:
             logger.error(f"Error getting historical metrics: {e}")
-            return []
\ No newline at end of file
+            return []
+
+def get_monitoring_service(request: Request) -> MonitoringService:
+    """Dependency returning the application's monitoring service"""
+    return request.app.state.monitoring_service
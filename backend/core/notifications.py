@@ -0,0 +1,388 @@
+import asyncio
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import httpx
+from sqlalchemy.orm import Session
+from .config import get_settings
+from .database import NotificationQueue, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Longest text sent to a channel and most alerts listed in one digest
+DISCORD_MAX_LENGTH = 2000
+DIGEST_MAX_LINES = 50
+
+
+def build_message(items: List[dict]) -> dict:
+    """Render one or more alert notifications as a single message payload"""
+    lines = [
+        f"[{item['severity'].upper()}] {item['name']} {item['status']}"
+        + (f": {item['message']}" if item.get("message") else "")
+        for item in items
+    ]
+    if len(items) == 1:
+        subject = f"[{items[0]['severity'].upper()}] Alert {items[0]['status']}: {items[0]['name']}"
+        text = f"{lines[0]}\nAt {items[0]['timestamp']}"
+    else:
+        subject = f"{len(items)} alert notifications"
+        shown = lines[:DIGEST_MAX_LINES]
+        if len(lines) > len(shown):
+            shown.append(f"... and {len(lines) - len(shown)} more")
+        text = f"{subject} between {items[0]['timestamp']} and {items[-1]['timestamp']}:\n" + "\n".join(shown)
+    return {"subject": subject, "text": text, "alerts": items}
+
+
+class _SMTPConnection:
+    """A reusable SMTP session, reconnected when the server drops it"""
+
+    def __init__(self, timeout: float = 30):
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._key: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+    def send(self, config: dict, message: EmailMessage):
+        with self._lock:
+            key = (config.get("host"), config.get("port"), config.get("user"))
+            if self._smtp is not None and key != self._key:
+                self._close()
+            for attempt in (1, 2):
+                if self._smtp is None:
+                    self._connect(config)
+                    self._key = key
+                try:
+                    self._smtp.send_message(message)
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self._close()
+                    if attempt == 2:
+                        raise
+
+    def _connect(self, config: dict):
+        host = config.get("host")
+        port = int(config.get("port") or 587)
+        if port == 465:
+            smtp = smtplib.SMTP_SSL(host, port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(host, port, timeout=self.timeout)
+            if config.get("tls"):
+                smtp.starttls()
+        if config.get("user"):
+            smtp.login(config["user"], config.get("password", ""))
+        self._smtp = smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+class NotificationDispatcher:
+    """Delivers alert notifications concurrently over pooled connections.
+
+    notify() never blocks the caller. The first notification on an idle
+    channel is sent right away; further ones within digest_window seconds
+    are coalesced into one digest message sent when the window closes.
+    Failed deliveries go to the notification_queue table and are retried
+    with exponential backoff until max_retries attempts have been made.
+    """
+
+    def __init__(
+        self,
+        digest_window: Optional[float] = None,
+        max_retries: Optional[int] = None,
+        retry_interval: Optional[float] = None,
+        http_timeout: float = 10,
+        session_factory: Callable[[], Session] = SessionLocal,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        settings = get_settings()
+        self.digest_window = (
+            digest_window if digest_window is not None
+            else settings.NOTIFICATION_DIGEST_WINDOW
+        )
+        self.max_retries = max_retries if max_retries is not None else settings.NOTIFICATION_MAX_RETRIES
+        self.retry_interval = (
+            retry_interval if retry_interval is not None
+            else settings.NOTIFICATION_RETRY_INTERVAL
+        )
+        self.http_timeout = http_timeout
+        self.session_factory = session_factory
+        self.transport = transport  # httpx transport override, e.g. httpx.MockTransport
+        self.channels: Dict[str, dict] = {
+            "email": {
+                "enabled": bool(settings.SMTP_HOST and settings.SMTP_TO),
+                "config": {
+                    "host": settings.SMTP_HOST,
+                    "port": settings.SMTP_PORT,
+                    "user": settings.SMTP_USER,
+                    "password": settings.SMTP_PASSWORD,
+                    "tls": settings.SMTP_TLS,
+                    "from": settings.SMTP_FROM or settings.SMTP_USER,
+                    "to": [addr.strip() for addr in settings.SMTP_TO.split(",") if addr.strip()]
+                }
+            },
+            "slack": {
+                "enabled": bool(settings.SLACK_WEBHOOK_URL),
+                "config": {"url": settings.SLACK_WEBHOOK_URL}
+            },
+            "discord": {
+                "enabled": bool(settings.DISCORD_WEBHOOK_URL),
+                "config": {"url": settings.DISCORD_WEBHOOK_URL}
+            },
+            "webhook": {
+                "enabled": bool(settings.NOTIFICATION_WEBHOOK_URL),
+                "config": {"url": settings.NOTIFICATION_WEBHOOK_URL}
+            },
+            "sms": {"enabled": False, "config": {}}
+        }
+        self.client: Optional[httpx.AsyncClient] = None
+        self.smtp = _SMTPConnection()
+        self._digests: Dict[str, List[dict]] = {}
+        self._windows: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.running = False
+        self.task: Optional[asyncio.Task] = None
+        self.stats: Dict[str, int] = {
+            "sent": 0,
+            "digests": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0
+        }
+
+    async def start(self):
+        """Open the HTTP connection pool and start the retry loop"""
+        self.running = True
+        self.client = httpx.AsyncClient(
+            timeout=self.http_timeout,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            transport=self.transport
+        )
+        self.task = asyncio.create_task(self._retry_loop())
+        logger.info("Notification dispatcher started")
+
+    async def stop(self):
+        """Send pending digests, wait for in-flight deliveries and close connections"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        for channel in list(self._windows):
+            self._windows.pop(channel).cancel()
+            items = self._digests.pop(channel, None)
+            if items:
+                self._spawn(self._deliver(channel, build_message(items)))
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        await asyncio.to_thread(self.smtp.close)
+        logger.info("Notification dispatcher stopped")
+
+    def is_running(self) -> bool:
+        """Check if the dispatcher is running"""
+        return self.running and (self.task is not None and not self.task.done())
+
+    def configure(self, channel: str, config: dict) -> bool:
+        """Enable/disable a channel and override its settings"""
+        if channel not in self.channels:
+            return False
+        self.channels[channel]["enabled"] = config.get("enabled", False)
+        self.channels[channel]["config"].update(config.get("settings", {}))
+        return True
+
+    def notify(self, channel: str, alert: dict, status: str) -> bool:
+        """Queue a notification; returns False if the channel is unknown or disabled"""
+        if not self.channels.get(channel, {}).get("enabled"):
+            return False
+        item = {
+            "id": alert.get("id"),
+            "name": alert.get("name"),
+            "severity": alert.get("severity") or "info",
+            "message": alert.get("message"),
+            "status": status,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if channel in self._windows:
+            self._digests.setdefault(channel, []).append(item)
+        else:
+            self._open_window(channel)
+            self._spawn(self._deliver(channel, build_message([item])))
+        return True
+
+    def _open_window(self, channel: str):
+        loop = asyncio.get_running_loop()
+        self._windows[channel] = loop.call_later(self.digest_window, self._close_window, channel)
+
+    def _close_window(self, channel: str):
+        """Send what accumulated during a window; keep coalescing while alerts keep coming"""
+        self._windows.pop(channel, None)
+        items = self._digests.pop(channel, None)
+        if items:
+            self.stats["digests"] += 1
+            self._open_window(channel)
+            self._spawn(self._deliver(channel, build_message(items)))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, channel: str, payload: dict):
+        """Deliver a message, queueing it for retry on failure"""
+        error = await self._attempt(channel, payload)
+        if error is not None:
+            logger.warning(f"Error sending {channel} notification, queued for retry: {error}")
+            try:
+                await asyncio.to_thread(self._enqueue_retry, channel, payload, error)
+            except Exception as e:
+                self.stats["dropped"] += 1
+                logger.error(f"Error queueing {channel} notification: {e}")
+
+    async def _attempt(self, channel: str, payload: dict) -> Optional[str]:
+        """Send once; returns the error message on failure"""
+        try:
+            await self._send(channel, payload)
+            self.stats["sent"] += 1
+            return None
+        except Exception as e:
+            self.stats["failed"] += 1
+            return str(e) or type(e).__name__
+
+    async def _send(self, channel: str, payload: dict):
+        config = self.channels[channel]["config"]
+        if channel == "email":
+            await asyncio.to_thread(self.smtp.send, config, self._email_message(config, payload))
+            return
+
+        if channel == "slack":
+            body = {"text": payload["text"]}
+        elif channel == "discord":
+            body = {"content": payload["text"][:DISCORD_MAX_LENGTH]}
+        elif channel == "webhook":
+            body = payload
+        else:
+            raise ValueError(f"Channel {channel} is not supported")
+        if not config.get("url"):
+            raise ValueError(f"No URL configured for {channel}")
+        if self.client is None:
+            raise RuntimeError("Notification dispatcher is not running")
+        response = await self.client.post(config["url"], json=body)
+        response.raise_for_status()
+
+    def _email_message(self, config: dict, payload: dict) -> EmailMessage:
+        recipients = config.get("to") or []
+        if isinstance(recipients, str):
+            recipients = [addr.strip() for addr in recipients.split(",") if addr.strip()]
+        if not recipients:
+            raise ValueError("No email recipients configured")
+        message = EmailMessage()
+        message["Subject"] = payload["subject"]
+        message["From"] = config.get("from") or config.get("user") or "umc@localhost"
+        message["To"] = ", ".join(recipients)
+        message.set_content(payload["text"])
+        return message
+
+    def _backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(self.retry_interval * 2 ** (attempts - 1), 3600))
+
+    def _enqueue_retry(self, channel: str, payload: dict, error: str):
+        db = self.session_factory()
+        try:
+            db.add(NotificationQueue(
+                channel=channel,
+                payload=payload,
+                attempts=1,
+                next_attempt_at=datetime.utcnow() + self._backoff(1),
+                last_error=error
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    async def _retry_loop(self):
+        """Periodically retry queued notifications that are due"""
+        while self.running:
+            try:
+                await self._retry_due()
+            except Exception as e:
+                logger.error(f"Error retrying notifications: {e}")
+            await asyncio.sleep(self.retry_interval)
+
+    async def _retry_due(self, limit: int = 100):
+        due = await asyncio.to_thread(self._claim_due, limit)
+        if not due:
+            return
+        errors = await asyncio.gather(
+            *(self._attempt(channel, payload) for _, channel, payload, _ in due)
+        )
+        self.stats["retried"] += len(due)
+        await asyncio.to_thread(self._record_attempts, list(zip(due, errors)))
+
+    def _claim_due(self, limit: int) -> List[Tuple[int, str, dict, int]]:
+        """Lease due rows so other workers sharing the queue skip them"""
+        now = datetime.utcnow()
+        lease = now + timedelta(seconds=max(self.http_timeout * 3, self.retry_interval))
+        db = self.session_factory()
+        try:
+            rows = db.query(NotificationQueue).filter(
+                NotificationQueue.next_attempt_at <= now
+            ).order_by(NotificationQueue.next_attempt_at).limit(limit).all()
+            claimed = []
+            for row in rows:
+                updated = db.query(NotificationQueue).filter(
+                    NotificationQueue.id == row.id,
+                    NotificationQueue.next_attempt_at == row.next_attempt_at
+                ).update({"next_attempt_at": lease}, synchronize_session=False)
+                if updated:
+                    claimed.append((row.id, row.channel, row.payload, row.attempts))
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+    def _record_attempts(self, results: List[Tuple[Tuple[int, str, dict, int], Optional[str]]]):
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            for (row_id, channel, _, attempts), error in results:
+                query = db.query(NotificationQueue).filter(NotificationQueue.id == row_id)
+                if error is None:
+                    query.delete(synchronize_session=False)
+                elif attempts + 1 >= self.max_retries:
+                    query.delete(synchronize_session=False)
+                    self.stats["dropped"] += 1
+                    logger.error(f"Giving up on {channel} notification after {attempts + 1} attempts: {error}")
+                else:
+                    query.update({
+                        "attempts": attempts + 1,
+                        "next_attempt_at": now + self._backoff(attempts + 1),
+                        "last_error": error
+                    }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def get_stats(self) -> dict:
+        """Delivery counters and channel state"""
+        return {
+            **self.stats,
+            "channels": {name: channel["enabled"] for name, channel in self.channels.items()},
+            "coalescing": {channel: len(items) for channel, items in self._digests.items()}
+        }
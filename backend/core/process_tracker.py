@@ -0,0 +1,119 @@
+import time
+import heapq
+import threading
+import logging
+import psutil
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# sort_by values accepted by top(), mapped to row fields
+SORT_KEYS = {
+    "cpu": "cpu_percent",
+    "cpu_percent": "cpu_percent",
+    "memory": "memory_percent",
+    "memory_percent": "memory_percent",
+    "rss": "memory_rss",
+    "threads": "num_threads",
+    "pid": "pid",
+    "created": "created",
+    "name": "name"
+}
+
+# Sorted ascending; every other key returns the largest values first
+ASCENDING_KEYS = {"name"}
+
+
+class ProcessTable:
+    """One refresh of the process table"""
+
+    __slots__ = ("rows", "sampled_at")
+
+    def __init__(self, rows: Dict[int, dict], sampled_at: float):
+        self.rows = rows  # pid -> row
+        self.sampled_at = sampled_at  # time.monotonic() of the refresh
+
+    def age(self) -> float:
+        return time.monotonic() - self.sampled_at
+
+
+class ProcessTracker:
+    """Process table refreshed incrementally from cached psutil.Process handles.
+
+    Handles are kept per (pid, create_time), so cpu_percent() measures the
+    time since the previous refresh instead of always returning 0.0, and a
+    reused pid gets a fresh handle. Each process is read inside oneshot()
+    so its /proc files are parsed once per refresh.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handles: Dict[int, Tuple[float, psutil.Process]] = {}
+        self._table: Optional[ProcessTable] = None
+
+    def table(self, max_age: Optional[float] = None) -> ProcessTable:
+        """Latest table, refreshed first if it is missing or older than max_age seconds"""
+        table = self._table
+        if table is None or (max_age is not None and table.age() > max_age):
+            table = self.refresh()
+        return table
+
+    def refresh(self) -> ProcessTable:
+        """Re-read every process; blocking, run it in a thread from async code"""
+        with self._lock:
+            handles: Dict[int, Tuple[float, psutil.Process]] = {}
+            rows: Dict[int, dict] = {}
+            for pid in psutil.pids():
+                cached = self._handles.get(pid)
+                try:
+                    if cached is None:
+                        proc = psutil.Process(pid)
+                        create_time = proc.create_time()
+                    else:
+                        create_time, proc = cached
+                    with proc.oneshot():
+                        if cached is not None and not proc.is_running():
+                            # pid reused by a new process
+                            proc = psutil.Process(pid)
+                            create_time = proc.create_time()
+                        row = self._read(proc, create_time)
+                except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                    continue
+                handles[pid] = (create_time, proc)
+                rows[pid] = row
+            self._handles = handles
+            self._table = ProcessTable(rows, time.monotonic())
+            return self._table
+
+    @staticmethod
+    def _read(proc: psutil.Process, create_time: float) -> dict:
+        memory = proc.memory_info()
+        try:
+            username = proc.username()
+        except (KeyError, psutil.AccessDenied):
+            # uid without a passwd entry
+            username = None
+        return {
+            "pid": proc.pid,
+            "name": proc.name(),
+            "username": username,
+            # First refresh of a handle has no previous sample and reports 0.0
+            "cpu_percent": proc.cpu_percent(None),
+            "memory_percent": round(proc.memory_percent(), 2),
+            "memory_rss": memory.rss,
+            "num_threads": proc.num_threads(),
+            "status": proc.status(),
+            "created": create_time
+        }
+
+    def get(self, pid: int) -> Optional[dict]:
+        table = self._table
+        return table.rows.get(pid) if table else None
+
+    @staticmethod
+    def top(table: ProcessTable, sort_by: str = "memory", limit: int = 50) -> List[dict]:
+        """The limit first rows for sort_by, without sorting the whole table"""
+        key = SORT_KEYS[sort_by]
+        if key in ASCENDING_KEYS:
+            return heapq.nsmallest(limit, table.rows.values(), key=lambda row: row[key] or "")
+        return heapq.nlargest(limit, table.rows.values(), key=lambda row: row[key] or 0)
@@ -19,7 +19,7 @@ class SchedulerManager:
     async def start(self):
         """Start the scheduler"""
         jobstores = {
-            'default': SQLAlchemyJobStore(url='sqlite:///app/data/scheduler.db')
+            'default': SQLAlchemyJobStore(url='sqlite:////app/data/scheduler.db')
         }
         
         self.scheduler = AsyncIOScheduler(jobstores=jobstores)
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from fastapi import Request
+
+try:
+    from dbus_next import BusType, Message, MessageType
+    from dbus_next.aio import MessageBus
+except ImportError:  # optional: without it the services API falls back to systemctl
+    MessageBus = None
+
+logger = logging.getLogger(__name__)
+
+SYSTEMD_SERVICE = "org.freedesktop.systemd1"
+SYSTEMD_PATH = "/org/freedesktop/systemd1"
+MANAGER_INTERFACE = "org.freedesktop.systemd1.Manager"
+UNIT_INTERFACE = "org.freedesktop.systemd1.Unit"
+SERVICE_INTERFACE = "org.freedesktop.systemd1.Service"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+# Seconds between attempts to reach the system bus after it went away
+RECONNECT_DELAY = 10
+
+# Unit properties mirrored in the table, mapped to the keys the API returns
+TABLE_PROPERTIES = {
+    "Description": "description",
+    "LoadState": "load_state",
+    "ActiveState": "active_state",
+    "SubState": "sub_state"
+}
+
+SignalHandler = Callable[[str, str, str, list], None]
+
+
+class DBusBus:
+    """Connection to the systemd manager on the system bus (dbus-next)"""
+
+    def __init__(self):
+        self._bus = None
+        self._handlers: List[SignalHandler] = []
+
+    async def connect(self):
+        if MessageBus is None:
+            raise RuntimeError("dbus-next is not installed")
+        self._bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+        self._bus.add_message_handler(self._dispatch)
+        # systemd only emits PropertiesChanged for units once a client subscribed
+        for rule in (
+            f"type='signal',sender='{SYSTEMD_SERVICE}',interface='{MANAGER_INTERFACE}'",
+            f"type='signal',sender='{SYSTEMD_SERVICE}',interface='{PROPERTIES_INTERFACE}',"
+            f"member='PropertiesChanged',path_namespace='{SYSTEMD_PATH}/unit'"
+        ):
+            await self._call("org.freedesktop.DBus", "/org/freedesktop/DBus", "org.freedesktop.DBus", "AddMatch", "s", [rule])
+        await self.call_manager("Subscribe")
+
+    async def _call(self, destination: str, path: str, interface: str, member: str, signature: str = "", body: list = None) -> list:
+        reply = await self._bus.call(Message(
+            destination=destination,
+            path=path,
+            interface=interface,
+            member=member,
+            signature=signature,
+            body=body or []
+        ))
+        if reply.message_type == MessageType.ERROR:
+            raise LookupError(f"{member} failed: {reply.error_name} {reply.body}")
+        return reply.body
+
+    async def call_manager(self, member: str, signature: str = "", body: list = None) -> list:
+        return await self._call(SYSTEMD_SERVICE, SYSTEMD_PATH, MANAGER_INTERFACE, member, signature, body)
+
+    async def get_properties(self, path: str, interface: str) -> dict:
+        body = await self._call(SYSTEMD_SERVICE, path, PROPERTIES_INTERFACE, "GetAll", "s", [interface])
+        return {key: variant.value for key, variant in body[0].items()}
+
+    def on_signal(self, handler: SignalHandler):
+        self._handlers.append(handler)
+
+    def _dispatch(self, message):
+        if message.message_type != MessageType.SIGNAL:
+            return
+        body = list(message.body)
+        if message.member == "PropertiesChanged":
+            # Unwrap variants so handlers see plain values, as FakeBus delivers them
+            body[1] = {key: variant.value for key, variant in body[1].items()}
+        for handler in self._handlers:
+            handler(message.path, message.interface, message.member, body)
+
+    async def wait_closed(self):
+        await self._bus.wait_for_disconnect()
+
+    def close(self):
+        if self._bus is not None:
+            self._bus.disconnect()
+
+
+class FakeBus:
+    """In-memory stand-in for DBusBus, for tests and hosts without systemd.
+
+    units maps unit name to its Unit properties; service_properties holds
+    the Service interface properties. emit() delivers a signal as the bus
+    would.
+    """
+
+    def __init__(self, units: Optional[Dict[str, dict]] = None, service_properties: Optional[Dict[str, dict]] = None):
+        self.units: Dict[str, dict] = units or {}
+        self.service_properties: Dict[str, dict] = service_properties or {}
+        self.calls: List[Tuple[str, list]] = []
+        self._handlers: List[SignalHandler] = []
+        self._closed = asyncio.Event()
+
+    @staticmethod
+    def unit_path(name: str) -> str:
+        escaped = "".join(c if c.isalnum() else f"_{ord(c):02x}" for c in name)
+        return f"{SYSTEMD_PATH}/unit/{escaped}"
+
+    async def connect(self):
+        self._closed.clear()
+
+    async def call_manager(self, member: str, signature: str = "", body: list = None) -> list:
+        self.calls.append((member, body or []))
+        if member == "ListUnits":
+            return [[
+                (name, props.get("Description", ""), props.get("LoadState", "loaded"),
+                 props.get("ActiveState", "inactive"), props.get("SubState", "dead"),
+                 "", self.unit_path(name), 0, "", "/")
+                for name, props in self.units.items()
+            ]]
+        if member in ("GetUnit", "LoadUnit"):
+            name = body[0]
+            if name not in self.units:
+                raise LookupError(f"Unit {name} not loaded")
+            return [self.unit_path(name)]
+        return []
+
+    async def get_properties(self, path: str, interface: str) -> dict:
+        for name, props in self.units.items():
+            if self.unit_path(name) == path:
+                if interface == SERVICE_INTERFACE:
+                    return dict(self.service_properties.get(name, {}))
+                return {"Id": name, **props}
+        raise LookupError(f"No unit at {path}")
+
+    def on_signal(self, handler: SignalHandler):
+        self._handlers.append(handler)
+
+    def emit(self, path: str, interface: str, member: str, body: list):
+        for handler in self._handlers:
+            handler(path, interface, member, body)
+
+    def set_state(self, name: str, **props):
+        """Change unit properties and emit PropertiesChanged, as systemd does"""
+        self.units.setdefault(name, {}).update(props)
+        self.emit(self.unit_path(name), PROPERTIES_INTERFACE, "PropertiesChanged", [UNIT_INTERFACE, props, []])
+
+    async def wait_closed(self):
+        await self._closed.wait()
+
+    def close(self):
+        self._closed.set()
+
+
+class ServiceRegistry:
+    """In-memory table of systemd services, kept current from bus signals.
+
+    The table is loaded once with ListUnits and then updated from
+    PropertiesChanged, UnitNew, UnitRemoved and JobRemoved, so listing
+    services never forks systemctl. Every change is broadcast on the
+    "services" WebSocket channel. available is False while the bus cannot
+    be reached; callers then fall back to systemctl.
+    """
+
+    def __init__(self, bus=None, websocket_manager=None):
+        self.bus = bus if bus is not None else DBusBus()
+        self.websocket_manager = websocket_manager
+        self.units: Dict[str, dict] = {}
+        self.paths: Dict[str, str] = {}  # object path -> unit name
+        self.available = False
+        self._task: Optional[asyncio.Task] = None
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        self.bus.on_signal(self._on_signal)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for task in self._refreshing.values():
+            task.cancel()
+        self.bus.close()
+        self.available = False
+
+    async def _run(self):
+        while True:
+            try:
+                await self.bus.connect()
+                await self.load()
+                self.available = True
+                logger.info(f"Service registry loaded {len(self.units)} units from systemd")
+                await self.bus.wait_closed()
+                logger.warning("Lost connection to systemd, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"systemd D-Bus unavailable: {e}")
+            self.available = False
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def load(self):
+        """Replace the table with the current ListUnits result"""
+        (units,) = await self.bus.call_manager("ListUnits")
+        self.units.clear()
+        self.paths.clear()
+        for name, description, load_state, active_state, sub_state, _, path, *_ in units:
+            if name.endswith(".service"):
+                self._store(name, path, {
+                    "description": description,
+                    "load_state": load_state,
+                    "active_state": active_state,
+                    "sub_state": sub_state
+                })
+
+    def _store(self, name: str, path: str, fields: dict) -> dict:
+        unit = self.units.get(name)
+        if unit is None:
+            unit = self.units[name] = {
+                "name": name[:-len(".service")],
+                "full_name": name,
+                "load_state": "",
+                "active_state": "",
+                "sub_state": "",
+                "description": ""
+            }
+            self.paths[path] = name
+        unit.update(fields)
+        return unit
+
+    def _on_signal(self, path: str, interface: str, member: str, body: list):
+        if member == "PropertiesChanged":
+            name = self.paths.get(path)
+            if name is None or body[0] != UNIT_INTERFACE:
+                return
+            fields = {TABLE_PROPERTIES[key]: value for key, value in body[1].items() if key in TABLE_PROPERTIES}
+            if fields:
+                self._publish(self._store(name, path, fields))
+        elif interface == MANAGER_INTERFACE:
+            if member == "UnitNew":
+                name, unit_path = body[0], body[1]
+            elif member == "JobRemoved":
+                name, unit_path = body[2], None
+            elif member == "UnitRemoved":
+                name = body[0]
+                unit = self.units.pop(name, None)
+                self.paths.pop(body[1], None)
+                if unit is not None:
+                    self._publish({**unit, "removed": True})
+                return
+            else:
+                return
+            if name.endswith(".service") and name not in self._refreshing:
+                self._refreshing[name] = asyncio.ensure_future(self._refresh(name, unit_path))
+
+    async def _refresh(self, name: str, path: Optional[str] = None):
+        """Re-read one unit's table properties from systemd"""
+        try:
+            if path is None:
+                (path,) = await self.bus.call_manager("GetUnit", "s", [name])
+            props = await self.bus.get_properties(path, UNIT_INTERFACE)
+            self._publish(self._store(name, path, {
+                field: props.get(key, "") for key, field in TABLE_PROPERTIES.items()
+            }))
+        except LookupError:
+            # Unloaded again before we got to it
+            pass
+        except Exception as e:
+            logger.error(f"Error refreshing unit {name}: {e}")
+        finally:
+            self._refreshing.pop(name, None)
+
+    def _publish(self, unit: dict):
+        if self.websocket_manager is None:
+            return
+        asyncio.ensure_future(self.websocket_manager.broadcast(
+            {"type": "service_update", "data": dict(unit)},
+            channel="services"
+        ))
+
+    def list_services(self) -> List[dict]:
+        """All known services, sorted by unit name"""
+        return [dict(self.units[name]) for name in sorted(self.units)]
+
+    async def get_properties(self, service_name: str) -> Optional[dict]:
+        """Unit and Service properties of one service, or None if systemd does not know it"""
+        name = service_name if "." in service_name else f"{service_name}.service"
+        try:
+            (path,) = await self.bus.call_manager("LoadUnit", "s", [name])
+            props = await self.bus.get_properties(path, UNIT_INTERFACE)
+            if props.get("LoadState") == "not-found":
+                return None
+            props.update(await self.bus.get_properties(path, SERVICE_INTERFACE))
+        except LookupError:
+            return None
+        return props
+
+
+def get_service_registry(request: Request) -> ServiceRegistry:
+    """Dependency returning the application's service registry"""
+    return request.app.state.service_registry
@@ -0,0 +1,528 @@
+import os
+import math
+import time
+import array
+import bisect
+import fcntl
+import random
+import shutil
+import struct
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rollup tiers as (name, bucket width in seconds); "raw" keeps every sample
+TIERS: List[Tuple[str, int]] = [
+    ("raw", 0),
+    ("1m", 60),
+    ("5m", 300),
+    ("1h", 3600),
+    ("1d", 86400)
+]
+TIER_WIDTHS: Dict[str, int] = dict(TIERS)
+
+RAW_COLUMNS = ("ts", "value")
+ROLLUP_COLUMNS = ("ts", "min", "max", "avg", "p95", "count")
+
+_SEGMENT_MAGIC = b"TSEG"
+_SEGMENT_HEADER = struct.Struct("<4sHI")
+_OPEN_SEGMENT = "open.seg"
+
+
+class ColumnSegment:
+    """Append-only block of rows stored as one array per column"""
+
+    def __init__(self, columns: Sequence[str], capacity: int):
+        self.columns = columns
+        self.capacity = capacity
+        self.data = [array.array("d") for _ in columns]
+        self.persisted = False
+
+    def __len__(self) -> int:
+        return len(self.data[0])
+
+    def is_full(self) -> bool:
+        return len(self) >= self.capacity
+
+    @property
+    def first_ts(self) -> float:
+        return self.data[0][0]
+
+    @property
+    def last_ts(self) -> float:
+        return self.data[0][-1]
+
+    def append(self, row: Sequence[float]):
+        for column, value in zip(self.data, row):
+            column.append(value)
+
+    def rows(self, start: float, end: float) -> Iterator[Tuple[float, ...]]:
+        """Rows with start <= ts <= end"""
+        ts = self.data[0]
+        lo = bisect.bisect_left(ts, start)
+        hi = bisect.bisect_right(ts, end)
+        for i in range(lo, hi):
+            yield tuple(column[i] for column in self.data)
+
+    def write(self, path: str):
+        """Atomically write the segment to path"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, len(self.data), len(self)))
+            for column in self.data:
+                column.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def read(cls, path: str, columns: Sequence[str], capacity: int) -> "ColumnSegment":
+        """Load a segment written by write()"""
+        with open(path, "rb") as f:
+            magic, ncols, nrows = _SEGMENT_HEADER.unpack(f.read(_SEGMENT_HEADER.size))
+            if magic != _SEGMENT_MAGIC or ncols != len(columns):
+                raise ValueError(f"Invalid segment file {path}")
+            segment = cls(columns, max(capacity, nrows))
+            for column in segment.data:
+                column.fromfile(f, nrows)
+        return segment
+
+
+class Series:
+    """Time-ordered list of column segments for one metric in one tier"""
+
+    def __init__(self, columns: Sequence[str], segment_size: int):
+        self.columns = columns
+        self.segment_size = segment_size
+        self.segments: List[ColumnSegment] = []
+
+    @property
+    def last_ts(self) -> Optional[float]:
+        if not self.segments:
+            return None
+        return self.segments[-1].last_ts
+
+    def append(self, row: Sequence[float]):
+        if not self.segments or self.segments[-1].is_full():
+            self.segments.append(ColumnSegment(self.columns, self.segment_size))
+        self.segments[-1].append(row)
+
+    def rows(self, start: float, end: float) -> Iterator[Tuple[float, ...]]:
+        """Rows with start <= ts <= end, oldest first"""
+        for segment in self.segments:
+            if segment.last_ts < start:
+                continue
+            if segment.first_ts > end:
+                break
+            yield from segment.rows(start, end)
+
+    def drop_before(self, cutoff: float) -> List[ColumnSegment]:
+        """Drop sealed segments that end before cutoff"""
+        dropped = []
+        while len(self.segments) > 1 and self.segments[0].last_ts < cutoff:
+            dropped.append(self.segments.pop(0))
+        return dropped
+
+
+class _Bucket:
+    """Open rollup bucket, aggregated incrementally as samples arrive"""
+
+    RESERVOIR_SIZE = 256
+
+    __slots__ = ("start", "count", "total", "minimum", "maximum", "reservoir", "seen")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.reservoir: List[float] = []
+        self.seen = 0
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        # Reservoir sampling keeps p95 estimation bounded for wide buckets
+        self.seen += 1
+        if len(self.reservoir) < self.RESERVOIR_SIZE:
+            self.reservoir.append(value)
+        else:
+            slot = random.randrange(self.seen)
+            if slot < self.RESERVOIR_SIZE:
+                self.reservoir[slot] = value
+
+    def row(self) -> Tuple[float, ...]:
+        return (
+            self.start,
+            self.minimum,
+            self.maximum,
+            self.total / self.count,
+            _percentile(sorted(self.reservoir), 0.95),
+            float(self.count)
+        )
+
+
+def _percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _as_rollup(row: Tuple[float, ...]) -> Tuple[float, ...]:
+    """Present a raw (ts, value) row as a rollup row"""
+    ts, value = row
+    return (ts, value, value, value, value, 1.0)
+
+
+def _resample(rows: List[Tuple[float, ...]], step: float) -> List[Tuple[float, ...]]:
+    """Merge adjacent rollup rows into step-aligned buckets"""
+    merged: List[Tuple[float, ...]] = []
+    current = None
+    for ts, minimum, maximum, avg, p95, count in rows:
+        bucket_start = ts - ts % step
+        if current is None or current[0] != bucket_start:
+            if current is not None:
+                merged.append(tuple(current[:3]) + (current[3] / current[5], current[4], current[5]))
+            current = [bucket_start, minimum, maximum, avg * count, p95, count]
+            continue
+        current[1] = min(current[1], minimum)
+        current[2] = max(current[2], maximum)
+        current[3] += avg * count
+        current[4] = max(current[4], p95)  # p95 of merged buckets is bounded by the worst bucket
+        current[5] += count
+    if current is not None:
+        merged.append(tuple(current[:3]) + (current[3] / current[5], current[4], current[5]))
+    return merged
+
+
+class TimeSeriesStore:
+    """Embedded columnar time-series store with incremental rollup tiers.
+
+    Samples are appended to per-metric raw series and folded into the open
+    bucket of every rollup tier at ingest time, so range queries read a
+    handful of pre-aggregated rows from the coarsest tier that satisfies
+    the requested resolution. Sealed segments are persisted once, by the
+    next flush, as flat column files under data_dir and never rewritten;
+    ingest itself does no I/O.
+
+    With max_metrics set, metrics not given up front are registered the
+    first time they are ingested, until max_metrics series exist; samples
+    of further new metrics are dropped. Registered metrics whose newest
+    data has expired from every tier are evicted on flush, freeing their
+    slot and directories; on restart the most recently written series are
+    reloaded first. Metric names are used as directory names and must not
+    contain "/".
+    """
+
+    def __init__(
+        self,
+        metrics: Sequence[str],
+        retention_days: int = 30,
+        data_dir: Optional[str] = None,
+        segment_size: int = 1024,
+        max_metrics: int = 0
+    ):
+        self.metrics = list(metrics)
+        self._known = set(self.metrics)
+        self._fixed = frozenset(self.metrics)  # given up front, never evicted
+        self.max_metrics = max_metrics
+        self.data_dir = data_dir
+        self.segment_size = segment_size
+        self.retention: Dict[str, float] = {
+            "raw": min(1, retention_days) * 86400,
+            "1m": min(7, retention_days) * 86400,
+            "5m": retention_days * 86400,
+            "1h": retention_days * 86400,
+            "1d": retention_days * 86400
+        }
+        self.series: Dict[Tuple[str, str], Series] = {}
+        self.buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._lock = threading.RLock()
+        self._lock_file = None
+        self._writable = False
+        self._full_logged = False
+
+        for metric in self.metrics:
+            self._add_series(metric)
+
+        if data_dir:
+            self._open_data_dir()
+
+    def _add_series(self, metric: str):
+        for tier, _ in TIERS:
+            columns = RAW_COLUMNS if tier == "raw" else ROLLUP_COLUMNS
+            self.series[(tier, metric)] = Series(columns, self.segment_size)
+
+    def _register(self, metric: str) -> bool:
+        """Start a series for a metric first seen at ingest, within max_metrics"""
+        if not self.max_metrics or len(self.metrics) >= self.max_metrics or "/" in metric:
+            if self.max_metrics and not self._full_logged:
+                self._full_logged = True
+                logger.warning(f"Time-series store full ({self.max_metrics} metrics); dropping new metrics such as {metric}")
+            return False
+        self.metrics.append(metric)
+        self._known.add(metric)
+        self._add_series(metric)
+        if self._writable:
+            for tier, _ in TIERS:
+                os.makedirs(self._series_dir(tier, metric), exist_ok=True)
+        return True
+
+    def _expired(self, metric: str, now: float) -> bool:
+        """Whether retention has left nothing of metric in any tier"""
+        for tier, _ in TIERS:
+            cutoff = now - self.retention[tier]
+            last_ts = self.series[(tier, metric)].last_ts
+            bucket = self.buckets.get((tier, metric))
+            if (last_ts is not None and last_ts >= cutoff) or (bucket is not None and bucket.start >= cutoff):
+                return False
+        return True
+
+    def _evict(self, metric: str):
+        """Forget a registered metric and its files, freeing its slot"""
+        self.metrics.remove(metric)
+        self._known.discard(metric)
+        for tier, _ in TIERS:
+            del self.series[(tier, metric)]
+            self.buckets.pop((tier, metric), None)
+            if self._writable:
+                shutil.rmtree(self._series_dir(tier, metric), ignore_errors=True)
+        # Warn again should the store fill up once more
+        self._full_logged = False
+
+    def ingest(self, timestamp: float, values: Dict[str, float]):
+        """Append one sample per metric and update the open rollup buckets"""
+        with self._lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                if metric not in self._known and not self._register(metric):
+                    continue
+                value = float(value)
+
+                raw = self.series[("raw", metric)]
+                if raw.last_ts is not None and timestamp <= raw.last_ts:
+                    continue
+                raw.append((timestamp, value))
+
+                for tier, width in TIERS[1:]:
+                    key = (tier, metric)
+                    bucket_start = timestamp - timestamp % width
+                    bucket = self.buckets.get(key)
+                    if bucket is not None and bucket.start != bucket_start:
+                        self.series[key].append(bucket.row())
+                        bucket = None
+                    if bucket is None:
+                        bucket = self.buckets[key] = _Bucket(bucket_start)
+                    bucket.add(value)
+
+    def select_tier(self, step: float, start: float, now: Optional[float] = None) -> str:
+        """Coarsest tier whose bucket width still satisfies the requested step
+        and whose retention reaches back to start; finer tiers expire sooner,
+        so for older ranges the finest tier still holding start is used instead"""
+        now = time.time() if now is None else now
+        covering = [(tier, width) for tier, width in TIERS if now - self.retention[tier] <= start]
+        if not covering:
+            return TIERS[-1][0]
+        chosen = covering[0][0]
+        for tier, width in covering:
+            if width <= step:
+                chosen = tier
+        return chosen
+
+    def query(
+        self,
+        metric: str,
+        start: float,
+        end: float,
+        step: float = 0,
+        max_points: int = 500
+    ) -> List[Dict[str, float]]:
+        """Aggregated points for metric between start and end (epoch seconds)"""
+        if end <= start or metric not in self._known:
+            return []
+        if max_points:
+            step = max(step, math.ceil((end - start) / max_points))
+        tier = self.select_tier(step, start)
+
+        with self._lock:
+            rows = list(self.series[(tier, metric)].rows(start, end))
+            bucket = self.buckets.get((tier, metric))
+            if bucket is not None and start <= bucket.start <= end:
+                rows.append(bucket.row())
+
+        if tier == "raw":
+            rows = [_as_rollup(row) for row in rows]
+        if step > TIER_WIDTHS[tier]:
+            rows = _resample(rows, step)
+
+        return [
+            {
+                "timestamp": ts,
+                "min": minimum,
+                "max": maximum,
+                "avg": avg,
+                "p95": p95,
+                "count": int(count)
+            }
+            for ts, minimum, maximum, avg, p95, count in rows
+        ]
+
+    def latest(self, metric: str) -> Optional[Tuple[float, float]]:
+        """Most recent raw (timestamp, value) for metric"""
+        with self._lock:
+            series = self.series.get(("raw", metric))
+            if series is None or not series.segments:
+                return None
+            segment = series.segments[-1]
+            return segment.data[0][-1], segment.data[1][-1]
+
+    def flush(self):
+        """Apply retention and checkpoint open segments to disk"""
+        now = time.time()
+        with self._lock:
+            if self.max_metrics:
+                evicted = [metric for metric in self.metrics if metric not in self._fixed and self._expired(metric, now)]
+                for metric in evicted:
+                    self._evict(metric)
+                if evicted:
+                    logger.info(f"Evicted {len(evicted)} expired series from the time-series store")
+            for (tier, metric), series in self.series.items():
+                for segment in series.drop_before(now - self.retention[tier]):
+                    if segment.persisted:
+                        self._remove(self._segment_path(tier, metric, segment))
+
+                if not self._writable:
+                    continue
+                try:
+                    for segment in series.segments:
+                        if segment.is_full() and not segment.persisted:
+                            segment.write(self._segment_path(tier, metric, segment))
+                            segment.persisted = True
+                    open_path = os.path.join(self._series_dir(tier, metric), _OPEN_SEGMENT)
+                    if series.segments and not series.segments[-1].is_full():
+                        series.segments[-1].write(open_path)
+                    else:
+                        self._remove(open_path)
+                except OSError as e:
+                    logger.error(f"Error checkpointing {tier} series for {metric}: {e}")
+
+    def close(self):
+        """Checkpoint and release the data directory"""
+        self.flush()
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+            self._writable = False
+
+    def _series_dir(self, tier: str, metric: str) -> str:
+        return os.path.join(self.data_dir, tier, metric)
+
+    def _segment_path(self, tier: str, metric: str, segment: ColumnSegment) -> str:
+        return os.path.join(self._series_dir(tier, metric), f"{int(segment.first_ts * 1000)}.seg")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing segment {path}: {e}")
+
+    def _open_data_dir(self):
+        """Take the writer lock (one process per data_dir persists) and load segments"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        left_out = []
+        if self.max_metrics:
+            # Series registered at ingest by an earlier run, most recently written first;
+            # every checkpoint replaces a file in the raw series directory, updating its mtime
+            raw_dir = os.path.join(self.data_dir, "raw")
+            found = []
+            for metric in os.listdir(raw_dir) if os.path.isdir(raw_dir) else []:
+                try:
+                    found.append((os.path.getmtime(os.path.join(raw_dir, metric)), metric))
+                except OSError:
+                    continue
+            for mtime, metric in sorted(found, reverse=True):
+                if metric in self._known:
+                    continue
+                if len(self.metrics) < self.max_metrics:
+                    self.metrics.append(metric)
+                    self._known.add(metric)
+                    self._add_series(metric)
+                else:
+                    left_out.append((mtime, metric))
+        self._lock_file = open(os.path.join(self.data_dir, ".lock"), "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._writable = True
+            for tier, metric in self.series:
+                os.makedirs(self._series_dir(tier, metric), exist_ok=True)
+            # Series that did not fit and have expired anyway would never be loaded again
+            cutoff = time.time() - max(self.retention.values())
+            for mtime, metric in left_out:
+                if mtime < cutoff:
+                    for tier, _ in TIERS:
+                        shutil.rmtree(self._series_dir(tier, metric), ignore_errors=True)
+        except OSError:
+            logger.info(f"Time-series data in {self.data_dir} is owned by another process; running read-only")
+            self._lock_file.close()
+            self._lock_file = None
+        self._load()
+
+    def _load(self):
+        """Load persisted segments and rebuild open buckets from raw samples"""
+        for (tier, metric), series in self.series.items():
+            series_dir = self._series_dir(tier, metric)
+            if not os.path.isdir(series_dir):
+                continue
+            names = sorted(
+                (name for name in os.listdir(series_dir) if name.endswith(".seg") and name != _OPEN_SEGMENT),
+                key=lambda name: int(name[:-4])
+            )
+            for name in names:
+                try:
+                    segment = ColumnSegment.read(os.path.join(series_dir, name), series.columns, self.segment_size)
+                    segment.persisted = True
+                    series.segments.append(segment)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping unreadable segment {name} for {tier}/{metric}: {e}")
+
+            open_path = os.path.join(series_dir, _OPEN_SEGMENT)
+            if os.path.exists(open_path):
+                try:
+                    pending = ColumnSegment.read(open_path, series.columns, self.segment_size)
+                    segment = ColumnSegment(series.columns, self.segment_size)
+                    for row in pending.rows(-math.inf, math.inf):
+                        # A crash between sealing and checkpointing can leave duplicates behind
+                        if series.last_ts is None or row[0] > series.last_ts:
+                            segment.append(row)
+                    if len(segment):
+                        series.segments.append(segment)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Skipping unreadable open segment for {tier}/{metric}: {e}")
+
+        for metric in self.metrics:
+            raw = self.series[("raw", metric)]
+            last_ts = raw.last_ts
+            if last_ts is None:
+                continue
+            for tier, width in TIERS[1:]:
+                bucket_start = last_ts - last_ts % width
+                rollup = self.series[(tier, metric)]
+                if rollup.last_ts is not None and rollup.last_ts >= bucket_start:
+                    continue
+                bucket = _Bucket(bucket_start)
+                for _, value in raw.rows(bucket_start, last_ts):
+                    bucket.add(value)
+                if bucket.count:
+                    self.buckets[(tier, metric)] = bucket
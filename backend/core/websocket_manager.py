@@ -1,17 +1,223 @@
+import copy
+import time
 import asyncio
 import json
 import logging
-from typing import List, Dict, Set
-from fastapi import WebSocket
+from collections import deque
+from typing import Deque, List, Dict, Optional, Set, Tuple
+from fastapi import Request, WebSocket
 from datetime import datetime
+from .config import get_settings
 
 logger = logging.getLogger(__name__)
 
+
+class FanoutStats:
+    """Rolling statistics of broadcast fan-out latency"""
+
+    def __init__(self, window: int = 256):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.messages = 0
+        self.dropped_clients = 0
+        self.conflated = 0
+
+    def record(self, latency: float):
+        self.messages += 1
+        self.latencies.append(latency)
+
+    def summary(self) -> dict:
+        """Latency summary in milliseconds over the rolling window"""
+        if not self.latencies:
+            return {"messages": self.messages, "last_ms": None, "avg_ms": None, "p95_ms": None, "max_ms": None}
+        ordered = sorted(self.latencies)
+        return {
+            "messages": self.messages,
+            "last_ms": round(self.latencies[-1] * 1000, 3),
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)] * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3)
+        }
+
+
+class _Fanout:
+    """Tracks one broadcast until every recipient has sent or discarded it"""
+
+    __slots__ = ("started", "remaining", "stats")
+
+    def __init__(self, remaining: int, stats: FanoutStats):
+        self.started = time.perf_counter()
+        self.remaining = remaining
+        self.stats = stats
+
+    def done(self):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.stats.record(time.perf_counter() - self.started)
+
+
+def _diff(old, new, path: Tuple = ()) -> Tuple[dict, List[list]]:
+    """Changed leaves of new relative to old, plus paths of removed keys.
+
+    Dicts are compared key by key; any other value (including lists) is a
+    leaf that is sent whole when it changes.
+    """
+    changes: dict = {}
+    removed: List[list] = []
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            sub_changes, sub_removed = _diff(old[key], value, path + (key,))
+            if sub_changes:
+                changes[key] = sub_changes
+            removed.extend(sub_removed)
+        elif old[key] != value:
+            changes[key] = value
+    for key in old:
+        if key not in new:
+            removed.append(list(path + (key,)))
+    return changes, removed
+
+
+def _apply_changes(target: dict, changes: dict):
+    """Merge nested changes into target; non-dict targets are replaced"""
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _apply_changes(target[key], value)
+        else:
+            target[key] = value
+
+
+def _remove_path(target: dict, path: list):
+    for key in path[:-1]:
+        target = target.get(key)
+        if not isinstance(target, dict):
+            return
+    target.pop(path[-1], None)
+
+
+def _path_in(changes: dict, path: list) -> bool:
+    for key in path:
+        if not isinstance(changes, dict) or key not in changes:
+            return False
+        changes = changes[key]
+    return True
+
+
+class _PendingDelta:
+    """An unsent delta that later deltas are merged into"""
+
+    __slots__ = ("base_seq", "seq", "changes", "removed", "owned")
+
+    def __init__(self, base_seq: int, seq: int, changes: dict, removed: List[list]):
+        self.base_seq = base_seq
+        self.seq = seq
+        # changes/removed may be shared with other clients until first merge
+        self.changes = changes
+        self.removed = removed
+        self.owned = False
+
+    def merge(self, seq: int, changes: dict, removed: List[list]):
+        """Fold a newer delta into this one, keeping the original base"""
+        if not self.owned:
+            self.changes = copy.deepcopy(self.changes)
+            self.removed = list(self.removed)
+            self.owned = True
+        for path in removed:
+            _remove_path(self.changes, path)
+            if path not in self.removed:
+                self.removed.append(path)
+        _apply_changes(self.changes, copy.deepcopy(changes))
+        self.removed = [path for path in self.removed if not _path_in(changes, path)]
+        self.seq = seq
+
+
+class ClientConnection:
+    """Outbound state for one WebSocket, drained by its own sender task.
+
+    Frames on "stream" channels are queued in order up to max_queue.
+    Frames on "conflate" channels occupy a single slot per channel that
+    is overwritten by newer frames, so a slow client only ever receives
+    the latest value and never accumulates backlog.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        # Entries are (seq, frame, fanout); seq preserves arrival order across both
+        self.queue: Deque[Tuple[int, str, Optional[_Fanout]]] = deque()
+        self.latest: Dict[str, Tuple[int, str, Optional[_Fanout]]] = {}
+        self.seq = 0
+        # Delta-encoded channels: last seq the client will hold once its
+        # pending frames are sent, and the unsent delta (if any) per channel
+        self.delta_channels: Set[str] = set()
+        self.channel_seq: Dict[str, int] = {}
+        self.pending_deltas: Dict[str, _PendingDelta] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.sent = 0
+
+    def depth(self) -> int:
+        """Frames waiting to be sent"""
+        return len(self.queue) + len(self.latest)
+
+    def enqueue(self, frame: str, fanout: Optional[_Fanout] = None) -> bool:
+        """Queue a stream frame; returns False if the client cannot keep up"""
+        if len(self.queue) >= self.max_queue:
+            return False
+        self.seq += 1
+        self.queue.append((self.seq, frame, fanout))
+        self.wakeup.set()
+        return True
+
+    def replace(self, channel: str, frame: str, fanout: Optional[_Fanout] = None) -> bool:
+        """Set the pending frame of a conflated channel; returns True if an unsent frame was superseded"""
+        previous = self.latest.pop(channel, None)
+        self.seq += 1
+        self.latest[channel] = (self.seq, frame, fanout)
+        self.wakeup.set()
+        if previous is not None:
+            if previous[2] is not None:
+                previous[2].done()
+            return True
+        return False
+
+    def next_frame(self) -> Tuple[str, Optional[_Fanout]]:
+        """Oldest pending frame across the stream queue and conflated slots"""
+        if self.latest:
+            # Slots are re-inserted on replace, so dict order is arrival order
+            channel = next(iter(self.latest))
+            if not self.queue or self.latest[channel][0] < self.queue[0][0]:
+                _, frame, fanout = self.latest.pop(channel)
+                self.pending_deltas.pop(channel, None)
+                return frame, fanout
+        _, frame, fanout = self.queue.popleft()
+        return frame, fanout
+
+    def discard(self):
+        """Drop everything still queued"""
+        pending = list(self.queue) + list(self.latest.values())
+        self.queue.clear()
+        self.latest.clear()
+        self.pending_deltas.clear()
+        for _, _, fanout in pending:
+            if fanout is not None:
+                fanout.done()
+
+
+# Channel delivery policies: "conflate" keeps only the newest pending
+# payload per client, "stream" delivers every message in order
+CONFLATE = "conflate"
+STREAM = "stream"
+
+
 class WebSocketManager:
     """Manages WebSocket connections and message broadcasting"""
-    
-    def __init__(self):
+
+    def __init__(self, max_queue: Optional[int] = None):
+        self.max_queue = max_queue or get_settings().WEBSOCKET_MAX_QUEUE
         self.active_connections: List[WebSocket] = []
+        self.clients: Dict[WebSocket, ClientConnection] = {}
         self.connection_metadata: Dict[WebSocket, dict] = {}
         self.subscriptions: Dict[str, Set[WebSocket]] = {
             "system_metrics": set(),
@@ -19,104 +225,343 @@ class WebSocketManager:
             "logs": set(),
             "processes": set(),
             "services": set(),
-            "notifications": set()
+            "notifications": set(),
+            "backups": set()
         }
-    
+        self.channel_policies: Dict[str, str] = {
+            "system_metrics": CONFLATE,
+            "processes": CONFLATE,
+            "alerts": STREAM,
+            "logs": STREAM,
+            "services": STREAM,
+            "notifications": STREAM,
+            "backups": STREAM
+        }
+        # Last message and sequence number per conflated channel, the base for deltas
+        self.channel_state: Dict[str, Tuple[int, dict]] = {}
+        # Per-channel producers told about (un)subscriptions, see add_listener()
+        self.listeners: Dict[str, object] = {}
+        self.fanout_stats = FanoutStats()
+
     async def connect(self, websocket: WebSocket):
         """Accept new WebSocket connection"""
         await websocket.accept()
         self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self.max_queue)
+        client.task = asyncio.create_task(self._sender(client))
+        self.clients[websocket] = client
         self.connection_metadata[websocket] = {
             "connected_at": datetime.utcnow(),
             "client_info": {},
             "subscriptions": set()
         }
         logger.info(f"New WebSocket connection. Total: {len(self.active_connections)}")
-    
+
     async def disconnect(self, websocket: WebSocket):
         """Remove WebSocket connection"""
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
-        
+
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            client.discard()
+            if client.task is not None and client.task is not asyncio.current_task():
+                client.task.cancel()
+
         if websocket in self.connection_metadata:
             # Unsubscribe from all channels
             for channel in self.connection_metadata[websocket].get("subscriptions", set()):
                 if channel in self.subscriptions:
                     self.subscriptions[channel].discard(websocket)
+                self._notify_unsubscribed(channel, websocket)
             del self.connection_metadata[websocket]
-        
+
         logger.info(f"WebSocket disconnected. Total: {len(self.active_connections)}")
-    
+
+    async def _sender(self, client: ClientConnection):
+        """Drain a client's queue; a slow socket only delays itself"""
+        try:
+            while True:
+                await client.wakeup.wait()
+                client.wakeup.clear()
+                while client.depth():
+                    frame, fanout = client.next_frame()
+                    try:
+                        await client.websocket.send_text(frame)
+                        client.sent += 1
+                    finally:
+                        if fanout is not None:
+                            fanout.done()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending message: {e}")
+            await self.disconnect(client.websocket)
+
+    @staticmethod
+    def _serialize(message: dict) -> str:
+        """Serialize a message once for all recipients"""
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False, default=str)
+
     async def handle_message(self, websocket: WebSocket, data: dict):
         """Handle incoming WebSocket message"""
         message_type = data.get("type")
-        
+
         if message_type == "subscribe":
             channel = data.get("channel")
-            await self.subscribe(websocket, channel)
+            await self.subscribe(
+                websocket,
+                channel,
+                encoding=data.get("encoding", "full"),
+                options=data.get("filters")
+            )
         elif message_type == "unsubscribe":
             channel = data.get("channel")
             await self.unsubscribe(websocket, channel)
+        elif message_type == "resync":
+            self.resync(websocket, data.get("channel"))
         elif message_type == "ping":
-            await websocket.send_json({"type": "pong", "timestamp": datetime.utcnow().isoformat()})
+            await self.send_to_client(websocket, {"type": "pong", "timestamp": datetime.utcnow().isoformat()})
         elif message_type == "auth":
             # Handle authentication
             token = data.get("token")
             self.connection_metadata[websocket]["authenticated"] = bool(token)
-    
-    async def subscribe(self, websocket: WebSocket, channel: str):
-        """Subscribe WebSocket to a channel"""
+
+    async def subscribe(self, websocket: WebSocket, channel: str, encoding: str = "full", options: Optional[dict] = None):
+        """Subscribe WebSocket to a channel.
+
+        options are handed to the channel's listener, if any (e.g. the
+        filters of a "logs" subscription). Subscribing again replaces them.
+
+        With encoding="delta" on a conflated channel the client receives one
+        {"type": "snapshot", "seq", "data"} frame, then {"type": "delta",
+        "seq", "base_seq", "changes", "removed"} frames. A client applies a
+        delta only if base_seq equals its last seq: nested dicts in changes
+        are merged into its copy, other values replace it, and each path in
+        removed is deleted. On a gap it sends {"type": "resync"}.
+        """
         if channel in self.subscriptions:
+            delta = encoding == "delta" and self.channel_policies.get(channel) == CONFLATE
             self.subscriptions[channel].add(websocket)
             self.connection_metadata[websocket]["subscriptions"].add(channel)
-            await websocket.send_json({
+            await self.send_to_client(websocket, {
                 "type": "subscribed",
                 "channel": channel,
+                "encoding": "delta" if delta else "full",
                 "timestamp": datetime.utcnow().isoformat()
             })
-    
+            client = self.clients.get(websocket)
+            if delta and client is not None:
+                client.delta_channels.add(channel)
+                self.resync(websocket, channel)
+            listener = self.listeners.get(channel)
+            if listener is not None:
+                await listener.subscribed(websocket, options or {})
+
+    def resync(self, websocket: WebSocket, channel: str):
+        """Replace anything pending on a delta channel with a full snapshot"""
+        client = self.clients.get(websocket)
+        if client is None or channel not in client.delta_channels:
+            return
+        client.pending_deltas.pop(channel, None)
+        client.channel_seq.pop(channel, None)
+        state = self.channel_state.get(channel)
+        if state is not None:
+            seq, message = state
+            client.replace(channel, self._serialize(self._snapshot_frame(channel, seq, message)))
+            client.channel_seq[channel] = seq
+
+    @staticmethod
+    def _snapshot_frame(channel: str, seq: int, message: dict) -> dict:
+        return {"type": "snapshot", "channel": channel, "seq": seq, "data": message}
+
+    @staticmethod
+    def _delta_frame(channel: str, delta: _PendingDelta) -> dict:
+        return {
+            "type": "delta",
+            "channel": channel,
+            "seq": delta.seq,
+            "base_seq": delta.base_seq,
+            "changes": delta.changes,
+            "removed": delta.removed
+        }
+
     async def unsubscribe(self, websocket: WebSocket, channel: str):
         """Unsubscribe WebSocket from a channel"""
         if channel in self.subscriptions:
             self.subscriptions[channel].discard(websocket)
             self.connection_metadata[websocket]["subscriptions"].discard(channel)
-            await websocket.send_json({
+            client = self.clients.get(websocket)
+            if client is not None:
+                client.delta_channels.discard(channel)
+                client.channel_seq.pop(channel, None)
+                client.pending_deltas.pop(channel, None)
+            self._notify_unsubscribed(channel, websocket)
+            await self.send_to_client(websocket, {
                 "type": "unsubscribed",
                 "channel": channel,
                 "timestamp": datetime.utcnow().isoformat()
             })
-    
+
     async def broadcast(self, message: dict, channel: str = None):
         """Broadcast message to all or specific channel subscribers"""
         if channel and channel in self.subscriptions:
             connections = list(self.subscriptions[channel])
         else:
-            connections = self.active_connections
-        
-        disconnected = []
+            connections = list(self.active_connections)
+
+        conflate = self.channel_policies.get(channel) == CONFLATE
+        if conflate:
+            base = self.channel_state.get(channel)
+            seq = base[0] + 1 if base else 1
+            self.channel_state[channel] = (seq, message)
+
+        if not connections:
+            return
+
+        fanout = _Fanout(len(connections), self.fanout_stats)
+        frames: Dict[str, str] = {}
+        changes = removed = None
+
+        def shared_frame(kind: str) -> str:
+            # Each encoding is serialized at most once per broadcast
+            if kind not in frames:
+                if kind == "full":
+                    frames[kind] = self._serialize(message)
+                elif kind == "snapshot":
+                    frames[kind] = self._serialize(self._snapshot_frame(channel, seq, message))
+                else:
+                    frames[kind] = self._serialize(
+                        self._delta_frame(channel, _PendingDelta(base[0], seq, changes, removed))
+                    )
+            return frames[kind]
+
+        overflowed = []
         for connection in connections:
-            try:
-                await connection.send_json(message)
-            except Exception as e:
-                logger.error(f"Error sending message: {e}")
-                disconnected.append(connection)
-        
-        # Clean up disconnected clients
-        for conn in disconnected:
+            client = self.clients.get(connection)
+            if client is None:
+                fanout.done()
+                overflowed.append(connection)
+            elif conflate and channel in client.delta_channels:
+                pending = client.pending_deltas.get(channel)
+                if base is not None and changes is None:
+                    changes, removed = _diff(base[1], message)
+                if pending is not None and channel in client.latest:
+                    # Fold into the unsent delta so the client's base stays valid
+                    pending.merge(seq, changes, removed)
+                    frame = self._serialize(self._delta_frame(channel, pending))
+                elif (
+                    base is not None
+                    and channel not in client.latest
+                    and client.channel_seq.get(channel) == base[0]
+                ):
+                    frame = shared_frame("delta")
+                    client.pending_deltas[channel] = _PendingDelta(base[0], seq, changes, removed)
+                else:
+                    # New subscriber, gap, or an unsent snapshot: send current state whole
+                    frame = shared_frame("snapshot")
+                    client.pending_deltas.pop(channel, None)
+                client.channel_seq[channel] = seq
+                if client.replace(channel, frame, fanout):
+                    self.fanout_stats.conflated += 1
+            elif conflate:
+                if client.replace(channel, shared_frame("full"), fanout):
+                    self.fanout_stats.conflated += 1
+            elif not client.enqueue(shared_frame("full"), fanout):
+                fanout.done()
+                overflowed.append(connection)
+
+        # Drop stream subscribers that cannot keep up rather than buffering without bound
+        for conn in overflowed:
+            if conn in self.clients:
+                logger.warning(f"Dropping slow WebSocket client (queue full at {self.max_queue})")
+                self.fanout_stats.dropped_clients += 1
+            await self.disconnect(conn)
+
+    async def send_to_clients(self, websockets, message: dict):
+        """Send one message to several clients, serialized once.
+
+        Used by producers that filter per subscriber instead of broadcasting
+        to a whole channel; like stream broadcasts, clients whose queue is
+        full are dropped.
+        """
+        connections = [websocket for websocket in websockets if websocket in self.clients]
+        if not connections:
+            return
+        frame = self._serialize(message)
+        fanout = _Fanout(len(connections), self.fanout_stats)
+        overflowed = []
+        for connection in connections:
+            if not self.clients[connection].enqueue(frame, fanout):
+                fanout.done()
+                overflowed.append(connection)
+        for conn in overflowed:
+            logger.warning(f"Dropping slow WebSocket client (queue full at {self.max_queue})")
+            self.fanout_stats.dropped_clients += 1
             await self.disconnect(conn)
-    
+
     async def send_to_client(self, websocket: WebSocket, message: dict):
         """Send message to specific client"""
-        try:
-            await websocket.send_json(message)
-        except Exception as e:
-            logger.error(f"Error sending message to client: {e}")
+        client = self.clients.get(websocket)
+        if client is None or not client.enqueue(self._serialize(message)):
+            logger.error("Error sending message to client: outbound queue full")
             await self.disconnect(websocket)
-    
+
+    def add_listener(self, channel: str, listener):
+        """Register the producer of a channel.
+
+        listener.subscribed(websocket, options) is awaited on every subscribe
+        and listener.unsubscribed(websocket) is called on unsubscribe and
+        disconnect, so the producer can run only while someone listens.
+        """
+        self.subscriptions.setdefault(channel, set())
+        self.listeners[channel] = listener
+
+    def _notify_unsubscribed(self, channel: str, websocket: WebSocket):
+        listener = self.listeners.get(channel)
+        if listener is not None:
+            try:
+                listener.unsubscribed(websocket)
+            except Exception as e:
+                logger.error(f"Error notifying {channel} listener: {e}")
+
+    def set_channel_policy(self, channel: str, policy: str):
+        """Set a channel's delivery policy ("conflate" or "stream")"""
+        if policy not in (CONFLATE, STREAM):
+            raise ValueError(f"Unknown delivery policy: {policy}")
+        self.channel_policies[channel] = policy
+
     def get_connection_count(self) -> int:
         """Get number of active connections"""
         return len(self.active_connections)
-    
+
     def get_channel_subscribers(self, channel: str) -> int:
         """Get number of subscribers for a channel"""
-        return len(self.subscriptions.get(channel, set()))
\ No newline at end of file
+        return len(self.subscriptions.get(channel, set()))
+
+    def get_stats(self) -> dict:
+        """Get fan-out latency and outbound queue statistics"""
+        depths = [client.depth() for client in self.clients.values()]
+        return {
+            "connections": len(self.active_connections),
+            "channels": {
+                channel: {
+                    "subscribers": len(subscribers),
+                    "policy": self.channel_policies.get(channel, STREAM)
+                }
+                for channel, subscribers in self.subscriptions.items()
+            },
+            "queue_depth": {
+                "total": sum(depths),
+                "max": max(depths) if depths else 0,
+                "limit": self.max_queue
+            },
+            "fanout": self.fanout_stats.summary(),
+            "dropped_clients": self.fanout_stats.dropped_clients,
+            "conflated": self.fanout_stats.conflated
+        }
+
+
+def get_websocket_manager(request: Request) -> WebSocketManager:
+    """Dependency returning the application's WebSocket manager"""
+    return request.app.state.websocket_manager
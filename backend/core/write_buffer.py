@@ -0,0 +1,239 @@
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, Type
+from sqlalchemy.orm import Session
+from .database import LogEntry, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Write-behind buffer that bulk-inserts ORM rows from a background thread.
+
+    Producers enqueue plain column mappings; a writer thread drains them in
+    one transaction per flush, triggered when max_batch rows are pending or
+    flush_interval seconds have passed since the oldest pending row. At most
+    max_pending rows are held in memory: blocking producers wait for the
+    writer, non-blocking ones are refused.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_batch: int = 500,
+        flush_interval: float = 300.0,
+        max_pending: int = 10000,
+        max_retries: int = 3
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._pending: List[Tuple[int, Type, dict]] = []
+        self._oldest_pending: Optional[float] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+        self._flush_requested = False
+        self._enqueued_seq = 0
+        self._handled_seq = 0
+        self._dropped_seq = 0  # newest row given up on after max_retries
+        self.stats: Dict[str, int] = {
+            "flushes": 0,
+            "rows_written": 0,
+            "rows_dropped": 0,
+            "failures": 0
+        }
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is not None:
+            return
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info("Write-behind buffer started")
+
+    def stop(self, timeout: Optional[float] = None):
+        """Flush everything pending and stop the writer thread"""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(
+            f"Write-behind buffer stopped ({self.stats['rows_written']} rows in "
+            f"{self.stats['flushes']} flushes)"
+        )
+
+    def is_running(self) -> bool:
+        """Check if the writer thread is running"""
+        return self._thread is not None and self._thread.is_alive()
+
+    def pending(self) -> int:
+        """Number of rows waiting to be written"""
+        return len(self._pending)
+
+    @property
+    def enqueued_seq(self) -> int:
+        """Sequence number of the newest enqueued row, for flush(since=...)"""
+        return self._enqueued_seq
+
+    def add(self, model: Type, row: dict, block: bool = True, timeout: Optional[float] = None) -> bool:
+        """Enqueue a row; returns False if the buffer is full and block is False or timed out"""
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                if not block or not self._cond.wait_for(
+                    lambda: len(self._pending) < self.max_pending or self._closing, timeout
+                ):
+                    self.stats["rows_dropped"] += 1
+                    return False
+            self._enqueue(model, row)
+            return True
+
+    async def put(self, model: Type, row: dict) -> bool:
+        """Enqueue a row from async code, waiting off the event loop when the buffer is full"""
+        with self._cond:
+            if len(self._pending) < self.max_pending:
+                self._enqueue(model, row)
+                return True
+        return await asyncio.to_thread(self.add, model, row, True)
+
+    def _enqueue(self, model: Type, row: dict):
+        """Append a row (caller holds the lock)"""
+        self._enqueued_seq += 1
+        self._pending.append((self._enqueued_seq, model, row))
+        if self._oldest_pending is None:
+            self._oldest_pending = time.monotonic()
+        if len(self._pending) >= self.max_batch:
+            self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None, since: int = 0) -> bool:
+        """Write everything enqueued so far and wait for it to be committed.
+
+        Returns False on timeout, or if any row enqueued after sequence
+        number since (see enqueued_seq) was dropped instead of committed.
+        """
+        with self._cond:
+            target = self._enqueued_seq
+            if self._handled_seq >= target:
+                return self._dropped_seq <= since
+            if self._thread is None:
+                batch = self._take_batch()
+            else:
+                self._flush_requested = True
+                self._cond.notify_all()
+                if not self._cond.wait_for(lambda: self._handled_seq >= target, timeout):
+                    return False
+                return self._dropped_seq <= since
+        # No writer thread: write synchronously in the caller
+        self._write(batch)
+        return self._dropped_seq <= since
+
+    async def flush_async(self, timeout: Optional[float] = None, since: int = 0) -> bool:
+        """Flush without blocking the event loop"""
+        return await asyncio.to_thread(self.flush, timeout, since)
+
+    def _take_batch(self) -> List[Tuple[int, Type, dict]]:
+        """Detach all pending rows (caller holds the lock)"""
+        batch = self._pending
+        self._pending = []
+        self._oldest_pending = None
+        self._flush_requested = False
+        self._cond.notify_all()
+        return batch
+
+    def _should_flush(self) -> bool:
+        if not self._pending:
+            return self._closing
+        if self._closing or self._flush_requested or len(self._pending) >= self.max_batch:
+            return True
+        return time.monotonic() - self._oldest_pending >= self.flush_interval
+
+    def _run(self):
+        """Writer thread main loop"""
+        while True:
+            with self._cond:
+                while not self._should_flush():
+                    timeout = None
+                    if self._oldest_pending is not None:
+                        timeout = max(0.0, self.flush_interval - (time.monotonic() - self._oldest_pending))
+                    self._cond.wait(timeout)
+                if self._closing and not self._pending:
+                    return
+                batch = self._take_batch()
+            self._write(batch)
+
+    def _write(self, batch: List[Tuple[int, Type, dict]]):
+        """Insert a batch in a single transaction, retrying with backoff"""
+        if not batch:
+            return
+
+        grouped: Dict[Type, List[dict]] = {}
+        for _, model, row in batch:
+            grouped.setdefault(model, []).append(row)
+
+        written = False
+        for attempt in range(1, self.max_retries + 1):
+            db = self.session_factory()
+            try:
+                for model, rows in grouped.items():
+                    db.bulk_insert_mappings(model, rows)
+                db.commit()
+                self.stats["flushes"] += 1
+                self.stats["rows_written"] += len(batch)
+                written = True
+                break
+            except Exception as e:
+                db.rollback()
+                self.stats["failures"] += 1
+                if attempt == self.max_retries:
+                    self.stats["rows_dropped"] += len(batch)
+                    logger.error(f"Dropping {len(batch)} buffered rows after {attempt} attempts: {e}")
+                else:
+                    logger.warning(f"Error flushing {len(batch)} buffered rows (attempt {attempt}): {e}")
+                    time.sleep(min(2 ** attempt, 30))
+            finally:
+                db.close()
+
+        with self._cond:
+            self._handled_seq = max(self._handled_seq, batch[-1][0])
+            if not written:
+                self._dropped_seq = max(self._dropped_seq, batch[-1][0])
+            self._cond.notify_all()
+
+
+class BufferedLogHandler(logging.Handler):
+    """Logging handler that persists records as LogEntry rows through a write-behind buffer"""
+
+    def __init__(self, write_buffer: WriteBehindBuffer, level: int = logging.WARNING):
+        super().__init__(level)
+        self.write_buffer = write_buffer
+
+    def emit(self, record: logging.LogRecord):
+        # Never feed the buffer's own failures back into it
+        if record.name == __name__:
+            return
+        try:
+            self.write_buffer.add(
+                LogEntry,
+                {
+                    "timestamp": datetime.utcfromtimestamp(record.created),
+                    "level": record.levelname,
+                    "source": record.name,
+                    "message": record.getMessage(),
+                    "meta": {
+                        "module": record.module,
+                        "line": record.lineno
+                    }
+                },
+                block=False
+            )
+        except Exception:
+            self.handleError(record)
@@ -6,19 +6,51 @@ import logging
 import sys
 sys.path.insert(0, '/app/backend')
 
+from core.config import get_settings
+from core.commands import CommandRunner
+from core.database import init_db
+from core.journal import JournalReader
+from core.log_ingest import LogIngestor
+from core.log_patterns import PatternMiner
+from core.write_buffer import WriteBehindBuffer
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 async def main():
     """Log aggregator daemon"""
+    settings = get_settings()
+    await init_db()
+
+    write_buffer = WriteBehindBuffer(
+        flush_interval=settings.LOG_INGEST_FLUSH_INTERVAL,
+        max_batch=settings.WRITE_BUFFER_MAX_BATCH,
+        max_pending=settings.WRITE_BUFFER_MAX_PENDING
+    )
+    write_buffer.start()
+    ingestor = LogIngestor(
+        write_buffer,
+        JournalReader(CommandRunner()) if settings.LOG_INGEST_JOURNAL else None,
+        files=[path.strip() for path in settings.LOG_INGEST_FILES.split(",") if path.strip()],
+        state_path=settings.LOG_INGEST_STATE_PATH,
+        backfill_hours=settings.LOG_INGEST_BACKFILL_HOURS,
+        patterns=PatternMiner() if settings.LOG_PATTERNS_ENABLED else None,
+        sample_threshold=settings.LOG_PATTERN_SAMPLE_THRESHOLD,
+        sample_rate=settings.LOG_PATTERN_SAMPLE_RATE
+    )
+    await ingestor.start()
+
     logger.info("Log aggregator started")
-    
+
     try:
         while True:
-            # Log processing logic would go here
             await asyncio.sleep(300)  # 5 minutes
-    except KeyboardInterrupt:
+            logger.info(f"Log ingestion: {ingestor.stats}, buffer: {write_buffer.stats}")
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Log aggregator stopped")
+    finally:
+        await ingestor.stop()
+        await asyncio.to_thread(write_buffer.stop)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -6,6 +6,7 @@ A comprehensive server management tool with Apple-inspired design
 
 import os
 import sys
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import Optional
@@ -18,13 +19,19 @@ from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
 from core.config import Settings, get_settings
-from core.database import init_db, get_db
+from core.database import init_db, close_db
 from core.security import verify_token, create_access_token
 from core.websocket_manager import WebSocketManager
 from core.scheduler import SchedulerManager
 from core.monitoring_service import MonitoringService
 from core.alert_manager import AlertManager
 from core.backup_manager import BackupManager
+from core.commands import CommandRunner
+from core.journal import JournalReader
+from core.log_tailer import LogTailer
+from core.maintenance import database_maintenance, run_database_maintenance
+from core.systemd import ServiceRegistry
+from core.write_buffer import WriteBehindBuffer, BufferedLogHandler
 
 # Import routers
 from routers import (
@@ -63,17 +70,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Global instances
+write_buffer: Optional[WriteBehindBuffer] = None
 websocket_manager: Optional[WebSocketManager] = None
 monitoring_service: Optional[MonitoringService] = None
 alert_manager: Optional[AlertManager] = None
 backup_manager: Optional[BackupManager] = None
 scheduler: Optional[SchedulerManager] = None
+service_registry: Optional[ServiceRegistry] = None
+log_tailer: Optional[LogTailer] = None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager"""
-    global websocket_manager, monitoring_service, alert_manager, backup_manager, scheduler
+    global write_buffer, websocket_manager, monitoring_service, alert_manager, backup_manager, scheduler, service_registry, log_tailer
     
     # Startup
     logger.info("Starting Ubuntu Master Control...")
@@ -81,24 +91,66 @@ async def lifespan(app: FastAPI):
     # Initialize database
     await init_db()
     
+    # Initialize write-behind buffer for metrics, alert history and log entries
+    settings = get_settings()
+    write_buffer = WriteBehindBuffer(
+        max_batch=settings.WRITE_BUFFER_MAX_BATCH,
+        flush_interval=settings.WRITE_BUFFER_FLUSH_INTERVAL,
+        max_pending=settings.WRITE_BUFFER_MAX_PENDING
+    )
+    write_buffer.start()
+    log_handler = BufferedLogHandler(write_buffer)
+    logging.getLogger().addHandler(log_handler)
+    
+    # Initialize the shared runner for systemctl/journalctl/apt/ufw/docker
+    app.state.command_runner = CommandRunner()
+    app.state.journal_reader = JournalReader(app.state.command_runner)
+    
     # Initialize WebSocket manager
     websocket_manager = WebSocketManager()
+    app.state.websocket_manager = websocket_manager
+    
+    # Initialize the systemd unit table, kept current over D-Bus
+    service_registry = ServiceRegistry(websocket_manager=websocket_manager)
+    await service_registry.start()
+    app.state.service_registry = service_registry
+    
+    # Initialize live log tailing, one shared journalctl follower per unit
+    log_tailer = LogTailer(app.state.journal_reader, websocket_manager)
+    await log_tailer.start()
+    app.state.log_tailer = log_tailer
     
     # Initialize monitoring service
-    monitoring_service = MonitoringService(websocket_manager)
+    monitoring_service = MonitoringService(websocket_manager, write_buffer=write_buffer)
     await monitoring_service.start()
+    app.state.monitoring_service = monitoring_service
     
     # Initialize alert manager
-    alert_manager = AlertManager(websocket_manager)
+    alert_manager = AlertManager(
+        websocket_manager,
+        monitoring_service=monitoring_service,
+        write_buffer=write_buffer
+    )
     await alert_manager.start()
+    app.state.alert_manager = alert_manager
     
     # Initialize backup manager
-    backup_manager = BackupManager()
+    backup_manager = BackupManager(websocket_manager=websocket_manager)
+    app.state.backup_manager = backup_manager
     
     # Initialize scheduler
     scheduler = SchedulerManager()
     await scheduler.start()
     
+    # Retention and vacuum for metrics, alert history and logs
+    app.state.database_maintenance = database_maintenance
+    scheduler.add_job(
+        "database_maintenance",
+        run_database_maintenance,
+        "interval",
+        hours=settings.DB_MAINTENANCE_INTERVAL_HOURS
+    )
+    
     logger.info("Ubuntu Master Control started successfully")
     
     yield
@@ -106,12 +158,24 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("Shutting down Ubuntu Master Control...")
     
-    if scheduler:
-        await scheduler.stop()
-    if alert_manager:
-        await alert_manager.stop()
-    if monitoring_service:
-        await monitoring_service.stop()
+    try:
+        if scheduler:
+            await scheduler.stop()
+        if alert_manager:
+            await alert_manager.stop()
+        if monitoring_service:
+            await monitoring_service.stop()
+        if service_registry:
+            await service_registry.stop()
+        if log_tailer:
+            await log_tailer.stop()
+        if backup_manager:
+            await asyncio.to_thread(backup_manager.shutdown)
+    finally:
+        # Always flush buffered rows, even if a service failed to stop
+        logging.getLogger().removeHandler(log_handler)
+        await asyncio.to_thread(write_buffer.stop)
+        await close_db()
     
     logger.info("Ubuntu Master Control shut down successfully")
 
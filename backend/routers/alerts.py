@@ -1,16 +1,23 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from core.security import get_current_user, get_admin_user
+from core.database import get_async_db, Alert
+from core.alert_manager import AlertManager, get_alert_manager
+from core.alert_rules import parse_condition
 from typing import List, Optional
 
 router = APIRouter()
 
 @router.get("/active")
-async def get_active_alerts(current_user = Depends(get_current_user)):
+async def get_active_alerts(
+    current_user = Depends(get_current_user),
+    alert_manager: AlertManager = Depends(get_alert_manager)
+):
     """Get active alerts"""
+    alerts = alert_manager.get_active_alerts()
     return {
-        "alerts": [],
-        "count": 0,
-        "message": "Alert system integration would be here"
+        "alerts": alerts,
+        "count": len(alerts)
     }
 
 @router.get("/history")
@@ -29,16 +36,49 @@ async def create_alert(
     name: str,
     condition: str,
     severity: str = "warning",
-    admin_user = Depends(get_admin_user)
+    description: Optional[str] = None,
+    admin_user = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_async_db),
+    alert_manager: AlertManager = Depends(get_alert_manager)
 ):
     """Create new alert rule"""
+    try:
+        parse_condition(condition)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    alert = Alert(
+        name=name,
+        description=description or name,
+        severity=severity,
+        condition=condition
+    )
+    db.add(alert)
+    await db.commit()
+    alert_manager.invalidate_rules()
+    
     return {
-        "message": f"Alert {name} would be created here",
+        "message": f"Alert {name} created",
+        "id": alert.id,
         "condition": condition,
         "severity": severity
     }
 
 @router.delete("/{alert_id}")
-async def delete_alert(alert_id: int, admin_user = Depends(get_admin_user)):
+async def delete_alert(
+    alert_id: int,
+    admin_user = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_async_db),
+    alert_manager: AlertManager = Depends(get_alert_manager)
+):
     """Delete alert"""
-    return {"message": f"Alert {alert_id} would be deleted"}
\ No newline at end of file
+    if not await alert_manager.delete_alert(db, alert_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Alert {alert_id} not found"
+        )
+    
+    return {"message": f"Alert {alert_id} deleted"}
\ No newline at end of file
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+import asyncio
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from pydantic import BaseModel
 from typing import Optional
 
-from core.database import get_db, User
+from core.database import AsyncSessionLocal, get_async_db, get_read_db, User
 from core.security import (
     verify_password,
     get_password_hash,
@@ -47,12 +49,13 @@ class LoginRequest(BaseModel):
 @router.post("/login", response_model=TokenResponse)
 async def login(
     login_data: LoginRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Authenticate user and return tokens"""
-    user = db.query(User).filter(User.username == login_data.username).first()
+    user = (await db.execute(select(User).where(User.username == login_data.username))).scalar_one_or_none()
     
-    if not user or not verify_password(login_data.password, user.hashed_password):
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not user or not await asyncio.to_thread(verify_password, login_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -74,10 +77,11 @@ async def login(
     )
     refresh_token = create_refresh_token(data={"sub": user.username})
     
-    # Update last login
+    # Update last login; the only write, so the writer is only taken after a successful login
     from datetime import datetime
-    user.last_login = datetime.utcnow()
-    db.commit()
+    async with AsyncSessionLocal() as writer:
+        await writer.execute(update(User).where(User.id == user.id).values(last_login=datetime.utcnow()))
+        await writer.commit()
     
     return {
         "access_token": access_token,
@@ -87,7 +91,7 @@ async def login(
     }
 
 @router.post("/refresh")
-async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
+async def refresh_token(refresh_token: str, db: AsyncSession = Depends(get_read_db)):
     """Refresh access token"""
     from core.security import verify_token
     
@@ -99,7 +103,7 @@ async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
         )
     
     username = payload.get("sub")
-    user = db.query(User).filter(User.username == username).first()
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
     
     if not user or not user.is_active:
         raise HTTPException(
@@ -136,7 +140,7 @@ async def change_password(
     old_password: str,
     new_password: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Change user password"""
     if not verify_password(old_password, current_user.hashed_password):
@@ -145,7 +149,9 @@ async def change_password(
             detail="Incorrect current password"
         )
     
-    current_user.hashed_password = get_password_hash(new_password)
-    db.commit()
+    # current_user comes from a read-only session
+    user = await db.get(User, current_user.id)
+    user.hashed_password = get_password_hash(new_password)
+    await db.commit()
     
     return {"message": "Password changed successfully"}
\ No newline at end of file
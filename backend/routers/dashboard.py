@@ -1,20 +1,19 @@
 from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 import psutil
 import platform
 import socket
 
-from core.database import get_db
 from core.security import get_current_user
-from core.database import User, SystemMetric
+from core.database import User
+from core.monitoring_service import MonitoringService, get_monitoring_service
 
 router = APIRouter()
 
 @router.get("/overview")
 async def get_dashboard_overview(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
 ):
     """Get dashboard overview data"""
     
@@ -30,25 +29,25 @@ async def get_dashboard_overview(
     }
     
     # Current metrics
-    cpu_percent = psutil.cpu_percent(interval=1)
-    memory = psutil.virtual_memory()
-    disk = psutil.disk_usage('/')
-    
-    # Uptime
-    uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
+    metrics = (await monitoring_service.get_snapshot()).metrics
+    cpu = metrics["cpu"]
+    memory = metrics["memory"]
+    disk = metrics["disk"]
     
     # Recent metrics for charts (last hour)
-    one_hour_ago = datetime.utcnow() - timedelta(hours=1)
-    recent_metrics = db.query(SystemMetric).filter(
-        SystemMetric.timestamp >= one_hour_ago
-    ).order_by(SystemMetric.timestamp.asc()).all()
+    now = datetime.utcnow()
+    recent_metrics = monitoring_service.get_metric_history(
+        ["cpu_percent", "memory_percent", "disk_percent"],
+        now - timedelta(hours=1),
+        now
+    )
     
     metrics_history = [
         {
-            "timestamp": m.timestamp.isoformat(),
-            "cpu": m.cpu_percent,
-            "memory": m.memory_percent,
-            "disk": m.disk_percent
+            "timestamp": m["timestamp"],
+            "cpu": m.get("cpu_percent"),
+            "memory": m.get("memory_percent"),
+            "disk": m.get("disk_percent")
         }
         for m in recent_metrics
     ]
@@ -72,23 +71,20 @@ async def get_dashboard_overview(
         "system_info": system_info,
         "current_metrics": {
             "cpu": {
-                "percent": cpu_percent,
-                "cores": psutil.cpu_count()
+                "percent": cpu["percent"],
+                "cores": cpu["count"]
             },
             "memory": {
-                "percent": memory.percent,
-                "used_gb": round(memory.used / (1024**3), 2),
-                "total_gb": round(memory.total / (1024**3), 2)
+                "percent": memory["percent"],
+                "used_gb": round(memory["used"] / 1024, 2),
+                "total_gb": round(memory["total"] / 1024, 2)
             },
             "disk": {
-                "percent": disk.percent,
-                "used_gb": round(disk.used / (1024**3), 2),
-                "total_gb": round(disk.total / (1024**3), 2)
+                "percent": disk["percent"],
+                "used_gb": disk["used"],
+                "total_gb": disk["total"]
             },
-            "uptime": {
-                "seconds": uptime.total_seconds(),
-                "formatted": str(uptime).split('.')[0]
-            }
+            "uptime": metrics["uptime"]
         },
         "metrics_history": metrics_history,
         "active_alerts": active_alerts,
@@ -140,17 +136,18 @@ async def get_quick_actions(current_user: User = Depends(get_current_user)):
 @router.get("/resources")
 async def get_resource_usage(
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
 ):
     """Get detailed resource usage"""
+    metrics = (await monitoring_service.get_snapshot()).metrics
     
     # CPU detailed
-    cpu_freq = psutil.cpu_freq()
-    cpu_stats = psutil.cpu_stats()
+    cpu = metrics["cpu"]
+    cpu_freq = cpu["frequency"]
+    cpu_stats = cpu["stats"]
     
     # Memory detailed
-    memory = psutil.virtual_memory()
-    swap = psutil.swap_memory()
+    memory = metrics["memory"]
     
     # Disk detailed
     disk_partitions = psutil.disk_partitions()
@@ -170,44 +167,44 @@ async def get_resource_usage(
             pass
     
     # Network
-    net_io = psutil.net_io_counters()
+    net_io = metrics["network"]
     net_connections = len(psutil.net_connections())
     
     return {
         "cpu": {
-            "percent": psutil.cpu_percent(interval=1),
-            "count": psutil.cpu_count(),
+            "percent": cpu["percent"],
+            "count": cpu["count"],
             "frequency": {
-                "current": cpu_freq.current if cpu_freq else None,
-                "min": cpu_freq.min if cpu_freq else None,
-                "max": cpu_freq.max if cpu_freq else None
+                "current": cpu_freq["current"],
+                "min": cpu_freq["min"],
+                "max": cpu_freq["max"]
             } if cpu_freq else None,
             "stats": {
-                "ctx_switches": cpu_stats.ctx_switches,
-                "interrupts": cpu_stats.interrupts,
-                "soft_interrupts": cpu_stats.soft_interrupts,
-                "syscalls": cpu_stats.syscalls
+                "ctx_switches": cpu_stats["ctx_switches"],
+                "interrupts": cpu_stats["interrupts"],
+                "soft_interrupts": cpu_stats["soft_interrupts"],
+                "syscalls": cpu_stats["syscalls"]
             } if cpu_stats else None
         },
         "memory": {
             "virtual": {
-                "percent": memory.percent,
-                "used_gb": round(memory.used / (1024**3), 2),
-                "total_gb": round(memory.total / (1024**3), 2),
-                "available_gb": round(memory.available / (1024**3), 2)
+                "percent": memory["percent"],
+                "used_gb": round(memory["used"] / 1024, 2),
+                "total_gb": round(memory["total"] / 1024, 2),
+                "available_gb": round(memory["available"] / 1024, 2)
             },
             "swap": {
-                "percent": swap.percent,
-                "used_gb": round(swap.used / (1024**3), 2),
-                "total_gb": round(swap.total / (1024**3), 2)
+                "percent": memory["swap_percent"],
+                "used_gb": round(memory["swap_used"] / 1024, 2),
+                "total_gb": round(memory["swap_total"] / 1024, 2)
             }
         },
         "disks": disks,
         "network": {
-            "bytes_sent": net_io.bytes_sent,
-            "bytes_recv": net_io.bytes_recv,
-            "packets_sent": net_io.packets_sent,
-            "packets_recv": net_io.packets_recv,
+            "bytes_sent": net_io["sent"],
+            "bytes_recv": net_io["recv"],
+            "packets_sent": net_io["packets_sent"],
+            "packets_recv": net_io["packets_recv"],
             "connections": net_connections
         }
     }
\ No newline at end of file
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Depends
 from core.security import get_current_user, get_admin_user
+from core.maintenance import DatabaseMaintenance, get_database_maintenance
 
 router = APIRouter()
 
@@ -14,4 +15,23 @@ async def get_database_status(current_user = Depends(get_current_user)):
 @router.get("/connections")
 async def get_database_connections(current_user = Depends(get_current_user)):
     """Get active database connections"""
-    return {"connections": []}
\ No newline at end of file
+    return {"connections": []}
+
+@router.get("/maintenance")
+async def get_maintenance_report(
+    current_user = Depends(get_current_user),
+    maintenance: DatabaseMaintenance = Depends(get_database_maintenance)
+):
+    """Last retention and vacuum run of this worker: rows deleted and space reclaimed"""
+    return {"report": maintenance.last_report}
+
+@router.post("/maintenance")
+async def run_maintenance(
+    admin_user = Depends(get_admin_user),
+    maintenance: DatabaseMaintenance = Depends(get_database_maintenance)
+):
+    """Enforce retention and reclaim space now"""
+    report = await maintenance.run(force=True)
+    if report is None:
+        return {"message": "Database maintenance is already running", "report": None}
+    return {"message": "Database maintenance completed", "report": report}
\ No newline at end of file
@@ -1,44 +1,40 @@
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, Depends, Request
+from core.commands import CommandRunner, CommandError, get_command_runner
 from core.security import get_current_user, get_admin_user
 
 router = APIRouter()
 
 @router.get("/status")
-async def get_docker_status(current_user = Depends(get_current_user)):
+async def get_docker_status(
+    request: Request,
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Get Docker status"""
-    import subprocess
-    
     try:
-        result = subprocess.run(
-            ['docker', 'info', '--format', '{{json .}}'],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode == 0:
-            import json
-            return json.loads(result.stdout)
-        else:
-            return {"error": "Docker not accessible", "running": False}
-    except:
+        result = await runner.run(['docker', 'info', '--format', '{{json .}}'], request=request, shared=True)
+    except CommandError:
         return {"error": "Docker not installed", "running": False}
+    
+    if result.returncode == 0:
+        return json.loads(result.stdout)
+    else:
+        return {"error": "Docker not accessible", "running": False}
 
 @router.get("/containers")
-async def list_containers(current_user = Depends(get_current_user)):
+async def list_containers(
+    request: Request,
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """List Docker containers"""
-    import subprocess
-    
     try:
-        result = subprocess.run(
-            ['docker', 'ps', '-a', '--format', '{{json .}}'],
-            capture_output=True,
-            text=True
-        )
+        result = await runner.run(['docker', 'ps', '-a', '--format', '{{json .}}'], request=request, shared=True)
         
         containers = []
         for line in result.stdout.strip().split('\n'):
             if line:
-                import json
                 containers.append(json.loads(line))
         
         return {"containers": containers, "count": len(containers)}
@@ -1,19 +1,18 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from core.commands import CommandRunner, get_command_runner
 from core.security import get_current_user, get_admin_user
 
 router = APIRouter()
 
 @router.get("/status")
-async def get_firewall_status(current_user = Depends(get_current_user)):
+async def get_firewall_status(
+    request: Request,
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Get firewall status"""
-    import subprocess
-    
     try:
-        result = subprocess.run(
-            ['ufw', 'status', 'verbose'],
-            capture_output=True,
-            text=True
-        )
+        result = await runner.run(['ufw', 'status', 'verbose'], request=request, shared=True)
         
         return {
             "status": result.stdout if result.returncode == 0 else "inactive",
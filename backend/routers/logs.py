@@ -1,41 +1,146 @@
-from fastapi import APIRouter, Depends
+import json
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from core.commands import CommandError
+from core.database import get_read_db
+from core.journal import JournalReader, format_entry, get_journal_reader, parse_priority
+from core.log_tailer import LogTailer, get_log_tailer
+from core.log_patterns import top_patterns
+from core.log_store import levels_at_least, search_logs
 from core.security import get_current_user
 from typing import List, Optional
 
 router = APIRouter()
 
+# Entries per chunk written to a streaming response
+STREAM_BATCH = 500
+
+
+def _filters(
+    service: Optional[str] = None,
+    priority: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    grep: Optional[str] = None,
+    cursor: Optional[str] = None,
+    direction: str = "older"
+) -> dict:
+    """Query parameters shared by the log endpoints, as JournalReader filters"""
+    if direction not in ("older", "newer"):
+        raise HTTPException(status_code=400, detail="direction must be 'older' or 'newer'")
+    try:
+        parse_priority(priority)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid priority: {priority}")
+    return {
+        "unit": service,
+        "priority": priority,
+        "since": since,
+        "until": until,
+        "grep": grep,
+        "cursor": cursor,
+        "reverse": direction == "older"
+    }
+
 @router.get("/list")
 async def get_logs(
     current_user = Depends(get_current_user),
-    service: Optional[str] = None,
-    lines: int = 100
+    lines: int = 100,
+    filters: dict = Depends(_filters),
+    reader: JournalReader = Depends(get_journal_reader)
+):
+    """Get one page of system logs; pass next_cursor back as cursor for the following page"""
+    try:
+        page = await reader.page(lines, **filters)
+    except CommandError as e:
+        return {"logs": [], "entries": [], "next_cursor": None, "has_more": False, "error": str(e)}
+    return {
+        "logs": [format_entry(entry) for entry in page["entries"]],
+        **page,
+        "service": filters["unit"],
+        "lines": lines
+    }
+
+@router.get("/stream")
+async def stream_logs(
+    request: Request,
+    current_user = Depends(get_current_user),
+    lines: Optional[int] = None,
+    filters: dict = Depends(_filters),
+    reader: JournalReader = Depends(get_journal_reader)
+):
+    """Stream matching entries as newline-delimited JSON, without a page size limit"""
+
+    async def body():
+        chunk: List[str] = []
+        # Its own family: a slow client must not hold a slot of the one-shot journalctl reads
+        async with aclosing(reader.entries(lines, family="journal_export", **filters)) as entries:
+            try:
+                async for entry in entries:
+                    chunk.append(json.dumps(entry))
+                    if len(chunk) >= STREAM_BATCH:
+                        yield "\n".join(chunk) + "\n"
+                        chunk = []
+                        if await request.is_disconnected():
+                            return
+            except CommandError as e:
+                chunk.append(json.dumps({"error": str(e)}))
+        if chunk:
+            yield "\n".join(chunk) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+@router.get("/search")
+async def search_stored_logs(
+    current_user = Depends(get_current_user),
+    q: Optional[str] = None,
+    level: Optional[str] = None,
+    source: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Get system logs"""
-    import subprocess
-    
+    """Search ingested logs by words, minimum level, source and time range, newest first"""
     try:
-        if service:
-            result = subprocess.run(
-                ['journalctl', '-u', service, '-n', str(lines), '--no-pager'],
-                capture_output=True,
-                text=True
-            )
-        else:
-            result = subprocess.run(
-                ['journalctl', '-n', str(lines), '--no-pager'],
-                capture_output=True,
-                text=True
-            )
-        
-        return {
-            "logs": result.stdout.strip().split('\n') if result.returncode == 0 else [],
-            "service": service,
-            "lines": lines
-        }
-    except Exception as e:
-        return {"logs": [], "error": str(e)}
+        return await db.run_sync(
+            search_logs, q, level=level, source=source, since=since, until=until, cursor=cursor, limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/patterns")
+async def get_top_patterns(
+    current_user = Depends(get_current_user),
+    minutes: int = 60,
+    level: Optional[str] = None,
+    source: Optional[str] = None,
+    limit: int = 20,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Most frequent message patterns in the last minutes, e.g. top error patterns of the last hour"""
+    try:
+        levels = levels_at_least(level) if level else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    patterns = await db.run_sync(
+        top_patterns, datetime.utcnow() - timedelta(minutes=minutes), levels, source, max(1, min(limit, 100))
+    )
+    return {"patterns": patterns, "minutes": minutes, "level": level}
+
+@router.get("/tail")
+async def get_tail_stats(
+    current_user = Depends(get_current_user),
+    tailer: LogTailer = Depends(get_log_tailer)
+):
+    """Live followers behind the logs WebSocket channel, with their sampling state"""
+    return tailer.get_stats()
 
 @router.get("/services")
 async def get_log_services(current_user = Depends(get_current_user)):
     """Get list of services with logs"""
-    return {"services": []}
\ No newline at end of file
+    return {"services": []}
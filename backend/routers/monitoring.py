@@ -1,5 +1,9 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from core.commands import CommandRunner, get_command_runner
 from core.security import get_current_user
+from core.monitoring_service import MonitoringService, RESOURCE_KINDS, get_monitoring_service
+from core.websocket_manager import WebSocketManager, get_websocket_manager
+from datetime import datetime, timezone
 from typing import Optional
 
 router = APIRouter()
@@ -7,37 +11,152 @@ router = APIRouter()
 @router.get("/metrics")
 async def get_monitoring_metrics(
     current_user = Depends(get_current_user),
-    interval: str = "5m"
+    interval: str = "5m",
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
 ):
     """Get monitoring metrics"""
-    import psutil
-    from datetime import datetime
+    snapshot = await monitoring_service.get_snapshot()
+    cpu = snapshot.metrics["cpu"]
+    memory = snapshot.metrics["memory"]
+    disk = snapshot.metrics["disk"]
+    network = snapshot.metrics["network"]
+    load_avg = snapshot.metrics["load_avg"]
     
     return {
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": snapshot.timestamp.isoformat(),
         "cpu": {
-            "percent": psutil.cpu_percent(interval=1),
-            "count": psutil.cpu_count(),
-            "per_cpu": psutil.cpu_percent(interval=1, percpu=True)
+            "percent": cpu["percent"],
+            "count": cpu["count"],
+            "per_cpu": cpu["per_cpu"]
         },
         "memory": {
-            "virtual": psutil.virtual_memory()._asdict(),
-            "swap": psutil.swap_memory()._asdict()
+            "virtual": {
+                "percent": memory["percent"],
+                "used_gb": round(memory["used"] / 1024, 2),
+                "total_gb": round(memory["total"] / 1024, 2),
+                "available_gb": round(memory["available"] / 1024, 2)
+            },
+            "swap": {
+                "percent": memory["swap_percent"],
+                "used_gb": round(memory["swap_used"] / 1024, 2),
+                "total_gb": round(memory["swap_total"] / 1024, 2)
+            }
         },
-        "disk": psutil.disk_usage('/')._asdict(),
-        "network": psutil.net_io_counters()._asdict(),
-        "load_avg": psutil.getloadavg()
+        "disk": {
+            "percent": disk["percent"],
+            "used_gb": disk["used"],
+            "total_gb": disk["total"],
+            "free_gb": disk["free"]
+        },
+        "network": {
+            "bytes_sent": network["sent"],
+            "bytes_recv": network["recv"],
+            "packets_sent": network["packets_sent"],
+            "packets_recv": network["packets_recv"],
+            "errin": network["errin"],
+            "errout": network["errout"],
+            "dropin": network["dropin"],
+            "dropout": network["dropout"]
+        },
+        "load_avg": (load_avg["1min"], load_avg["5min"], load_avg["15min"])
     }
 
 @router.get("/history")
 async def get_metrics_history(
     current_user = Depends(get_current_user),
-    hours: int = 24
+    hours: int = 24,
+    interval: str = "5m",
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
 ):
     """Get historical metrics"""
-    # This would fetch from database in production
+    from datetime import datetime, timedelta
+    
+    data = await monitoring_service.get_historical_metrics(
+        start_time=datetime.utcnow() - timedelta(hours=hours),
+        interval=interval
+    )
+    return {
+        "hours": hours,
+        "interval": interval,
+        "data": data
+    }
+
+@router.get("/websocket")
+async def get_websocket_stats(
+    current_user = Depends(get_current_user),
+    websocket_manager: WebSocketManager = Depends(get_websocket_manager)
+):
+    """Get WebSocket fan-out latency and queue depth statistics"""
+    return websocket_manager.get_stats()
+
+@router.get("/commands")
+async def get_command_stats(
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
+    """Get timing and concurrency statistics of external commands per family"""
+    return runner.get_stats()
+
+
+@router.get("/resources/top")
+async def get_top_resources(
+    current_user = Depends(get_current_user),
+    kind: str = "unit",
+    field: str = "memory_bytes",
+    at: Optional[datetime] = None,
+    window_minutes: int = 15,
+    limit: int = 10,
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
+):
+    """Get the services or processes that used the most of a resource around a point in time"""
+    from datetime import timedelta
+    
+    if field not in RESOURCE_KINDS.get(kind, []):
+        raise HTTPException(status_code=400, detail=f"Invalid kind or field. Valid: {RESOURCE_KINDS}")
+    if monitoring_service.resources is None:
+        raise HTTPException(status_code=404, detail="Resource history is disabled")
+    
+    if at is None:
+        center = datetime.utcnow()
+    elif at.tzinfo is not None:
+        # History is kept in naive UTC
+        center = at.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        center = at
+    window = timedelta(minutes=window_minutes)
     return {
+        "kind": kind,
+        "field": field,
+        "start": (center - window / 2).isoformat(),
+        "end": (center + window / 2).isoformat(),
+        "top": monitoring_service.top_resources(kind, field, center - window / 2, center + window / 2, limit)
+    }
+
+@router.get("/resources/{kind}/{name}")
+async def get_resource_history(
+    kind: str,
+    name: str,
+    current_user = Depends(get_current_user),
+    hours: int = 24,
+    interval: str = "5m",
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
+):
+    """Get CPU, memory and IO history of one service unit or process name"""
+    from datetime import datetime, timedelta
+    from core.monitoring_service import HISTORY_INTERVALS
+    
+    if kind not in RESOURCE_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid kind. Valid kinds: {', '.join(RESOURCE_KINDS)}")
+    if monitoring_service.resources is None:
+        raise HTTPException(status_code=404, detail="Resource history is disabled")
+    
+    end = datetime.utcnow()
+    return {
+        "kind": kind,
+        "name": name,
         "hours": hours,
-        "data": [],
-        "message": "Historical metrics would be fetched from database"
-    }
\ No newline at end of file
+        "interval": interval,
+        "data": monitoring_service.get_resource_history(
+            kind, name, end - timedelta(hours=hours), end, step=HISTORY_INTERVALS.get(interval, 300)
+        )
+    }
@@ -1,19 +1,22 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from core.commands import CommandRunner, get_command_runner
 from core.security import get_current_user, get_admin_user
 from typing import List
 
 router = APIRouter()
 
 @router.get("/list")
-async def list_packages(current_user = Depends(get_current_user)):
+async def list_packages(
+    request: Request,
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """List installed packages"""
-    import subprocess
-    
     try:
-        result = subprocess.run(
+        result = await runner.run(
             ['dpkg-query', '-W', '-f=${Package}\t${Version}\n'],
-            capture_output=True,
-            text=True
+            request=request,
+            shared=True
         )
         
         packages = []
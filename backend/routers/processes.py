@@ -1,5 +1,7 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from core.security import get_current_user
+from core.monitoring_service import MonitoringService, get_monitoring_service
+from core.process_tracker import SORT_KEYS
 import psutil
 
 router = APIRouter()
@@ -8,40 +10,31 @@ router = APIRouter()
 async def list_processes(
     current_user = Depends(get_current_user),
     sort_by: str = "memory",
-    limit: int = 50
+    limit: int = 50,
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
 ):
     """List running processes"""
-    processes = []
+    if sort_by not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort_by. Valid keys: {', '.join(SORT_KEYS)}")
     
-    for proc in psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_percent', 'status', 'create_time']):
-        try:
-            pinfo = proc.info
-            processes.append({
-                "pid": pinfo['pid'],
-                "name": pinfo['name'],
-                "username": pinfo['username'],
-                "cpu_percent": pinfo['cpu_percent'],
-                "memory_percent": pinfo['memory_percent'],
-                "status": pinfo['status'],
-                "created": pinfo['create_time']
-            })
-        except:
-            pass
-    
-    # Sort by specified field
-    if sort_by in ['cpu_percent', 'memory_percent', 'pid']:
-        processes.sort(key=lambda x: x.get(sort_by, 0), reverse=True)
+    table = await monitoring_service.get_process_table()
     
     return {
-        "processes": processes[:limit],
-        "total": len(processes)
+        "processes": monitoring_service.processes.top(table, sort_by, limit),
+        "total": len(table.rows)
     }
 
 @router.get("/{pid}")
-async def get_process_info(pid: int, current_user = Depends(get_current_user)):
+async def get_process_info(
+    pid: int,
+    current_user = Depends(get_current_user),
+    monitoring_service: MonitoringService = Depends(get_monitoring_service)
+):
     """Get detailed process information"""
     try:
         proc = psutil.Process(pid)
+        # CPU usage since the last table refresh, instead of sampling on the event loop
+        row = monitoring_service.processes.get(pid)
         
         return {
             "pid": pid,
@@ -51,7 +44,7 @@ async def get_process_info(pid: int, current_user = Depends(get_current_user)):
             "cmdline": proc.cmdline(),
             "status": proc.status(),
             "username": proc.username(),
-            "cpu_percent": proc.cpu_percent(interval=0.1),
+            "cpu_percent": row["cpu_percent"] if row and row["created"] == proc.create_time() else None,
             "memory_info": proc.memory_info()._asdict(),
             "memory_percent": proc.memory_percent(),
             "create_time": proc.create_time(),
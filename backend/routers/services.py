@@ -1,27 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-import subprocess
+from fastapi import APIRouter, Depends, HTTPException, Request
 import psutil
 from typing import List, Optional
 from pydantic import BaseModel
 
-from core.database import get_db, User
+from datetime import datetime, timedelta
+from core.commands import CommandError, CommandRunner, CommandTimeout, get_command_runner
+from core.journal import JournalReader, format_entry, get_journal_reader
+from core.monitoring_service import MonitoringService, get_monitoring_service
+from core.database import User
 from core.security import get_current_user, get_admin_user
+from core.systemd import ServiceRegistry, get_service_registry
 
 router = APIRouter()
 
+# systemd reports unset numeric properties as the maximum uint64
+UINT64_UNSET = 2 ** 64 - 1
+
 class ServiceAction(BaseModel):
     action: str  # start, stop, restart, enable, disable
 
 @router.get("/list")
-async def list_services(current_user: User = Depends(get_current_user)):
+async def list_services(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner),
+    registry: ServiceRegistry = Depends(get_service_registry)
+):
     """List all system services"""
+    if registry.available:
+        services = registry.list_services()
+        return {"services": services, "count": len(services)}
+    
     try:
         # Get all systemd services
-        result = subprocess.run(
+        result = await runner.run(
             ['systemctl', 'list-units', '--type=service', '--all', '--no-pager', '--no-legend'],
-            capture_output=True,
-            text=True
+            request=request,
+            shared=True
         )
         
         services = []
@@ -50,33 +65,46 @@ async def list_services(current_user: User = Depends(get_current_user)):
 @router.get("/{service_name}")
 async def get_service_info(
     service_name: str,
-    current_user: User = Depends(get_current_user)
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    history_hours: int = 6,
+    runner: CommandRunner = Depends(get_command_runner),
+    registry: ServiceRegistry = Depends(get_service_registry),
+    monitoring_service: MonitoringService = Depends(get_monitoring_service),
+    reader: JournalReader = Depends(get_journal_reader)
 ):
     """Get detailed information about a service"""
     try:
-        # Check if service exists
-        result = subprocess.run(
-            ['systemctl', 'show', service_name, '--property=Id,Description,LoadState,ActiveState,SubState,UnitFileState,MainPID,MemoryCurrent,CPUUsageNSec'],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            raise HTTPException(status_code=404, detail=f"Service {service_name} not found")
-        
-        # Parse properties
-        properties = {}
-        for line in result.stdout.strip().split('\n'):
-            if '=' in line:
-                key, value = line.split('=', 1)
-                properties[key] = value
+        if registry.available:
+            properties = await registry.get_properties(service_name)
+            if properties is None:
+                raise HTTPException(status_code=404, detail=f"Service {service_name} not found")
+            properties = {
+                key: "[not set]" if value == UINT64_UNSET else str(value)
+                for key, value in properties.items()
+            }
+        else:
+            # Check if service exists
+            result = await runner.run(
+                ['systemctl', 'show', service_name, '--property=Id,Description,LoadState,ActiveState,SubState,UnitFileState,MainPID,MemoryCurrent,CPUUsageNSec'],
+                request=request
+            )
+            
+            if result.returncode != 0:
+                raise HTTPException(status_code=404, detail=f"Service {service_name} not found")
+            
+            # Parse properties
+            properties = {}
+            for line in result.stdout.strip().split('\n'):
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    properties[key] = value
         
-        # Get service logs (last 10 lines)
-        logs_result = subprocess.run(
-            ['journalctl', '-u', service_name, '-n', '10', '--no-pager'],
-            capture_output=True,
-            text=True
-        )
+        # Get service logs (last 10 lines, oldest first)
+        try:
+            recent = [format_entry(entry) async for entry in reader.entries(10, unit=service_name)][::-1]
+        except CommandError:
+            recent = []
         
         return {
             "name": service_name,
@@ -88,10 +116,20 @@ async def get_service_info(
             "main_pid": properties.get('MainPID', '0'),
             "memory_current": properties.get('MemoryCurrent', '0'),
             "cpu_usage": properties.get('CPUUsageNSec', '0'),
-            "recent_logs": logs_result.stdout.strip().split('\n') if logs_result.returncode == 0 else []
+            "recent_logs": recent,
+            # CPU/memory/IO trend from cgroup accounting, empty unless resource history is enabled
+            "resource_history": monitoring_service.get_resource_history(
+                "unit",
+                properties.get('Id') or (service_name if '.' in service_name else f"{service_name}.service"),
+                datetime.utcnow() - timedelta(hours=history_hours),
+                datetime.utcnow(),
+                max_points=120
+            )
         }
     except HTTPException:
         raise
+    except CommandTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get service info: {e}")
 
@@ -99,7 +137,8 @@ async def get_service_info(
 async def service_action(
     service_name: str,
     action: str,
-    current_user: User = Depends(get_admin_user)
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
 ):
     """Perform action on a service (start, stop, restart, enable, disable)"""
     valid_actions = ['start', 'stop', 'restart', 'reload', 'enable', 'disable', 'status']
@@ -108,11 +147,8 @@ async def service_action(
         raise HTTPException(status_code=400, detail=f"Invalid action. Valid actions: {', '.join(valid_actions)}")
     
     try:
-        result = subprocess.run(
-            ['systemctl', action, service_name],
-            capture_output=True,
-            text=True
-        )
+        # Not tied to the request: a state change runs to completion even if the client leaves
+        result = await runner.run(['systemctl', action, service_name])
         
         if result.returncode == 0:
             return {
@@ -128,33 +164,31 @@ async def service_action(
             )
     except HTTPException:
         raise
+    except CommandTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to {action} service: {e}")
 
 @router.get("/{service_name}/logs")
 async def get_service_logs(
     service_name: str,
+    request: Request,
     lines: int = 100,
     since: Optional[str] = None,
-    current_user: User = Depends(get_current_user)
+    cursor: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    reader: JournalReader = Depends(get_journal_reader)
 ):
-    """Get service logs"""
+    """Get one page of service logs, newest first; pass next_cursor back as cursor for older lines"""
     try:
-        cmd = ['journalctl', '-u', service_name, '-n', str(lines), '--no-pager']
-        if since:
-            cmd.extend(['--since', since])
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            return {
-                "service": service_name,
-                "logs": result.stdout.strip().split('\n'),
-                "lines": lines
-            }
-        else:
-            raise HTTPException(status_code=400, detail=f"Failed to get logs: {result.stderr}")
-    except HTTPException:
-        raise
+        page = await reader.page(lines, unit=service_name, since=since, cursor=cursor)
+        return {
+            "service": service_name,
+            "logs": [format_entry(entry) for entry in page["entries"]],
+            **page,
+            "lines": lines
+        }
+    except CommandTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get service logs: {e}")
\ No newline at end of file
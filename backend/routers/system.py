@@ -1,17 +1,27 @@
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-import subprocess
+import asyncio
 import psutil
 import os
 from datetime import datetime
 
-from core.database import get_db, User
+from core.commands import CommandRunner, CommandError, get_command_runner
+from core.database import User
 from core.security import get_current_user, get_admin_user
 
 router = APIRouter()
 
+async def _get_timezone(runner: CommandRunner) -> str:
+    try:
+        result = await runner.run(['timedatectl', 'show', '--property=Timezone', '--value'], shared=True)
+    except CommandError:
+        return "Unknown"
+    return result.stdout.strip() if result.returncode == 0 else "Unknown"
+
 @router.get("/info")
-async def get_system_info(current_user: User = Depends(get_current_user)):
+async def get_system_info(
+    current_user: User = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Get detailed system information"""
     import platform
     import socket
@@ -34,11 +44,7 @@ async def get_system_info(current_user: User = Depends(get_current_user)):
     uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
     
     # Get timezone
-    try:
-        timezone = subprocess.check_output(['timedatectl', 'show', '--property=Timezone', '--value'], 
-                                         text=True).strip()
-    except:
-        timezone = "Unknown"
+    timezone = await _get_timezone(runner)
     
     return {
         "hostname": socket.gethostname(),
@@ -65,13 +71,13 @@ async def get_system_info(current_user: User = Depends(get_current_user)):
 @router.post("/restart")
 async def restart_system(
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_admin_user)
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
 ):
     """Restart the system"""
-    def do_restart():
-        import time
-        time.sleep(2)
-        subprocess.run(['systemctl', 'reboot'])
+    async def do_restart():
+        await asyncio.sleep(2)
+        await runner.run(['systemctl', 'reboot'])
     
     background_tasks.add_task(do_restart)
     return {"message": "System restart initiated", "warning": "System will restart in 2 seconds"}
@@ -79,13 +85,13 @@ async def restart_system(
 @router.post("/shutdown")
 async def shutdown_system(
     background_tasks: BackgroundTasks,
-    current_user: User = Depends(get_admin_user)
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
 ):
     """Shutdown the system"""
-    def do_shutdown():
-        import time
-        time.sleep(2)
-        subprocess.run(['systemctl', 'poweroff'])
+    async def do_shutdown():
+        await asyncio.sleep(2)
+        await runner.run(['systemctl', 'poweroff'])
     
     background_tasks.add_task(do_shutdown)
     return {"message": "System shutdown initiated", "warning": "System will shutdown in 2 seconds"}
@@ -99,36 +105,30 @@ async def get_hostname(current_user: User = Depends(get_current_user)):
 @router.put("/hostname")
 async def set_hostname(
     hostname: str,
-    current_user: User = Depends(get_admin_user)
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
 ):
     """Set system hostname"""
-    try:
-        subprocess.run(['hostnamectl', 'set-hostname', hostname], check=True)
-        return {"message": f"Hostname changed to {hostname}", "hostname": hostname}
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=400, detail=f"Failed to set hostname: {e}")
+    await runner.check(['hostnamectl', 'set-hostname', hostname], "Failed to set hostname")
+    return {"message": f"Hostname changed to {hostname}", "hostname": hostname}
 
 @router.get("/timezone")
-async def get_timezone(current_user: User = Depends(get_current_user)):
+async def get_timezone(
+    current_user: User = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Get system timezone"""
-    try:
-        result = subprocess.check_output(['timedatectl', 'show', '--property=Timezone', '--value'], 
-                                       text=True).strip()
-        return {"timezone": result}
-    except:
-        return {"timezone": "Unknown"}
+    return {"timezone": await _get_timezone(runner)}
 
 @router.put("/timezone")
 async def set_timezone(
     timezone: str,
-    current_user: User = Depends(get_admin_user)
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
 ):
     """Set system timezone"""
-    try:
-        subprocess.run(['timedatectl', 'set-timezone', timezone], check=True)
-        return {"message": f"Timezone changed to {timezone}", "timezone": timezone}
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=400, detail=f"Failed to set timezone: {e}")
+    await runner.check(['timedatectl', 'set-timezone', timezone], "Failed to set timezone")
+    return {"message": f"Timezone changed to {timezone}", "timezone": timezone}
 
 @router.get("/time")
 async def get_system_time(current_user: User = Depends(get_current_user)):
@@ -140,11 +140,14 @@ async def get_system_time(current_user: User = Depends(get_current_user)):
     }
 
 @router.post("/clear-cache")
-async def clear_system_cache(current_user: User = Depends(get_admin_user)):
+async def clear_system_cache(
+    current_user: User = Depends(get_admin_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Clear system cache"""
+    await runner.check(['sync'], "Failed to clear cache", status_code=500)
     try:
         # Clear page cache, dentries and inodes
-        subprocess.run(['sync'], check=True)
         with open('/proc/sys/vm/drop_caches', 'w') as f:
             f.write('3')
         return {"message": "System cache cleared successfully"}
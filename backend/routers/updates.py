@@ -1,22 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from core.commands import CommandRunner, CommandTimeout, get_command_runner
 from core.security import get_current_user, get_admin_user
-import subprocess
 
 router = APIRouter()
 
 @router.get("/updates")
-async def check_updates(current_user = Depends(get_current_user)):
+async def check_updates(
+    request: Request,
+    current_user = Depends(get_current_user),
+    runner: CommandRunner = Depends(get_command_runner)
+):
     """Check for available system updates"""
     try:
-        # Update package list
-        subprocess.run(['apt-get', 'update'], capture_output=True)
+        # Update package list; concurrent checks share one apt-get update
+        await runner.run(['apt-get', 'update'], timeout=600, request=request, shared=True)
         
         # Check for upgrades
-        result = subprocess.run(
-            ['apt-get', '-s', 'upgrade'],
-            capture_output=True,
-            text=True
-        )
+        result = await runner.run(['apt-get', '-s', 'upgrade'], request=request, shared=True)
         
         # Parse output to count packages
         lines = result.stdout.split('\n')
@@ -36,6 +36,8 @@ async def check_updates(current_user = Depends(get_current_user)):
             "packages": packages[:50],  # Limit to 50
             "has_updates": len(packages) > 0
         }
+    except CommandTimeout as e:
+        raise HTTPException(status_code=504, detail=f"Failed to check updates: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to check updates: {e}")
 
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Ubuntu Master Control - Query Plan Check
+Runs EXPLAIN QUERY PLAN over the hot database queries and fails if any
+of them falls back to a full table scan. Checks a scratch database built
+from the models, or the SQLite database given as argument.
+
+    python3 backend/scripts/check_query_plans.py [path/to/umc.db]
+"""
+
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from sqlalchemy import create_engine, func, literal_column, select
+from core.database import (
+    Alert, AlertHistory, Backup, LogEntry, LogPatternCount, NotificationQueue, User, sync_schema
+)
+
+# "SCAN alerts" ("SCAN TABLE alerts" before SQLite 3.36) reads every row,
+# and so does "SCAN alerts USING INDEX ix" for a query with a WHERE clause,
+# unless the index is partial; "SEARCH ..." reads a range
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?$")
+
+def hot_queries() -> dict:
+    """Statements mirroring the queries run on every request, check or poll"""
+    since = datetime.utcnow() - timedelta(hours=1)
+    return {
+        "current user": select(User).where(User.username == "admin"),
+        "active alert rules": select(Alert).where(Alert.is_active == True),
+        "open alert history": select(AlertHistory).where(
+            AlertHistory.alert_id == 1,
+            AlertHistory.resolved_at.is_(None)
+        ).order_by(AlertHistory.triggered_at.desc()).limit(1),
+        "latest backup of a name": select(Backup).where(
+            Backup.name == "etc"
+        ).order_by(Backup.created_at.desc()).limit(1),
+        "incremental base": select(Backup).where(
+            Backup.name == "etc",
+            Backup.type == "incremental",
+            Backup.source_path == "/etc",
+            Backup.status == "completed",
+            Backup.archive_path.isnot(None)
+        ).order_by(Backup.created_at.desc()).limit(1),
+        "backup listing": select(Backup).order_by(Backup.created_at.desc()),
+        "due notifications": select(NotificationQueue).where(
+            NotificationQueue.next_attempt_at <= datetime.utcnow()
+        ).order_by(NotificationQueue.next_attempt_at).limit(100),
+        "logs by level": select(LogEntry).where(
+            LogEntry.level.in_(["ERROR", "CRITICAL"]),
+            LogEntry.timestamp >= since
+        ).order_by(LogEntry.timestamp.desc(), LogEntry.id.desc()).limit(101),
+        "logs by source": select(LogEntry).where(
+            LogEntry.source == "nginx.service",
+            LogEntry.timestamp >= since
+        ).order_by(LogEntry.timestamp.desc(), LogEntry.id.desc()).limit(101),
+        "logs by time": select(LogEntry).where(
+            LogEntry.timestamp >= since
+        ).order_by(LogEntry.timestamp.desc(), LogEntry.id.desc()).limit(101),
+        "top patterns": select(
+            LogPatternCount.pattern_id, func.sum(LogPatternCount.count)
+        ).where(
+            LogPatternCount.minute >= since,
+            LogPatternCount.level.in_(["ERROR", "CRITICAL"])
+        ).group_by(literal_column("+log_pattern_counts.pattern_id")),
+    }
+
+def check_query_plans(engine) -> list:
+    """(query name, plan lines, fully scanned tables) of every hot query"""
+    results = []
+    with engine.connect() as conn:
+        partial = {
+            name for name, in conn.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'"
+            )
+        }
+        for name, statement in hot_queries().items():
+            sql = str(statement.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True}))
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+            scans = []
+            for match in map(SCAN.match, plan):
+                if match is None:
+                    continue
+                table, index = match.groups()
+                if index is None or (statement.whereclause is not None and index not in partial):
+                    scans.append(table)
+            results.append((name, plan, scans))
+    return results
+
+def main() -> int:
+    if len(sys.argv) > 1:
+        engine = create_engine(f"sqlite:///{os.path.abspath(sys.argv[1])}")
+    else:
+        scratch = tempfile.mkdtemp()
+        engine = create_engine(f"sqlite:///{os.path.join(scratch, 'plans.db')}")
+        sync_schema(engine)
+
+    failed = 0
+    for name, plan, scans in check_query_plans(engine):
+        if scans:
+            failed += 1
+            print(f"✗ {name}: full scan of {', '.join(scans)}")
+        else:
+            print(f"✓ {name}")
+        for line in plan:
+            print(f"    {line}")
+
+    if failed:
+        print(f"✗ {failed} hot queries scan a whole table")
+        return 1
+    print("✓ No hot query scans a whole table")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
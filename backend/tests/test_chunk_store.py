@@ -0,0 +1,27 @@
+import os
+import pytest
+from core import chunk_store
+
+
+def _cut_points(data: bytes) -> list:
+    points = []
+    view = memoryview(data)
+    while len(view):
+        cut = chunk_store._cut_point(view)
+        points.append(cut)
+        view = view[cut:]
+    return points
+
+
+@pytest.mark.parametrize("data", [
+    os.urandom(3 * 1024 * 1024),
+    bytes(2 * 1024 * 1024),
+    b"".join(b"line %d of a log file\n" % i for i in range(150000)),
+    os.urandom(chunk_store.MIN_CHUNK + 10)
+])
+def test_vectorised_cut_points_match_byte_loop(data, monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    monkeypatch.setattr(chunk_store, "numpy", numpy)
+    vectorised = _cut_points(data)
+    monkeypatch.setattr(chunk_store, "numpy", None)
+    assert vectorised == _cut_points(data)
@@ -0,0 +1,51 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from core import log_store
+from core.database import LogEntry, LogTemplate, sync_schema
+
+
+@pytest.fixture(params=[True, False], ids=["fts", "like"])
+def db(request, tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'logs.db'}")
+    sync_schema(engine)
+    monkeypatch.setattr(log_store, "_fts_available", None if request.param else False)
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        session.add(LogTemplate(id=1, pattern_id=1, source="sshd", template="Failed password for <*> from <*>"))
+        session.add_all([
+            LogEntry(timestamp=now, level="WARNING", source="sshd", template_id=1, params=["root", "10.0.0.1"]),
+            LogEntry(timestamp=now, level="WARNING", source="sshd", message="Failed password for admin from 10.0.0.2"),
+            LogEntry(timestamp=now, level="INFO", source="app", message="serverless_handler at 100% load"),
+        ])
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def _messages(db: Session, query: str) -> list:
+    return sorted(entry["message"] for entry in log_store.search_logs(db, query=query)["entries"])
+
+
+def test_templated_and_raw_rows_match_alike(db):
+    assert _messages(db, "failed password") == [
+        "Failed password for admin from 10.0.0.2",
+        "Failed password for root from 10.0.0.1"
+    ]
+    assert _messages(db, "fail*") == _messages(db, "failed")
+    assert _messages(db, "root") == ["Failed password for root from 10.0.0.1"]
+
+
+def test_whole_words_with_the_index(db):
+    if not log_store.full_text_available(db):
+        pytest.skip("substring matching without the full-text index")
+    assert _messages(db, "fail") == []
+
+
+def test_like_wildcards_are_literal(db):
+    if log_store.full_text_available(db):
+        pytest.skip("no LIKE patterns with the full-text index")
+    assert _messages(db, "100%") == ["serverless_handler at 100% load"]
+    assert _messages(db, "r_ot") == []
+    assert _messages(db, "%") == ["serverless_handler at 100% load"]
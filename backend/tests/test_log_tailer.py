@@ -0,0 +1,36 @@
+from core.log_tailer import LogTailer, SubscriberFilter, _Follower
+
+
+def _entry(priority: int) -> dict:
+    return {"priority": priority, "identifier": "app", "message": "m"}
+
+
+def test_sampling_keeps_entries_subscribers_filter_for():
+    tailer = LogTailer(reader=None, websocket_manager=None, max_rate=10)
+    follower = _Follower("app.service")
+    follower.subscribers["all"] = SubscriberFilter({})
+    follower.subscribers["warnings"] = SubscriberFilter({"priority": "warning"})
+    follower.update_keep_priority()
+    # A noisy unit: heavy sampling, rate cap already reached
+    follower.sample_every = 1000
+    follower.window_passed = tailer.max_rate
+
+    for priority in (6, 4, 3, 6, 2):
+        tailer._admit(follower, _entry(priority))
+
+    assert [entry["priority"] for entry in follower.pending] == [4, 3, 2]
+    assert follower.dropped == 2
+
+
+def test_errors_are_kept_without_priority_filters():
+    tailer = LogTailer(reader=None, websocket_manager=None, max_rate=10)
+    follower = _Follower(None)
+    follower.subscribers["all"] = SubscriberFilter({})
+    follower.update_keep_priority()
+    follower.sample_every = 1000
+    follower.window_passed = tailer.max_rate
+
+    for priority in (4, 3, 7):
+        tailer._admit(follower, _entry(priority))
+
+    assert [entry["priority"] for entry in follower.pending] == [3]
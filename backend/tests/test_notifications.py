@@ -0,0 +1,208 @@
+import json
+import socket
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from core.database import NotificationQueue, sync_schema
+from core.notifications import NotificationDispatcher
+
+ALERT = {"id": 1, "name": "cpu high", "severity": "critical", "message": "CPU above 90%"}
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'notifications.db'}")
+    sync_schema(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+class Webhook:
+    """Records posted bodies; answers with the queued status codes, then 200"""
+
+    def __init__(self, *statuses: int):
+        self.statuses = list(statuses)
+        self.bodies = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.bodies.append(json.loads(request.content))
+        return httpx.Response(self.statuses.pop(0) if self.statuses else 200)
+
+
+def _dispatcher(session_factory, webhook: Webhook, **kwargs) -> NotificationDispatcher:
+    kwargs.setdefault("digest_window", 0.2)
+    kwargs.setdefault("max_retries", 3)
+    kwargs.setdefault("retry_interval", 60)
+    dispatcher = NotificationDispatcher(
+        session_factory=session_factory,
+        transport=httpx.MockTransport(webhook),
+        **kwargs
+    )
+    dispatcher.configure("webhook", {"enabled": True, "settings": {"url": "http://hooks.test/alerts"}})
+    return dispatcher
+
+
+def _queue(session_factory) -> list:
+    db = session_factory()
+    try:
+        return db.query(NotificationQueue).order_by(NotificationQueue.id).all()
+    finally:
+        db.close()
+
+
+def test_digest_window_coalesces_notifications(session_factory):
+    webhook = Webhook()
+    dispatcher = _dispatcher(session_factory, webhook)
+
+    async def run():
+        await dispatcher.start()
+        dispatcher.notify("webhook", ALERT, "triggered")
+        await asyncio.sleep(0.05)
+        dispatcher.notify("webhook", {**ALERT, "id": 2, "name": "disk full"}, "triggered")
+        dispatcher.notify("webhook", ALERT, "resolved")
+        await asyncio.sleep(0.05)
+        assert len(webhook.bodies) == 1
+        await asyncio.sleep(0.3)
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    first, digest = webhook.bodies
+    assert first["subject"] == "[CRITICAL] Alert triggered: cpu high"
+    assert digest["subject"] == "2 alert notifications"
+    assert [alert["status"] for alert in digest["alerts"]] == ["triggered", "resolved"]
+    assert dispatcher.stats["digests"] == 1
+
+
+def test_failed_delivery_is_queued_with_backoff(session_factory):
+    webhook = Webhook(500)
+    dispatcher = _dispatcher(session_factory, webhook)
+
+    async def run():
+        await dispatcher.start()
+        dispatcher.notify("webhook", ALERT, "triggered")
+        await dispatcher.stop()
+
+    before = datetime.utcnow()
+    asyncio.run(run())
+
+    row, = _queue(session_factory)
+    assert row.channel == "webhook"
+    assert row.attempts == 1
+    assert "500" in row.last_error
+    assert before + timedelta(seconds=59) <= row.next_attempt_at <= datetime.utcnow() + timedelta(seconds=60)
+
+
+def test_claimed_rows_are_leased(session_factory):
+    dispatcher = _dispatcher(session_factory, Webhook())
+    dispatcher._enqueue_retry("webhook", {"subject": "s", "text": "t", "alerts": []}, "timeout")
+    db = session_factory()
+    db.query(NotificationQueue).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    db.close()
+
+    claimed = dispatcher._claim_due(10)
+    assert [(channel, attempts) for _, channel, _, attempts in claimed] == [("webhook", 1)]
+    # Another worker polling meanwhile finds nothing due
+    assert dispatcher._claim_due(10) == []
+    assert _queue(session_factory)[0].next_attempt_at > datetime.utcnow()
+
+
+def test_retries_back_off_then_give_up(session_factory):
+    webhook = Webhook(503, 503)
+    dispatcher = _dispatcher(session_factory, webhook, max_retries=3)
+    dispatcher._enqueue_retry("webhook", {"subject": "s", "text": "t", "alerts": []}, "timeout")
+
+    def make_due():
+        db = session_factory()
+        db.query(NotificationQueue).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        db.close()
+
+    async def run():
+        await dispatcher.start()
+        make_due()
+        await dispatcher._retry_due()
+        row, = _queue(session_factory)
+        assert row.attempts == 2
+        # Backoff doubles: retry_interval * 2 ** (attempts - 1)
+        assert row.next_attempt_at >= datetime.utcnow() + timedelta(seconds=119)
+        make_due()
+        await dispatcher._retry_due()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert len(webhook.bodies) == 2
+    assert _queue(session_factory) == []
+    assert dispatcher.stats["dropped"] == 1
+
+
+def test_retry_succeeds_and_clears_queue(session_factory):
+    webhook = Webhook()
+    dispatcher = _dispatcher(session_factory, webhook)
+    dispatcher._enqueue_retry("webhook", {"subject": "s", "text": "t", "alerts": []}, "timeout")
+    db = session_factory()
+    db.query(NotificationQueue).update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.commit()
+    db.close()
+
+    async def run():
+        await dispatcher.start()
+        await dispatcher._retry_due()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+
+    assert webhook.bodies == [{"subject": "s", "text": "t", "alerts": []}]
+    assert _queue(session_factory) == []
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_email_delivery_over_smtp(session_factory):
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    from aiosmtpd.handlers import Sink
+
+    class Inbox(Sink):
+        def __init__(self):
+            self.messages = []
+
+        async def handle_DATA(self, server, session, envelope):
+            self.messages.append(envelope)
+            return "250 OK"
+
+    inbox = Inbox()
+    port = _free_port()
+    controller = controller_module.Controller(inbox, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        dispatcher = NotificationDispatcher(digest_window=0.2, session_factory=session_factory)
+        dispatcher.configure("email", {"enabled": True, "settings": {
+            "host": "127.0.0.1", "port": port, "user": "", "tls": False,
+            "from": "umc@example.com", "to": ["ops@example.com"]
+        }})
+
+        async def run():
+            await dispatcher.start()
+            dispatcher.notify("email", ALERT, "triggered")
+            dispatcher.notify("email", ALERT, "resolved")
+            await asyncio.sleep(0.4)
+            await dispatcher.stop()
+
+        asyncio.run(run())
+    finally:
+        controller.stop()
+
+    assert [envelope.rcpt_tos for envelope in inbox.messages] == [["ops@example.com"]] * 2
+    first, digest = (envelope.content.decode() for envelope in inbox.messages)
+    assert "Subject: [CRITICAL] Alert triggered: cpu high" in first
+    assert "resolved" in digest
+    assert _queue(session_factory) == []
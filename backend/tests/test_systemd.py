@@ -0,0 +1,166 @@
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from core.commands import get_command_runner
+from core.journal import get_journal_reader
+from core.monitoring_service import get_monitoring_service
+from core.security import get_current_user
+from core.systemd import MANAGER_INTERFACE, FakeBus, ServiceRegistry, get_service_registry
+from routers import services
+
+
+class Broadcasts:
+    """Collects what the registry publishes on the services channel"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def broadcast(self, message: dict, channel: str = None):
+        self.messages.append((channel, message))
+
+
+def _bus() -> FakeBus:
+    return FakeBus(
+        units={
+            "nginx.service": {"Description": "Web server", "ActiveState": "active", "SubState": "running"},
+            "cron.service": {"Description": "Cron", "ActiveState": "active", "SubState": "running"},
+            "tmp.mount": {"Description": "Temporary Directory"}
+        },
+        service_properties={"nginx.service": {"MainPID": 42}}
+    )
+
+
+async def _started(bus: FakeBus, broadcasts: Broadcasts = None) -> ServiceRegistry:
+    registry = ServiceRegistry(bus=bus, websocket_manager=broadcasts)
+    await registry.start()
+    for _ in range(100):
+        if registry.available:
+            break
+        await asyncio.sleep(0.01)
+    assert registry.available
+    return registry
+
+
+async def _settle():
+    # Let refresh and broadcast tasks scheduled by a signal run
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_list_units_loads_services_only():
+    async def run():
+        registry = await _started(_bus())
+        listed = registry.list_services()
+        await registry.stop()
+        return listed
+
+    listed = asyncio.run(run())
+
+    assert [unit["full_name"] for unit in listed] == ["cron.service", "nginx.service"]
+    assert listed[1] == {
+        "name": "nginx",
+        "full_name": "nginx.service",
+        "load_state": "loaded",
+        "active_state": "active",
+        "sub_state": "running",
+        "description": "Web server"
+    }
+
+
+def test_properties_changed_updates_table_and_broadcasts():
+    bus, broadcasts = _bus(), Broadcasts()
+
+    async def run():
+        registry = await _started(bus, broadcasts)
+        bus.set_state("nginx.service", ActiveState="failed", SubState="failed", MainPID=0)
+        # Signals for units outside the table are ignored
+        bus.set_state("tmp.mount", ActiveState="active")
+        await _settle()
+        await registry.stop()
+        return registry
+
+    registry = asyncio.run(run())
+
+    assert registry.units["nginx.service"]["active_state"] == "failed"
+    assert registry.units["nginx.service"]["sub_state"] == "failed"
+    assert "tmp.mount" not in registry.units
+    (channel, message), = broadcasts.messages
+    assert channel == "services"
+    assert message["type"] == "service_update"
+    assert message["data"]["full_name"] == "nginx.service"
+    assert message["data"]["active_state"] == "failed"
+
+
+def test_unit_new_and_job_removed_refresh_from_bus():
+    bus, broadcasts = _bus(), Broadcasts()
+
+    async def run():
+        registry = await _started(bus, broadcasts)
+        bus.units["redis.service"] = {"Description": "Redis", "ActiveState": "activating", "SubState": "start"}
+        bus.emit("/org/freedesktop/systemd1", MANAGER_INTERFACE, "UnitNew",
+                 ["redis.service", FakeBus.unit_path("redis.service")])
+        await _settle()
+        assert registry.units["redis.service"]["active_state"] == "activating"
+
+        # JobRemoved carries no path, so the registry resolves it with GetUnit
+        bus.units["redis.service"].update(ActiveState="active", SubState="running")
+        bus.emit("/org/freedesktop/systemd1", MANAGER_INTERFACE, "JobRemoved",
+                 [7, "/org/freedesktop/systemd1/job/7", "redis.service", "done"])
+        await _settle()
+        await registry.stop()
+        return registry
+
+    registry = asyncio.run(run())
+
+    assert registry.units["redis.service"]["active_state"] == "active"
+    assert registry.units["redis.service"]["sub_state"] == "running"
+    assert ("GetUnit", ["redis.service"]) in bus.calls
+    assert [message["data"]["active_state"] for _, message in broadcasts.messages] == ["activating", "active"]
+
+
+def test_unit_removed_drops_unit():
+    bus, broadcasts = _bus(), Broadcasts()
+
+    async def run():
+        registry = await _started(bus, broadcasts)
+        path = FakeBus.unit_path("cron.service")
+        bus.emit("/org/freedesktop/systemd1", MANAGER_INTERFACE, "UnitRemoved", ["cron.service", path])
+        await _settle()
+        await registry.stop()
+        return registry, path
+
+    registry, path = asyncio.run(run())
+
+    assert [unit["full_name"] for unit in registry.list_services()] == ["nginx.service"]
+    assert path not in registry.paths
+    (_, message), = broadcasts.messages
+    assert message["data"]["full_name"] == "cron.service"
+    assert message["data"]["removed"] is True
+
+
+def _client(registry: ServiceRegistry) -> TestClient:
+    app = FastAPI()
+    app.include_router(services.router, prefix="/api/services")
+    app.dependency_overrides[get_service_registry] = lambda: registry
+    app.dependency_overrides[get_current_user] = lambda: None
+    app.dependency_overrides[get_command_runner] = lambda: None
+    app.dependency_overrides[get_monitoring_service] = lambda: None
+    app.dependency_overrides[get_journal_reader] = lambda: None
+    return TestClient(app)
+
+
+def test_load_unit_not_found_returns_404():
+    bus = _bus()
+    bus.units["ghost.service"] = {"LoadState": "not-found"}
+    registry = ServiceRegistry(bus=bus)
+    registry.available = True
+
+    assert asyncio.run(registry.get_properties("nginx"))["MainPID"] == 42
+
+    client = _client(registry)
+    # LoadUnit fails outright, and LoadUnit succeeds for a unit file that does not exist
+    for name in ("missing", "ghost"):
+        response = client.get(f"/api/services/{name}")
+        assert response.status_code == 404
+        assert response.json()["detail"] == f"Service {name} not found"
+    assert ("LoadUnit", ["ghost.service"]) in bus.calls
@@ -0,0 +1,92 @@
+import os
+import time
+from core.timeseries import TimeSeriesStore
+
+
+def test_select_tier_prefers_coarsest_tier_within_step():
+    store = TimeSeriesStore(["cpu"], retention_days=30)
+    now = time.time()
+    assert store.select_tier(0, now - 600, now) == "raw"
+    assert store.select_tier(90, now - 600, now) == "1m"
+    assert store.select_tier(7200, now - 600, now) == "1h"
+
+
+def test_select_tier_skips_tiers_expired_at_start():
+    store = TimeSeriesStore(["cpu"], retention_days=30)
+    now = time.time()
+    # raw keeps a day and 1m a week
+    assert store.select_tier(30, now - 3 * 86400, now) == "1m"
+    assert store.select_tier(30, now - 10 * 86400, now) == "5m"
+    assert store.select_tier(30, now - 60 * 86400, now) == "1d"
+
+
+def test_query_old_narrow_window_reads_rollups():
+    store = TimeSeriesStore(["cpu"], retention_days=30, segment_size=10)
+    now = time.time()
+    start = now - 3 * 86400
+    start -= start % 300
+    for i in range(60):
+        store.ingest(start + i * 10, {"cpu": float(i)})
+    store.ingest(now, {"cpu": 0.0})
+    # Past raw retention; only the rollup tiers still hold this window
+    store.flush()
+    assert not list(store.series[("raw", "cpu")].rows(start, start + 600))
+
+    points = store.query("cpu", start, start + 600, max_points=100)
+
+    assert points
+    assert points[0]["timestamp"] == start
+    assert sum(point["count"] for point in points) == 60
+    assert max(point["max"] for point in points) == 59.0
+
+
+def test_expired_series_are_evicted_and_free_their_slot(tmp_path):
+    store = TimeSeriesStore([], retention_days=30, data_dir=str(tmp_path), max_metrics=2)
+    now = time.time()
+    store.ingest(now - 40 * 86400, {"old": 1.0})
+    store.ingest(now, {"live": 1.0})
+    store.ingest(now, {"new": 1.0})
+    assert store.query("new", now - 60, now + 60) == []
+
+    store.flush()
+
+    assert store.metrics == ["live"]
+    assert not (tmp_path / "raw" / "old").exists()
+    store.ingest(now + 1, {"new": 2.0})
+    assert store.latest("new") == (now + 1, 2.0)
+    store.close()
+
+
+def test_reload_prefers_recently_written_series(tmp_path):
+    now = time.time()
+    store = TimeSeriesStore([], retention_days=30, data_dir=str(tmp_path), max_metrics=3)
+    for metric in ("a", "b", "c"):
+        store.ingest(now, {metric: 1.0})
+    store.close()
+    stale = now - 40 * 86400
+    os.utime(tmp_path / "raw" / "a", (stale, stale))
+
+    reloaded = TimeSeriesStore([], retention_days=30, data_dir=str(tmp_path), max_metrics=2)
+
+    assert sorted(reloaded.metrics) == ["b", "c"]
+    assert not (tmp_path / "raw" / "a").exists()
+    reloaded.close()
+
+
+def test_sealed_segments_are_written_on_flush_not_ingest(tmp_path):
+    store = TimeSeriesStore(["cpu"], retention_days=1, data_dir=str(tmp_path), segment_size=4)
+    now = time.time()
+    for i in range(6):
+        store.ingest(now - 6 + i, {"cpu": float(i)})
+    raw_dir = tmp_path / "raw" / "cpu"
+    assert not raw_dir.exists() or os.listdir(raw_dir) == []
+
+    store.flush()
+
+    sealed = [name for name in os.listdir(raw_dir) if name != "open.seg"]
+    assert len(sealed) == 1
+    store.close()
+
+    reloaded = TimeSeriesStore(["cpu"], retention_days=1, data_dir=str(tmp_path), segment_size=4)
+    assert [row[1] for row in reloaded.series[("raw", "cpu")].rows(0, now)] == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+    reloaded.close()
@@ -0,0 +1,47 @@
+from core.database import LogEntry
+from core.write_buffer import WriteBehindBuffer
+
+
+class _Session:
+    """Session stand-in recording committed rows, failing while fail is set"""
+
+    def __init__(self, store: dict):
+        self.store = store
+
+    def bulk_insert_mappings(self, model, rows):
+        self.rows = rows
+
+    def commit(self):
+        if self.store["fail"]:
+            raise RuntimeError("database is locked")
+        self.store["rows"].extend(self.rows)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _buffer(store: dict) -> WriteBehindBuffer:
+    return WriteBehindBuffer(session_factory=lambda: _Session(store), max_retries=1)
+
+
+def test_flush_reports_dropped_rows():
+    store = {"fail": False, "rows": []}
+    buffer = _buffer(store)
+    buffer.add(LogEntry, {"message": "a"})
+    assert buffer.flush()
+    committed = buffer.enqueued_seq
+
+    store["fail"] = True
+    buffer.add(LogEntry, {"message": "b"})
+    assert not buffer.flush(since=committed)
+    assert buffer.stats["rows_dropped"] == 1
+
+    # Rows committed later do not hide the earlier loss
+    store["fail"] = False
+    buffer.add(LogEntry, {"message": "c"})
+    assert not buffer.flush(since=committed)
+    assert buffer.flush(since=buffer.enqueued_seq)
+    assert [row["message"] for row in store["rows"]] == ["a", "c"]